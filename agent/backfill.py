@@ -0,0 +1,218 @@
+"""
+Re-validate stored invoices after a rule change, without the LLM.
+
+    python agent/backfill.py --dry-run --diff-file diff.jsonl   # report what would change
+    python agent/backfill.py                                     # write changed flagged/visited values
+    python agent/backfill.py --resume                            # continue after an interrupted run
+
+Rows are read from extracted_information in pages ordered by file_id (keyset
+pagination, so every page costs the same however deep into the table it is),
+validated with agent.validation_helper.validate_invoice, and only rows whose
+flagged/visited values change are written back, as bulk UPDATEs grouped by
+the new values.
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from agent.validation_helper import VALIDATION_COLUMNS, validate_invoice
+from agent.invoice_index import get_invoice_index, to_timestamp
+from helper.clients import get_supabase
+from helper.write_behind import WriteBehindBuffer
+from helper import metrics
+
+load_dotenv()
+
+TABLE = "extracted_information"
+BACKFILL_PAGE_SIZE = int(os.getenv("BACKFILL_PAGE_SIZE", "1000"))
+BACKFILL_CHECKPOINT_PATH = os.getenv("BACKFILL_CHECKPOINT_PATH", os.path.join(".cache", "backfill_checkpoint.json"))
+
+COLUMNS = list(dict.fromkeys(VALIDATION_COLUMNS + ["file_id", "flagged", "visited", "created_at"]))
+
+
+def fetch_page(client, after, page_size):
+    """One page of rows with file_id greater than `after`"""
+    columns = ",".join(f'"{c}"' if " " in c else c for c in COLUMNS)
+    query = client.table(TABLE).select(columns)
+    if after is not None:
+        query = query.gt("file_id", after)
+    with metrics.span("backfill.fetch", rows=page_size):
+        return query.order("file_id").limit(page_size).execute().data
+
+
+def iter_pages(client, after=None, page_size=BACKFILL_PAGE_SIZE):
+    """Yield pages in file_id order, fetching the next page while the caller works on the current one"""
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="backfill-fetch") as executor:
+        pending = executor.submit(fetch_page, client, after, page_size)
+        while True:
+            rows = pending.result()
+            if not rows:
+                return
+            if len(rows) == page_size:
+                pending = executor.submit(fetch_page, client, rows[-1]["file_id"], page_size)
+            yield rows
+            if len(rows) < page_size:
+                return
+
+
+def revalidate(row, index=None):
+    """Return (is_valid, reason) for a stored row; history checks only see invoices that arrived before it"""
+    as_of = to_timestamp(row.get("created_at")) if index is not None else None
+    try:
+        return validate_invoice(row, index=index, as_of=as_of)
+    except Exception as e:
+        return None, f"Error during validation: {str(e)}"
+
+
+def load_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_checkpoint(path, checkpoint):
+    if not path:
+        return
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def run_backfill(client, dry_run=False, use_history=True, page_size=BACKFILL_PAGE_SIZE,
+                 checkpoint_path=BACKFILL_CHECKPOINT_PATH, resume=False, diff_file=None, show=20, limit=None):
+    """
+    Re-validate every row and write back the ones whose flagged/visited values change.
+
+    One page of rows is held at a time, the diff goes to `diff_file` as it is
+    produced, and only counters are kept. With `use_history` the invoice index
+    is loaded first, which holds every stored invoice and its deletion variants,
+    so memory then grows with the table; `use_history=False` keeps it flat.
+    The checkpoint (last file_id plus counters) is saved after each page's
+    writes are flushed, so `resume` continues exactly where a run stopped.
+    """
+    checkpoint = load_checkpoint(checkpoint_path) if resume else None
+    if checkpoint and checkpoint.get("dry_run") != dry_run:
+        raise ValueError(f"Checkpoint {checkpoint_path} is from a {'dry' if checkpoint['dry_run'] else 'write'} run; "
+                         f"rerun with the same mode or without --resume")
+    checkpoint = checkpoint or {
+        "after": None, "dry_run": dry_run, "scanned": 0, "unchanged": 0,
+        "flagged": 0, "cleared": 0, "undecided": 0, "written": 0, "failed": 0,
+    }
+    if checkpoint["after"]:
+        print(f"[Backfill] Resuming after file_id={checkpoint['after']} ({checkpoint['scanned']} rows already checked)")
+
+    index = None
+    if use_history:
+        index = get_invoice_index(client)
+        print(f"[Backfill] History checks against {len(index)} indexed invoices")
+
+    buffer = None if dry_run else WriteBehindBuffer(client, TABLE, max_rows=page_size)
+
+    def on_written(table, file_id, ok, error):
+        # Called while the buffer flushes, one flush at a time
+        checkpoint["written" if ok else "failed"] += 1
+        if not ok:
+            print(f"[Backfill] Could not update {file_id}: {error}")
+
+    diff = open(diff_file, "a" if resume else "w", encoding="utf-8") if diff_file else None
+    shown = 0
+    started = time.perf_counter()
+    scanned_this_run = 0
+    try:
+        for rows in iter_pages(client, checkpoint["after"], page_size):
+            with metrics.span("backfill.page", rows=len(rows)):
+                for row in rows:
+                    is_valid, reason = revalidate(row, index)
+                    checkpoint["scanned"] += 1
+                    scanned_this_run += 1
+                    if is_valid is None:
+                        # Leave undecided rows as they are rather than guessing
+                        checkpoint["undecided"] += 1
+                        continue
+                    flagged = not is_valid
+                    if row.get("flagged") == flagged and row.get("visited") is True:
+                        checkpoint["unchanged"] += 1
+                        continue
+                    checkpoint["flagged" if flagged else "cleared"] += 1
+                    change = {
+                        "file_id": row["file_id"],
+                        "flagged": [row.get("flagged"), flagged],
+                        "visited": [row.get("visited"), True],
+                        "reason": reason,
+                    }
+                    if diff:
+                        diff.write(json.dumps(change) + "\n")
+                    if shown < show:
+                        print(f"  {row['file_id']}: flagged {row.get('flagged')} -> {flagged} ({reason})")
+                        shown += 1
+                    if buffer:
+                        # An UPDATE, never an upsert: a row deleted since it was read must not come back
+                        buffer.add({"file_id": row["file_id"], "flagged": flagged, "visited": True}, on_written,
+                                   update=True)
+                if buffer:
+                    buffer.flush()
+            checkpoint["after"] = rows[-1]["file_id"]
+            save_checkpoint(checkpoint_path, checkpoint)
+            elapsed = time.perf_counter() - started
+            print(f"[Backfill] {checkpoint['scanned']} rows checked, "
+                  f"{checkpoint['flagged'] + checkpoint['cleared']} changed "
+                  f"({scanned_this_run / elapsed if elapsed else 0:.0f} rows/s)")
+            if limit and scanned_this_run >= limit:
+                print(f"[Backfill] Stopping after {scanned_this_run} rows (--limit); rerun with --resume to continue")
+                break
+    finally:
+        if buffer:
+            buffer.close()
+        if diff:
+            diff.close()
+
+    verb = "would change" if dry_run else "changed"
+    print(f"[Backfill] Done: {checkpoint['scanned']} rows checked, {checkpoint['unchanged']} unchanged, "
+          f"{verb} {checkpoint['flagged']} to flagged and {checkpoint['cleared']} to valid, "
+          f"{checkpoint['undecided']} undecided"
+          + ("" if dry_run else f", {checkpoint['written']} written, {checkpoint['failed']} failed"))
+    return checkpoint
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Re-validate stored invoices and update flagged/visited in bulk.")
+    parser.add_argument("--dry-run", action="store_true", help="Report changes without writing them.")
+    parser.add_argument("--diff-file", help="Write every change as a JSON line to this file.")
+    parser.add_argument("--show", type=int, default=20, help="Changes to print (default: 20).")
+    parser.add_argument("--page-size", type=int, default=BACKFILL_PAGE_SIZE)
+    parser.add_argument("--limit", type=int, help="Stop after checking this many rows.")
+    parser.add_argument("--no-history", action="store_true",
+                        help="Skip the duplicate, frequency and similarity checks (no invoice index).")
+    parser.add_argument("--checkpoint", default=BACKFILL_CHECKPOINT_PATH,
+                        help=f"Checkpoint file (default: {BACKFILL_CHECKPOINT_PATH}).")
+    parser.add_argument("--resume", action="store_true", help="Continue after the file_id in the checkpoint.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    run_backfill(
+        get_supabase(),
+        dry_run=args.dry_run,
+        use_history=not args.no_history,
+        page_size=args.page_size,
+        checkpoint_path=args.checkpoint,
+        resume=args.resume,
+        diff_file=args.diff_file,
+        show=args.show,
+        limit=args.limit,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+import bisect
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+load_dotenv()
+
+INDEX_PATH = os.getenv("INVOICE_INDEX_PATH", os.path.join(".cache", "invoice_index.jsonl"))
+INDEX_SYNC_INTERVAL = float(os.getenv("INVOICE_INDEX_SYNC_INTERVAL", "30"))
+
+# Columns needed for the duplicate, frequency and similarity checks
+INDEX_COLUMNS = ["file_id", "Invoice Number", "Company Name", "GSTIN", "Total Amount", "Invoice Date", "created_at"]
+# Fields that must all match for a fuzzy-similar invoice number to count as a resubmission
+SIMILARITY_FIELDS = ["Company Name", "GSTIN", "Total Amount", "Invoice Date"]
+# The append-only index log is rewritten once it holds this many lines more than there are records
+INDEX_COMPACT_SLACK = 10000
+
+
+def normalize_number(value):
+    """Invoice numbers are compared case-insensitively, ignoring surrounding whitespace"""
+    return str(value).strip().upper() if value not in (None, "", "null") else None
+
+
+def normalize_company(value):
+    return " ".join(str(value).lower().split()) if value not in (None, "", "null") else None
+
+
+def normalize_amount(value):
+    """Amounts compare as numbers, so 1180.0, "1180" and "1,180.00" are the same total"""
+    if value in (None, "", "null"):
+        return None
+    try:
+        return round(float(str(value).replace(",", "")), 2)
+    except ValueError:
+        return normalize_company(value)
+
+
+def similarity_key(record):
+    """The SIMILARITY_FIELDS of a record in comparable form"""
+    return [normalize_amount(record.get(field)) if field == "Total Amount" else normalize_company(record.get(field))
+            for field in SIMILARITY_FIELDS]
+
+
+def fuzzy_key(number):
+    """Alphanumeric-only form used for fuzzy matching"""
+    return re.sub(r"[^0-9A-Z]", "", number)
+
+
+def deletion_variants(key):
+    """The key plus every string obtained by deleting one character from it"""
+    return {key} | {key[:i] + key[i + 1:] for i in range(len(key))}
+
+
+def within_one_edit(a, b):
+    """True if a and b differ by at most one insertion, deletion or substitution (linear time)"""
+    if len(a) > len(b):
+        a, b = b, a
+    if len(b) - len(a) > 1:
+        return False
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return a[i + 1:] == b[i + 1:]
+    return a[i:] == b[i + 1:]
+
+
+def levenshtein(a, b, limit):
+    """Edit distance between a and b, or limit + 1 as soon as it is known to exceed limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if limit == 1:
+        # The default similarity check; sequential invoice numbers make this the hot path
+        return 0 if a == b else 1 if within_one_edit(a, b) else 2
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1):
+        current = [i]
+        for j, cb in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def to_timestamp(value):
+    if value is None:
+        return time.time()
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return time.time()
+
+
+class InvoiceIndex:
+    """
+    Local, incrementally synced index over extracted_information.
+
+    Keeps an exact map from invoice number to file IDs, a time-ordered arrival
+    list per company and a symmetric-deletion index over invoice numbers: two
+    numbers one edit apart always share a single-deletion variant, so fuzzy
+    lookups are a handful of dict probes instead of a scan.
+    Only rows newer than the last sync cursor are fetched, so lookups and syncs
+    do not grow with the size of the table. Fetched rows are appended to a JSON
+    Lines log at `path`, which is rewritten only when stale lines pile up.
+    """
+
+    def __init__(self, client=None, path=INDEX_PATH):
+        self.client = client
+        self.path = path
+        self.records = {}
+        self.by_number = {}
+        self.by_company = {}
+        self.by_fuzzy = {}
+        self.by_variant = {}
+        self.cursor = None
+        self.last_sync = 0.0
+        self._log_lines = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, file_id):
+        return file_id in self.records
+
+    def add(self, row):
+        """Insert or replace one invoice row"""
+        file_id = row.get("file_id")
+        if not file_id:
+            return
+        record = {field: row.get(field) for field in INDEX_COLUMNS if field != "created_at"}
+        record["ts"] = to_timestamp(row.get("created_at") or row.get("ts"))
+        with self._lock:
+            if file_id in self.records:
+                self._unlink(file_id)
+            self.records[file_id] = record
+
+            number = normalize_number(record["Invoice Number"])
+            if number:
+                self.by_number.setdefault(number, set()).add(file_id)
+                key = fuzzy_key(number)
+                if key not in self.by_fuzzy:
+                    for variant in deletion_variants(key):
+                        self.by_variant.setdefault(variant, set()).add(key)
+                self.by_fuzzy.setdefault(key, set()).add(number)
+
+            company = normalize_company(record["Company Name"])
+            if company:
+                bisect.insort(self.by_company.setdefault(company, []), (record["ts"], file_id))
+
+    def _unlink(self, file_id):
+        record = self.records.pop(file_id)
+        number = normalize_number(record["Invoice Number"])
+        if number and number in self.by_number:
+            self.by_number[number].discard(file_id)
+            if not self.by_number[number]:
+                del self.by_number[number]
+                # Other spellings may share the fuzzy key, so only drop it when none remain
+                key = fuzzy_key(number)
+                spellings = self.by_fuzzy.get(key, set())
+                spellings.discard(number)
+                if not spellings:
+                    self.by_fuzzy.pop(key, None)
+                    for variant in deletion_variants(key):
+                        keys = self.by_variant.get(variant)
+                        if keys is not None:
+                            keys.discard(key)
+                            if not keys:
+                                del self.by_variant[variant]
+        company = normalize_company(record["Company Name"])
+        arrivals = self.by_company.get(company)
+        if arrivals:
+            entry = (record["ts"], file_id)
+            position = bisect.bisect_left(arrivals, entry)
+            if position < len(arrivals) and arrivals[position] == entry:
+                arrivals.pop(position)
+
+    def _arrived_before(self, file_id, before):
+        return before is None or self.records[file_id]["ts"] < before
+
+    def find_duplicates(self, invoice_number, exclude_file_id=None, before=None):
+        """File IDs of other invoices with exactly the same invoice number (that arrived before `before`)"""
+        number = normalize_number(invoice_number)
+        if not number:
+            return []
+        with self._lock:
+            return sorted(
+                file_id for file_id in self.by_number.get(number, set()) - {exclude_file_id}
+                if self._arrived_before(file_id, before)
+            )
+
+    def company_arrivals(self, company_name, since, until=None, exclude_file_id=None):
+        """File IDs of invoices from the company that arrived within [since, until]"""
+        company = normalize_company(company_name)
+        with self._lock:
+            arrivals = self.by_company.get(company, [])
+            start = bisect.bisect_left(arrivals, (since, ""))
+            end = len(arrivals) if until is None else bisect.bisect_right(arrivals, (until, "￿"))
+            return [file_id for _, file_id in arrivals[start:end] if file_id != exclude_file_id]
+
+    def similar_numbers(self, invoice_number, max_distance=1):
+        """Invoice numbers within `max_distance` edits of the given one (excluding exact matches)"""
+        number = normalize_number(invoice_number)
+        if not number:
+            return []
+        key = fuzzy_key(number)
+        with self._lock:
+            candidates = set()
+            for variant in deletion_variants(key):
+                candidates |= self.by_variant.get(variant, set())
+            similar = []
+            for candidate in candidates:
+                if levenshtein(key, candidate, max_distance) <= max_distance:
+                    similar.extend(n for n in self.by_fuzzy.get(candidate, ()) if n != number)
+            return sorted(similar)
+
+    def find_similar_invoices(self, invoice_data, exclude_file_id=None, before=None):
+        """File IDs with a fuzzy-similar invoice number whose other key fields all match"""
+        wanted = similarity_key(invoice_data)
+        similar = []
+        with self._lock:
+            for number in self.similar_numbers(invoice_data.get("Invoice Number")):
+                for file_id in self.by_number.get(number, ()):
+                    if file_id == exclude_file_id or not self._arrived_before(file_id, before):
+                        continue
+                    record = self.records[file_id]
+                    if similarity_key(record) == wanted:
+                        similar.append(file_id)
+        return sorted(similar)
+
+    def sync(self, page_size=1000):
+        """
+        Fetch rows created since the last sync using keyset pagination on (created_at, file_id).
+
+        Rows without a created_at cannot be placed after the cursor, so they are skipped.
+        """
+        if self.client is None:
+            return 0
+        columns = ",".join(f'"{c}"' if " " in c else c for c in INDEX_COLUMNS)
+        fetched = 0
+        with self._lock:
+            while True:
+                query = self.client.table("extracted_information").select(columns).not_.is_("created_at", "null")
+                if self.cursor:
+                    created_at, file_id = self.cursor
+                    query = query.or_(
+                        f'created_at.gt."{created_at}",and(created_at.eq."{created_at}",file_id.gt."{file_id}")'
+                    )
+                rows = query.order("created_at").order("file_id").limit(page_size).execute().data
+                for row in rows:
+                    self.add(row)
+                fetched += len(rows)
+                if rows:
+                    self.cursor = (rows[-1]["created_at"], rows[-1]["file_id"])
+                    self.append(rows)
+                if len(rows) < page_size:
+                    break
+            self.last_sync = time.monotonic()
+        return fetched
+
+    def sync_if_stale(self, max_age=INDEX_SYNC_INTERVAL):
+        if time.monotonic() - self.last_sync >= max_age:
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"[InvoiceIndex] Sync failed, using local state: {e}")
+
+    def append(self, rows):
+        """Add the rows' records and the current cursor to the log, compacting it when it has grown stale"""
+        if not self.path:
+            return
+        with self._lock:
+            if self._log_lines + len(rows) + 1 > len(self.records) + INDEX_COMPACT_SLACK:
+                self.save()
+                return
+            self._ensure_directory()
+            with open(self.path, "a", encoding="utf-8") as f:
+                for row in rows:
+                    file_id = row.get("file_id")
+                    if file_id in self.records:
+                        f.write(json.dumps({"file_id": file_id, **self.records[file_id]}) + "\n")
+                        self._log_lines += 1
+                f.write(json.dumps({"cursor": self.cursor}) + "\n")
+                self._log_lines += 1
+
+    def save(self):
+        """Rewrite the log as one line per record plus the cursor"""
+        if not self.path:
+            return
+        self._ensure_directory()
+        with self._lock:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for file_id, record in self.records.items():
+                    f.write(json.dumps({"file_id": file_id, **record}) + "\n")
+                f.write(json.dumps({"cursor": self.cursor}) + "\n")
+            os.replace(tmp_path, self.path)
+            self._log_lines = len(self.records) + 1
+
+    def _ensure_directory(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        lines = 0
+        with self._lock, open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash mid-append; the next sync fetches its rows again
+                    continue
+                lines += 1
+                if "cursor" in entry:
+                    self.cursor = tuple(entry["cursor"]) if entry["cursor"] else None
+                else:
+                    self.add(entry)
+            self._log_lines = lines
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_invoice_index(client):
+    """Return the shared index, loading the local snapshot and syncing it on first use"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = InvoiceIndex(client)
+            _index.load()
+            _index.sync_if_stale(max_age=0)
+        return _index
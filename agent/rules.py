@@ -0,0 +1,396 @@
+import json
+import os
+import re
+import threading
+import time
+from operator import itemgetter
+
+from dotenv import load_dotenv
+from ocr.pre_extractor import normalize_currency
+from helper import metrics
+load_dotenv()
+
+# Window for the company frequency check from the SOP
+FREQUENCY_WINDOW_SECONDS = 24 * 60 * 60
+VALID_CURRENCIES = frozenset(c.strip().upper() for c in os.getenv("VALID_CURRENCIES", "INR,USD,EUR").split(",") if c.strip())
+VALID_TAX_RATES = tuple(float(r) for r in os.getenv("VALID_TAX_RATES", "5,12,18").split(",") if r.strip())
+# Allowed gap, in percentage points, between a tax rate implied by the amounts and a valid rate
+IMPLIED_RATE_TOLERANCE = 0.6
+
+REQUIRED_FIELDS = ['Company Name', 'Invoice Number', 'Invoice Date', 'Total Amount', 'GSTIN', 'Customer Name']
+
+GSTIN_CHARSET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+GSTIN_RE = re.compile(r"\d{2}[A-Z]{5}\d{4}[A-Z][1-9A-Z]Z[0-9A-Z]")
+PAN_RE = re.compile(r"[A-Z]{5}\d{4}[A-Z]")
+RATE_RE = re.compile(r"(\d+(?:\.\d+)?)\s*%")
+AMOUNT_RE = re.compile(r"\d[\d,]*(?:\.\d+)?")
+CURRENCY_ALIASES = {
+    "RUPEE": "INR", "RUPEES": "INR", "INDIAN RUPEE": "INR", "INDIAN RUPEES": "INR",
+    "US$": "USD", "US DOLLAR": "USD", "US DOLLARS": "USD", "DOLLAR": "USD", "DOLLARS": "USD",
+    "EURO": "EUR", "EUROS": "EUR",
+}
+
+
+def is_missing(value):
+    return value is None or value == "" or value == "null" or value == {}
+
+
+# Checksum contribution of each character at odd (weight 1) and even (weight 2) positions
+_GSTIN_WEIGHTED = [
+    {char: (i * weight) // 36 + (i * weight) % 36 for i, char in enumerate(GSTIN_CHARSET)}
+    for weight in (1, 2)
+]
+
+
+def gstin_check_character(first14):
+    """GSTIN check character: weighted base-36 checksum over the first 14 characters"""
+    odd, even = _GSTIN_WEIGHTED
+    total = sum(odd[char] for char in first14[0::2]) + sum(even[char] for char in first14[1::2])
+    return GSTIN_CHARSET[(36 - total % 36) % 36]
+
+
+def normalize_id(value):
+    """GSTIN/PAN as printed often carry spaces or lower case; compare them in canonical form"""
+    if isinstance(value, str) and value.isalnum() and value.isupper():
+        return value
+    return re.sub(r"[\s\-]", "", str(value)).upper()
+
+
+def parse_amount(value):
+    """First number in the value, negative when written as -1,200.00 or (1,200.00)"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value)
+    match = AMOUNT_RE.search(text)
+    if not match:
+        return None
+    amount = float(match.group(0).replace(",", ""))
+    prefix = text[:match.start()].rstrip()
+    if prefix.endswith("-") or (prefix.endswith("(") and text[match.end():].lstrip().startswith(")")):
+        return -amount
+    return amount
+
+
+def parse_taxes(value):
+    """
+    Return ([(label, rate)], total tax amount or None) from a Taxes field.
+
+    Taxes arrive as a dict, its JSON string, or free text such as
+    "CGST @9%: 450.00, SGST @9%: 450.00"; rates may sit in the keys or values.
+    A bare number that is one of VALID_TAX_RATES, such as "18", is a rate.
+    """
+    if isinstance(value, str) and value.lstrip().startswith("{"):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass
+    if not isinstance(value, dict):
+        rate = bare_rate(value)
+        if rate is not None:
+            return [("", rate)], None
+    rates, amounts = [], []
+    if isinstance(value, dict):
+        for label, amount in value.items():
+            label = str(label).upper()
+            numeric = isinstance(amount, (int, float))
+            for rate in RATE_RE.findall(label if numeric else f"{label} {amount}"):
+                rates.append((label, float(rate)))
+            if numeric:
+                amounts.append(float(amount))
+            elif "%" not in str(amount):
+                parsed = parse_amount(amount)
+                if parsed is not None:
+                    amounts.append(parsed)
+    else:
+        text = str(value)
+        # Commas followed by a digit belong to amounts such as 1,23,456.00
+        for segment in re.split(r",(?!\d)|[;\n]", text):
+            for rate in RATE_RE.findall(segment):
+                rates.append((segment.upper(), float(rate)))
+            # Amounts are whatever numbers are left once the rates are removed
+            for amount in AMOUNT_RE.findall(RATE_RE.sub("", segment)):
+                amounts.append(float(amount.replace(",", "")))
+    return rates, (sum(amounts) if amounts else None)
+
+
+def bare_rate(value):
+    """The rate in a Taxes value that is only a valid rate, such as 18, "18" or "18%", else None"""
+    try:
+        rate = float(str(value).strip().rstrip("%"))
+    except ValueError:
+        return None
+    return rate if is_valid_rate(rate) else None
+
+
+def effective_rates(rates):
+    """Combine CGST with SGST/UTGST into one rate; IGST and unlabelled rates stand alone"""
+    central = [rate for label, rate in rates if "CGST" in label]
+    state = [rate for label, rate in rates if "SGST" in label or "UTGST" in label]
+    others = [rate for label, rate in rates if not any(k in label for k in ("CGST", "SGST", "UTGST"))]
+    if central and state:
+        return [c + s for c, s in zip(central, state)] + others
+    return central + state + others
+
+
+def is_valid_rate(rate, tolerance=0.01):
+    for valid in VALID_TAX_RATES:
+        if abs(rate - valid) <= tolerance:
+            return True
+    return False
+
+
+# Rule checks take the values of their fields (in declaration order) and return
+# None when the rule passes, or a message when it fails.
+
+def check_required(*values):
+    missing = [field for field, value in zip(REQUIRED_FIELDS, values) if is_missing(value)]
+    return ", ".join(missing) if missing else None
+
+
+def check_total_amount(total):
+    if is_missing(total):
+        return "Total Amount is zero or missing"
+    amount = parse_amount(total)
+    if amount is None:
+        return "Total Amount is not a number"
+    if amount == 0:
+        return "Total Amount is zero or missing"
+    if amount < 0:
+        return "Total Amount is negative"
+    return None
+
+
+def check_gstin(gstin):
+    if is_missing(gstin):
+        return None  # reported by the required fields rule
+    gstin = normalize_id(gstin)
+    if len(gstin) != 15:
+        return "GSTIN format is invalid (should be 15 characters)"
+    if not GSTIN_RE.fullmatch(gstin):
+        return "GSTIN format is invalid"
+    if gstin_check_character(gstin[:14]) != gstin[14]:
+        return "GSTIN checksum is invalid"
+    return None
+
+
+def check_invoice_date(date):
+    if is_missing(date):
+        return "Invoice Date is missing"
+    return None
+
+
+def check_pan(pan, gstin):
+    if is_missing(pan):
+        return None
+    pan = normalize_id(pan)
+    if not PAN_RE.fullmatch(pan):
+        return "PAN format is invalid"
+    if not is_missing(gstin) and normalize_id(gstin)[2:12] != pan:
+        return "PAN does not match the PAN embedded in the GSTIN"
+    return None
+
+
+def check_currency(currency):
+    if is_missing(currency):
+        return None
+    code = normalize_currency(str(currency))
+    code = CURRENCY_ALIASES.get(code, code)
+    if code not in VALID_CURRENCIES:
+        return f"Currency {currency} is not one of {', '.join(sorted(VALID_CURRENCIES))}"
+    return None
+
+
+_VALID_RATES_TEXT = "/".join(f"{rate:g}%" for rate in VALID_TAX_RATES)
+
+
+def check_taxes(taxes, total):
+    if is_missing(taxes):
+        return "Tax information is missing"
+    rates, tax_amount = parse_taxes(taxes)
+    valid = _VALID_RATES_TEXT
+    if rates:
+        invalid = [rate for rate in effective_rates(rates) if not is_valid_rate(rate)]
+        if invalid:
+            return f"Tax rate {', '.join(f'{rate:g}%' for rate in invalid)} is not one of {valid}"
+        return None
+    # No printed rate: infer it from the tax amount and the total it was added to
+    total_amount = parse_amount(total) if not is_missing(total) else None
+    if tax_amount and total_amount and total_amount > tax_amount:
+        implied = tax_amount / (total_amount - tax_amount) * 100
+        if is_valid_rate(implied, IMPLIED_RATE_TOLERANCE):
+            return None
+        return f"Implied tax rate {implied:.1f}% is not one of {valid}"
+    return "Tax rate could not be determined"
+
+
+# History checks compare the invoice with stored invoices through an InvoiceIndex;
+# they take (invoice, index, as_of) and only run when an index is given.
+
+def check_duplicate_number(invoice, index, as_of):
+    duplicates = index.find_duplicates(invoice.get('Invoice Number'), exclude_file_id=invoice.get('file_id'), before=as_of)
+    if duplicates:
+        return f"Duplicate Invoice Number (already used by {', '.join(duplicates[:3])})"
+    return None
+
+
+def check_company_frequency(invoice, index, as_of):
+    if is_missing(invoice.get('Company Name')):
+        return None
+    now = as_of if as_of is not None else time.time()
+    recent = index.company_arrivals(
+        invoice['Company Name'], since=now - FREQUENCY_WINDOW_SECONDS,
+        until=now if as_of is not None else None, exclude_file_id=invoice.get('file_id'),
+    )
+    if recent:
+        return f"Company Name appears {len(recent) + 1} times within 24 hours"
+    return None
+
+
+def check_similar_invoice(invoice, index, as_of):
+    similar = index.find_similar_invoices(invoice, exclude_file_id=invoice.get('file_id'), before=as_of)
+    if similar:
+        return f"Invoice is similar to existing invoice(s) {', '.join(similar[:3])}"
+    return None
+
+
+class Rule:
+    """One named check over a fixed list of invoice fields, or over the invoice history"""
+
+    def __init__(self, name, fields, check, history=False, missing=False):
+        self.name = name
+        self.fields = tuple(fields)
+        self.check = check
+        self.history = history
+        # The message of a `missing` rule lists field names rather than describing an issue
+        self.missing = missing
+
+
+RULES = [
+    Rule("required_fields", REQUIRED_FIELDS, check_required, missing=True),
+    Rule("total_amount", ["Total Amount"], check_total_amount),
+    Rule("gstin", ["GSTIN"], check_gstin),
+    Rule("invoice_date", ["Invoice Date"], check_invoice_date),
+    Rule("pan_matches_gstin", ["PAN", "GSTIN"], check_pan),
+    Rule("taxes", ["Taxes", "Total Amount"], check_taxes),
+    Rule("currency", ["Currency"], check_currency),
+    Rule("duplicate_invoice_number", ["file_id", "Invoice Number"], check_duplicate_number, history=True),
+    Rule("company_frequency", ["file_id", "Company Name"], check_company_frequency, history=True),
+    Rule("similar_invoice", ["file_id", "Invoice Number", "Company Name", "GSTIN", "Total Amount", "Invoice Date"],
+         check_similar_invoice, history=True),
+]
+
+
+class ValidationResult:
+    __slots__ = ("is_valid", "reason", "results")
+
+    def __init__(self, is_valid, reason, results):
+        self.is_valid = is_valid
+        self.reason = reason
+        self.results = results
+
+    def as_dict(self):
+        return {"is_valid": self.is_valid, "reason": self.reason, "rules": self.results}
+
+
+class Validator:
+    """
+    A rule set compiled for single-pass validation.
+
+    Every field any rule reads is looked up once per invoice, and each rule is
+    bound to the positions of its fields in that lookup, so no rule touches the
+    invoice dict itself. Per-rule call counts, failures and cumulative time are
+    kept for the whole process.
+    """
+
+    def __init__(self, rules=RULES):
+        self.rules = list(rules)
+        self.fields = list(dict.fromkeys(field for rule in self.rules for field in rule.fields))
+        position = {field: i for i, field in enumerate(self.fields)}
+        self._compiled = []
+        for number, rule in enumerate(self.rules):
+            positions = [position[field] for field in rule.fields]
+            # itemgetter returns a bare value for one field and a tuple for several
+            accessor = itemgetter(*positions) if positions else (lambda values: ())
+            self._compiled.append((number, rule.name, rule.check, accessor, len(positions) == 1,
+                                   rule.history, rule.missing))
+        self._calls = [0] * len(self.rules)
+        self._failures = [0] * len(self.rules)
+        self._seconds = [0.0] * len(self.rules)
+        self._lock = threading.Lock()
+
+    def evaluate(self, invoice, index=None, as_of=None, details=True):
+        """Run every rule once and return a ValidationResult; history rules need `index`"""
+        get = invoice.get
+        values = [get(field) for field in self.fields]
+        clock = time.perf_counter
+        missing, issues, results, ran = None, [], [], []
+        for number, name, check, accessor, single, history, is_missing_rule in self._compiled:
+            if history and index is None:
+                continue
+            started = clock()
+            try:
+                if history:
+                    message = check(invoice, index, as_of)
+                elif single:
+                    message = check(accessor(values))
+                else:
+                    message = check(*accessor(values))
+            except Exception as e:
+                message = f"{name} check failed: {e}"
+            elapsed = clock() - started
+            ran.append((number, elapsed, message is not None))
+            if message is not None:
+                if is_missing_rule:
+                    missing = message
+                else:
+                    issues.append(message)
+            if details:
+                results.append({"rule": name, "passed": message is None, "message": message,
+                                "elapsed_us": round(elapsed * 1e6, 2)})
+        with self._lock:
+            for number, elapsed, failed in ran:
+                self._calls[number] += 1
+                self._failures[number] += failed
+                self._seconds[number] += elapsed
+
+        if missing is None and not issues:
+            return ValidationResult(True, "Invoice validation passed", results)
+        reason_parts = []
+        if missing:
+            reason_parts.append(f"Missing required fields: {missing}")
+        if issues:
+            reason_parts.append(f"Validation issues: {'; '.join(issues)}")
+        return ValidationResult(False, ". ".join(reason_parts), results)
+
+    def validate(self, invoice, index=None, as_of=None):
+        """(is_valid, reason), without the per-rule details"""
+        result = self.evaluate(invoice, index, as_of, details=False)
+        return result.is_valid, result.reason
+
+    def report(self):
+        """Per-rule calls, failures, cumulative seconds and mean microseconds so far"""
+        with self._lock:
+            return {
+                rule.name: {
+                    "calls": calls,
+                    "failures": failures,
+                    "seconds": round(seconds, 6),
+                    "mean_us": round(seconds / calls * 1e6, 2) if calls else 0.0,
+                }
+                for rule, calls, failures, seconds in zip(self.rules, self._calls, self._failures, self._seconds)
+            }
+
+
+_validator = None
+_validator_lock = threading.Lock()
+
+
+def get_validator():
+    """The validator for RULES, compiled on first use"""
+    global _validator
+    with _validator_lock:
+        if _validator is None:
+            _validator = Validator(RULES)
+            metrics.register_gauge("rule_seconds", lambda: {n: r["seconds"] for n, r in _validator.report().items()})
+            metrics.register_gauge("rule_failures", lambda: {n: r["failures"] for n, r in _validator.report().items()})
+        return _validator
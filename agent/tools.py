@@ -1,13 +1,15 @@
-from langchain.tools import tool
-from supabase import create_client
+from langchain_core.tools import tool
 import os, json
 from dotenv import load_dotenv
-import smtplib
 from email.mime.text import MIMEText
+from helper.clients import get_supabase, smtp_session
+from helper.mailer import MAILER_ENABLED, get_mailer, rejection_body
+from helper import metrics
+from helper.write_behind import WRITE_BEHIND_ENABLED, get_write_buffer, report_write
+from agent.invoice_index import get_invoice_index
+from agent.validation_helper import validate_invoice
 load_dotenv()
 
-supabase = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
-
 @tool
 def update_flagged(tool_input: str) -> str:
     """
@@ -32,24 +34,50 @@ def update_flagged(tool_input: str) -> str:
         file_id = data["file_id"].strip("'\"")  # Remove any extra quotes
         is_valid = data.get("is_valid", False)  # Default to False if not provided
         
+        if WRITE_BEHIND_ENABLED:
+            queue_flag_update(file_id, is_valid)
+            return f"Queued update: flagged={not is_valid}, visited=True for file_id={file_id}"
+
         # Update Supabase
-        result = supabase.table("extracted_information").update({
-            "flagged": not is_valid,  # flagged=True means invalid, flagged=False means valid
-            "visited": True
-        }).eq("file_id", file_id).execute()
-        
+        try:
+            with metrics.span("db.update", table="extracted_information"):
+                result = get_supabase().table("extracted_information").update({
+                    "flagged": not is_valid,  # flagged=True means invalid, flagged=False means valid
+                    "visited": True
+                }).eq("file_id", file_id).execute()
+        except Exception as e:
+            report_write("extracted_information", file_id, False, e)
+            raise
+        report_write("extracted_information", file_id, True)
+
         return f"Successfully updated: flagged={not is_valid}, visited=True for file_id={file_id}"
         
     except Exception as e:
         return f"Error updating flagged status: {str(e)}"
 
+def queue_flag_update(file_id, is_valid, callback=None):
+    """
+    Buffer a flagged/visited update. It joins the row's insert when that is still pending,
+    and is otherwise sent as an UPDATE, so a failed insert never leaves a flag-only row.
+    `callback` defaults to the one set with helper.write_behind.write_callback.
+    """
+    get_write_buffer(get_supabase(), "extracted_information").add(
+        {"file_id": file_id, "flagged": not is_valid, "visited": True}, callback, update=True
+    )
+
+def queue_invoice_push(data, callback=None):
+    """Buffer a valid invoice for the next bulk upsert into invoice_db (needs a unique file_id, see README)"""
+    get_write_buffer(get_supabase(), "invoice_db").add(data, callback)
+
 @tool
 def fetch_other_invoices(file_id: str) -> str:
     """Get all invoices except the current one."""
     try:
         file_id = file_id.strip("'\"")  # Remove any extra quotes
-        result = supabase.table("extracted_information").select("*").neq("file_id", file_id).execute()
-        return f"Found {len(result.data)} other invoices"
+        # The local index only pulls rows added since its last sync instead of the whole table
+        index = get_invoice_index(get_supabase())
+        index.sync_if_stale()
+        return f"Found {len(index) - (1 if file_id in index else 0)} other invoices"
     except Exception as e:
         return f"Error fetching invoices: {str(e)}"
 
@@ -66,8 +94,18 @@ def push_invoice(invoice_data: str) -> str:
             data = json.loads(invoice_data)
         else:
             data = invoice_data
-            
-        supabase.table("invoice_db").insert([data]).execute()
+
+        if WRITE_BEHIND_ENABLED and data.get("file_id"):
+            queue_invoice_push(data)
+            return "Queued invoice for invoice_db"
+
+        try:
+            with metrics.span("db.insert", table="invoice_db"):
+                get_supabase().table("invoice_db").insert([data]).execute()
+        except Exception as e:
+            report_write("invoice_db", data.get("file_id"), False, e)
+            raise
+        report_write("invoice_db", data.get("file_id"), True)
         return "Successfully inserted invoice into invoice_db"
     except Exception as e:
         return f"Error pushing invoice: {str(e)}"
@@ -76,12 +114,16 @@ def push_invoice(invoice_data: str) -> str:
 def send_invalid_email(email_data: str) -> str:
     """
     Send invalidation reason via Gmail SMTP.
+
+    Queued to the background mailer unless SMTP_ASYNC=false, so the caller
+    does not wait for the SMTP round trip.
     
     Args:
         email_data: JSON string with:
           {
             "recipient_email": "string",
-            "reason": "string"
+            "reason": "string",
+            "invoice": "string"   (optional: invoice number or file_id, named in the email)
           }
     """
     try:
@@ -89,20 +131,23 @@ def send_invalid_email(email_data: str) -> str:
         data = json.loads(email_data) if isinstance(email_data, str) else email_data
         recipient = data.get("recipient_email") or data.get("Received_From")
         reason    = data.get("reason", "Invoice validation failed")
+        invoice   = data.get("invoice")
 
         if not recipient:
             return "Error: No recipient email provided."
 
+        if MAILER_ENABLED:
+            get_mailer().send_rejection(recipient, reason, invoice=invoice)
+            return f"Email to {recipient} queued"
+
         # Build the message
-        msg = MIMEText(f"Your invoice was rejected for this reason:\n\n{reason}")
+        msg = MIMEText(rejection_body([(invoice, reason)]))
         msg["Subject"] = "Invoice Validation Failed"
         msg["From"] = os.getenv("SMTP_USER")
         msg["To"] = recipient
 
-        # Send via SMTP
-        with smtplib.SMTP(os.getenv("SMTP_HOST"), int(os.getenv("SMTP_PORT"))) as server:
-            server.starttls()
-            server.login(os.getenv("SMTP_USER"), os.getenv("SMTP_PASS"))
+        # Send over the shared, already authenticated SMTP connection
+        with smtp_session() as server, metrics.span("smtp.send", recipient=recipient):
             server.send_message(msg)
 
         return f"Email sent to {recipient}"
@@ -112,17 +157,5 @@ def send_invalid_email(email_data: str) -> str:
 
 def generate_validation_reason(invoice_data):
     """Generate a validation failure reason based on missing/invalid fields"""
-    required_fields = ['Company Name', 'Invoice Number', 'Invoice Date', 'Total Amount', 'GSTIN', 'Customer Name']
-    missing_fields = [field for field in required_fields if not invoice_data.get(field) or invoice_data.get(field) == "null"]
-    
-    issues = []
-    if missing_fields:
-        issues.append(f"Missing required fields: {', '.join(missing_fields)}")
-    
-    if invoice_data.get('Total Amount') == 0:
-        issues.append("Total Amount is zero")
-    
-    if not invoice_data.get('Taxes') or invoice_data.get('Taxes') == "null":
-        issues.append("Tax information is missing")
-    
-    return "; ".join(issues) if issues else "Invoice validation failed"
\ No newline at end of file
+    is_valid, reason = validate_invoice(invoice_data)
+    return "Invoice validation failed" if is_valid else reason
@@ -1,61 +1,34 @@
 import json
-from typing import Tuple, Dict, Any
+from typing import Tuple, Dict, Any, Optional
 
-def validate_invoice(invoice_data: Dict[str, Any]) -> Tuple[bool, str]:
+from agent.rules import get_validator
+
+# extracted_information columns the rules read, for callers that re-validate stored rows
+VALIDATION_COLUMNS = list(dict.fromkeys(['file_id'] + get_validator().fields))
+
+def validate_invoice(invoice_data: Dict[str, Any], index: Optional[Any] = None,
+                     as_of: Optional[float] = None) -> Tuple[bool, str]:
     """
     Validate invoice data and return validation result with reason.
     
     Args:
         invoice_data: Dictionary containing invoice information
+        index: Optional InvoiceIndex; enables the duplicate, frequency and similarity checks
+        as_of: Arrival timestamp when re-validating a stored invoice; only invoices
+            that arrived before it count for the history checks
         
     Returns:
         Tuple of (is_valid: bool, reason: str)
     """
-    required_fields = [
-        'Company Name',
-        'Invoice Number', 
-        'Invoice Date',
-        'Total Amount',
-        'GSTIN',
-        'Customer Name'
-    ]
-    
-    missing_fields = []
-    validation_issues = []
-    
-    # Check for missing required fields
-    for field in required_fields:
-        if not invoice_data.get(field) or invoice_data.get(field) == "null":
-            missing_fields.append(field)
-    
-    # Check for specific validation issues
-    if invoice_data.get('Total Amount') == 0 or invoice_data.get('Total Amount') is None:
-        validation_issues.append("Total Amount is zero or missing")
-    
-    if invoice_data.get('GSTIN') and len(str(invoice_data.get('GSTIN'))) != 15:
-        validation_issues.append("GSTIN format is invalid (should be 15 characters)")
-    
-    if not invoice_data.get('Invoice Date'):
-        validation_issues.append("Invoice Date is missing")
-    
-    if not invoice_data.get('Taxes') or invoice_data.get('Taxes') == "null":
-        validation_issues.append("Tax information is missing")
-    
-    # Compile reason
-    if missing_fields or validation_issues:
-        reason_parts = []
-        if missing_fields:
-            reason_parts.append(f"Missing required fields: {', '.join(missing_fields)}")
-        if validation_issues:
-            reason_parts.append(f"Validation issues: {'; '.join(validation_issues)}")
-        
-        reason = ". ".join(reason_parts)
-        return False, reason
-    
-    return True, "Invoice validation passed"
+    return get_validator().validate(invoice_data, index=index, as_of=as_of)
+
+def explain_invoice(invoice_data: Dict[str, Any], index: Optional[Any] = None,
+                    as_of: Optional[float] = None) -> Dict[str, Any]:
+    """Like validate_invoice, with the outcome and timing of every rule"""
+    return get_validator().evaluate(invoice_data, index=index, as_of=as_of).as_dict()
 
 # Tool wrapper for the validation function
-from langchain.tools import tool
+from langchain_core.tools import tool
 
 @tool
 def validate_invoice_tool(invoice_json: str) -> str:
@@ -74,12 +47,7 @@ def validate_invoice_tool(invoice_json: str) -> str:
         else:
             invoice_data = invoice_json
             
-        is_valid, reason = validate_invoice(invoice_data)
-        
-        return json.dumps({
-            "is_valid": is_valid,
-            "reason": reason
-        })
+        return json.dumps(explain_invoice(invoice_data))
         
     except Exception as e:
         return json.dumps({
@@ -0,0 +1,125 @@
+"""
+Compare the OCR backends in ocr/tesseract_pool.py on synthetic invoice pages.
+
+    python bench/ocr_backends.py                          # every available backend, 24 pages
+    python bench/ocr_backends.py --pages 60 --workers 4 --profile fast --json ocr_backends.json
+
+Each backend OCRs the same pages twice: one call per page in this process, and
+in batches across a process pool as ocr/ocr_main.py does for PDFs. pytesseract
+one page at a time is the old path and the baseline for the others. Recall is
+the share of the invoice's field values found verbatim in the OCR text.
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import argparse
+import json
+import random
+import re
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from bench.synthetic import random_invoice, render_pages, scan_noise
+from ocr.tesseract_pool import BACKENDS, ocr_batch, split_batches
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the OCR backends on synthetic invoice pages.")
+    parser.add_argument("--pages", type=int, default=24)
+    parser.add_argument("--dpi", type=int, default=200, help="Render resolution of the pages.")
+    parser.add_argument("--noise-rate", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--profile", choices=["fast", "balanced", "accurate"], default="balanced")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="Comma-separated backends to run.")
+    parser.add_argument("--json", help="Write the results to this file.")
+    return parser.parse_args(argv)
+
+
+def available(backend):
+    if backend == "tesserocr":
+        try:
+            import tesserocr  # noqa: F401
+            return True
+        except ImportError:
+            return False
+    return shutil.which("tesseract") is not None
+
+
+def make_pages(count, dpi, noise_rate, seed):
+    rng = random.Random(seed)
+    pages, truths = [], []
+    for index in range(count):
+        invoice = random_invoice(rng, index, f"Bench Traders {index}", f"billing{index}@bench.example.com")
+        image = render_pages(invoice, 1, dpi)[0]
+        pages.append(scan_noise(image, rng) if rng.random() < noise_rate else image)
+        truths.append([str(v) for v in invoice["fields"].values() if isinstance(v, (str, int, float)) and str(v)])
+    return pages, truths
+
+
+def recall(texts, truths):
+    squash = lambda text: re.sub(r"\s+", " ", text).strip().lower()
+    found = total = 0
+    for text, values in zip(texts, truths):
+        text = squash(text)
+        found += sum(squash(value) in text for value in values)
+        total += len(values)
+    return found / total if total else 0.0
+
+
+def run_serial(pages, backend, profile, dpi):
+    started = time.perf_counter()
+    texts = [ocr_batch([page], profile, dpi, backend)[0] for page in pages]
+    return texts, time.perf_counter() - started
+
+
+def run_pool(pages, backend, profile, dpi, workers):
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Start the processes and load their engines before timing, as a long-running service would have
+        list(pool.map(ocr_batch, [[page] for page in pages[:workers]], repeat(profile), repeat(dpi), repeat(backend)))
+        started = time.perf_counter()
+        batches = split_batches(pages, workers)
+        results = pool.map(ocr_batch, batches, repeat(profile), repeat(dpi), repeat(backend))
+        texts = [text for batch in results for text in batch]
+        return texts, time.perf_counter() - started
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    pages, truths = make_pages(args.pages, args.dpi, args.noise_rate, args.seed)
+    rows = []
+    for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        if not available(backend):
+            print(f"[OCR bench] Skipping {backend}: not installed")
+            continue
+        for mode in ("per_page", "pool_batched"):
+            if mode == "per_page":
+                texts, elapsed = run_serial(pages, backend, args.profile, args.dpi)
+            else:
+                texts, elapsed = run_pool(pages, backend, args.profile, args.dpi, args.workers)
+            rows.append({
+                "backend": backend,
+                "mode": mode,
+                "pages_per_second": round(len(pages) / elapsed, 2),
+                "ms_per_page": round(elapsed / len(pages) * 1000, 1),
+                "recall": round(recall(texts, truths), 4),
+            })
+
+    baseline = {row["mode"]: row for row in rows if row["backend"] == "pytesseract"}
+    print(f"[OCR bench] {len(pages)} pages at {args.dpi} DPI, profile={args.profile}, workers={args.workers}")
+    print(f"{'backend':<12} {'mode':<13} {'pages/s':>8} {'ms/page':>8} {'recall':>7} {'speedup':>8}")
+    for row in rows:
+        base = baseline.get(row["mode"])
+        speedup = f"{base['ms_per_page'] / row['ms_per_page']:.2f}x" if base else "-"
+        print(f"{row['backend']:<12} {row['mode']:<13} {row['pages_per_second']:>8} {row['ms_per_page']:>8} "
+              f"{row['recall']:>7} {speedup:>8}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": rows}, f, indent=2)
+    return rows
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import json
+import math
+import re
+import threading
+import time
+
+from ocr.pre_extractor import parse_date
+
+# Compared against ground truth; Received_From comes from ingestion metadata, not the LLM
+ACCURACY_FIELDS = [
+    "Company Name", "Invoice Number", "Invoice Date", "GSTIN", "PAN", "HSN/SAC", "Taxes",
+    "Total Amount", "Payment Terms", "Currency", "Customer Name", "Billing Address",
+    "Shipping Address", "Document Type", "Company Address", "Received_From",
+]
+
+
+class LatencyRecorder:
+    """Thread-safe per-stage latency samples, in seconds"""
+
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def timed(self, stage, func):
+        """Wrap a stage function so every call is recorded under `stage`"""
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - started)
+        return wrapper
+
+    def summary(self):
+        with self._lock:
+            return {stage: summarize(values) for stage, values in self.samples.items()}
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(values):
+    ordered = sorted(values)
+    ms = lambda seconds: round(seconds * 1000, 2)
+    return {
+        "count": len(ordered),
+        "p50_ms": ms(percentile(ordered, 0.50)),
+        "p90_ms": ms(percentile(ordered, 0.90)),
+        "p99_ms": ms(percentile(ordered, 0.99)),
+        "mean_ms": ms(sum(ordered) / len(ordered)) if ordered else 0.0,
+        "max_ms": ms(ordered[-1]) if ordered else 0.0,
+    }
+
+
+def _amounts(value):
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return sorted(round(float(n.replace(",", "")), 2) for n in re.findall(r"\d[\d,]*\.\d{2}", value))
+    if isinstance(value, dict):
+        return sorted(round(float(str(v).replace(",", "")), 2) for v in value.values())
+    return value
+
+
+def normalize_value(field, value):
+    """Canonical form for comparison: numbers as rounded floats, dates ISO, text casefolded"""
+    if value in (None, "", "null", "None") or value == {}:
+        return None
+    try:
+        if field == "Total Amount":
+            return round(float(re.sub(r"[^\d.]", "", str(value))), 2)
+        if field == "Taxes":
+            return _amounts(value)
+    except ValueError:
+        pass
+    if field == "Invoice Date":
+        return parse_date(str(value)) or str(value).strip()
+    return " ".join(str(value).casefold().split()).strip(" .,")
+
+
+def score_extraction(results, manifest):
+    """
+    Compare extracted invoices with the corpus ground truth.
+
+    `results` maps a sender email (unique per synthetic invoice) to
+    {"invoice": dict, "is_valid": bool or None}.
+    """
+    by_sender = {entry["sender_email"]: entry for entry in manifest["invoices"]}
+    correct = {field: 0 for field in ACCURACY_FIELDS}
+    documents_exact = 0
+    validation_agree = 0
+    scored = 0
+    for sender, result in results.items():
+        entry = by_sender.get(sender)
+        if entry is None:
+            continue
+        scored += 1
+        invoice = result.get("invoice") or {}
+        exact = True
+        for field in ACCURACY_FIELDS:
+            if normalize_value(field, invoice.get(field)) == normalize_value(field, entry["fields"].get(field)):
+                correct[field] += 1
+            else:
+                exact = False
+        documents_exact += exact
+        validation_agree += result.get("is_valid") == entry["expected_valid"]
+
+    total = len(manifest["invoices"])
+    ratio = lambda n: round(n / total, 4) if total else 0.0
+    return {
+        "documents": total,
+        "extracted": scored,
+        "fields": {field: ratio(n) for field, n in correct.items()},
+        "overall": round(sum(correct.values()) / (total * len(ACCURACY_FIELDS)), 4) if total else 0.0,
+        "documents_exact": ratio(documents_exact),
+        "validation_agreement": ratio(validation_agree),
+    }
+
+
+def print_report(report):
+    throughput = report["throughput"]
+    print(f"\n[Bench] {throughput['invoices']} invoices in {throughput['elapsed_seconds']}s "
+          f"({throughput['invoices_per_minute']} invoices/min), mode={report['config']['mode']}")
+    print(f"{'stage':<14}{'count':>7}{'p50 ms':>11}{'p90 ms':>11}{'p99 ms':>11}{'max ms':>11}")
+    for stage, s in report["stages"].items():
+        print(f"{stage:<14}{s['count']:>7}{s['p50_ms']:>11}{s['p90_ms']:>11}{s['p99_ms']:>11}{s['max_ms']:>11}")
+    memory = report["memory"]
+    print(f"Peak RSS: {memory['peak_rss_mb']} MB (children: {memory['children_peak_rss_mb']} MB)"
+          + (f", Python heap peak: {memory['tracemalloc_peak_mb']} MB" if memory.get("tracemalloc_peak_mb") else ""))
+    accuracy = report["accuracy"]
+    print(f"Accuracy: {accuracy['overall']:.1%} of fields, {accuracy['documents_exact']:.1%} of documents exact, "
+          f"validation agrees on {accuracy['validation_agreement']:.1%}")
+    weakest = sorted(accuracy["fields"].items(), key=lambda item: item[1])[:5]
+    print("Weakest fields: " + ", ".join(f"{field} {score:.0%}" for field, score in weakest))
+    print("Stand-ins: " + ", ".join(f"{k}={v}" for k, v in report["stand_ins"].items()))
+
+
+def compare_reports(report, baseline):
+    """Print the change from a previous run on the same corpus"""
+    def delta(label, new, old, lower_is_better):
+        if not old:
+            return
+        change = (new - old) / old
+        better = change < 0 if lower_is_better else change > 0
+        print(f"  {label:<28}{old:>12}{new:>12}{change:>+10.1%}{'  better' if better and change else ''}")
+
+    print("\n[Bench] Compared with baseline")
+    print(f"  {'metric':<28}{'baseline':>12}{'now':>12}{'change':>10}")
+    delta("invoices/min", report["throughput"]["invoices_per_minute"],
+          baseline["throughput"]["invoices_per_minute"], lower_is_better=False)
+    for stage, s in report["stages"].items():
+        old = baseline["stages"].get(stage)
+        if old:
+            delta(f"{stage} p50 ms", s["p50_ms"], old["p50_ms"], lower_is_better=True)
+            delta(f"{stage} p90 ms", s["p90_ms"], old["p90_ms"], lower_is_better=True)
+    delta("peak RSS MB", report["memory"]["peak_rss_mb"], baseline["memory"]["peak_rss_mb"], lower_is_better=True)
+    delta("field accuracy", report["accuracy"]["overall"], baseline["accuracy"]["overall"], lower_is_better=False)
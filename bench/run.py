@@ -0,0 +1,252 @@
+"""
+Offline end-to-end benchmark: synthetic invoices through OCR, extraction, validation and the tool layer.
+
+    python bench/run.py --generate 100                    # build the corpus, then benchmark it
+    python bench/run.py --mode pipeline --source imap     # same corpus through the staged pipeline
+    python bench/run.py --json after.json --baseline before.json
+
+Drive, IMAP, Supabase, SMTP and Ollama are replaced by the local stand-ins in
+bench/stubs.py; tesseract and poppler still run for real.
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'watcher')))
+import argparse
+import contextlib
+import json
+import resource
+import tempfile
+import time
+import tracemalloc
+
+from bench.synthetic import generate_corpus, load_manifest
+
+DEFAULT_CORPUS = os.path.join(".cache", "bench_corpus")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the invoice pipeline offline on a synthetic corpus.")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help=f"Corpus directory (default: {DEFAULT_CORPUS}).")
+    parser.add_argument("--generate", type=int, metavar="N", help="(Re)generate the corpus with N invoices first.")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--noise-rate", type=float, default=0.5, help="Share of invoices with scan noise.")
+    parser.add_argument("--multipage-rate", type=float, default=0.2, help="Share of 2-3 page PDFs.")
+    parser.add_argument("--defect-rate", type=float, default=0.2, help="Share of invoices that should fail validation.")
+    parser.add_argument("--dpi", type=int, default=150, help="Render resolution of the synthetic documents.")
+    parser.add_argument("--limit", type=int, help="Only benchmark the first N invoices of the corpus.")
+    parser.add_argument("--mode", choices=["stages", "pipeline"], default="stages",
+                        help="Time each stage serially per invoice (default) or run the concurrent pipeline.")
+    parser.add_argument("--source", choices=["changes", "list", "imap"], default="changes",
+                        help="Pipeline mode input: Drive changes feed, Drive folder listing or IMAP attachments.")
+    parser.add_argument("--ocr-workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--ocr-profile", choices=["fast", "balanced", "accurate"], default="balanced",
+                        help="OCR preprocessing/tesseract profile for every document (see ocr/preprocess.py).")
+    parser.add_argument("--llm-workers", type=int, default=1)
+    parser.add_argument("--side-effect-workers", type=int, default=2)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds per stand-in LLM call.")
+    parser.add_argument("--llm-per-char", type=float, default=0.0, help="Extra stand-in LLM seconds per OCR character.")
+    parser.add_argument("--llm-per-token", type=float, default=0.0,
+                        help="Stand-in LLM seconds per generated token (streaming client only).")
+    parser.add_argument("--llm-in-flight", type=int, default=4, help="In-flight limit of the streaming LLM stand-in.")
+    parser.add_argument("--db-latency", type=float, default=0.0, help="Seconds per stand-in Supabase request.")
+    parser.add_argument("--smtp-latency", type=float, default=0.0, help="Seconds per stand-in SMTP send.")
+    parser.add_argument("--cache", action="store_true", help="Keep the extraction cache on (off by default).")
+    parser.add_argument("--tracemalloc", action="store_true", help="Also track the Python heap peak (slower).")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own logging.")
+    parser.add_argument("--json", dest="json_path", help="Write the report to this file.")
+    parser.add_argument("--baseline", help="Report from an earlier run to compare against.")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args, work_dir):
+    """Settings read at import time, so this runs before any pipeline module is imported"""
+    os.environ["EXTRACTION_CACHE"] = "true" if args.cache else "false"
+    os.environ["INVOICE_INDEX_PATH"] = ""
+    os.environ["INVOICE_INDEX_SYNC_INTERVAL"] = "0"
+    os.environ["ATTACHMENT_SPOOL_DIR"] = os.path.join(work_dir, "spool")
+    os.environ["WATCHER_DOWNLOAD_DIR"] = os.path.join(work_dir, "downloads")
+    os.environ["SMTP_RATE_PER_MINUTE"] = "0"
+    os.environ["OCR_WORKERS"] = str(args.ocr_workers)
+    os.environ["OCR_PROFILE"] = os.environ["OCR_IMAGE_PROFILE"] = args.ocr_profile
+    os.environ.setdefault("SMTP_USER", "invoices@bench.local")
+
+
+def run_stages(entries, files_dir, recorder, results):
+    """Every invoice through each stage in turn, timing the stages separately"""
+    from ocr.ocr_main import (
+        PAGE_BREAK, PageReader, read_until_complete, extract_fields_with_llm, enforce_nulls, insert_to_supabase,
+    )
+    from agent.validation_helper import validate_invoice
+    from agent.invoice_index import get_invoice_index
+    from helper.clients import get_supabase
+    from main import dispatch_actions
+
+    index = get_invoice_index(get_supabase())
+    for entry in entries:
+        sender, file_id = entry["sender_email"], entry["name"]
+        started = time.perf_counter()
+        reader = PageReader(os.path.join(files_dir, entry["name"]))
+        pages = recorder.timed("ocr", lambda: reader.read(reader.first_pages()))()
+        ocr_text = PAGE_BREAK.join(page["text"] for page in pages)
+
+        def extract():
+            fields = extract_fields_with_llm(ocr_text, sender)
+            pending = reader.remaining_pages(pages)
+            if pending and isinstance(fields, dict) and "error" not in fields:
+                fields = read_until_complete(reader, pending, fields)[0]
+            return enforce_nulls(fields)
+        invoice = recorder.timed("extraction", extract)()
+        if not isinstance(invoice, dict) or "error" in invoice:
+            results[sender] = {"invoice": None, "is_valid": None}
+            continue
+        invoice["file_id"], invoice["Received_From"] = file_id, sender
+
+        def validate():
+            outcome = validate_invoice(invoice, index=index)
+            index.add(invoice)
+            return outcome
+        is_valid, reason = recorder.timed("validation", validate)()
+
+        def act():
+            insert_to_supabase(dict(invoice))
+            dispatch_actions(invoice, file_id, is_valid, reason)
+        recorder.timed("tools", act)()
+        recorder.add("end_to_end", time.perf_counter() - started)
+        results[sender] = {"invoice": invoice, "is_valid": is_valid}
+
+
+def run_pipeline(args, manifest, entries, files_dir, stand_ins, recorder, results):
+    """The corpus through the concurrent staged pipeline, fed from the chosen stand-in source"""
+    from pipeline.stages import DriveFolderSource, DriveChangesSource, build_invoice_pipeline
+    from change_watcher import ChangeWatcher, LocalFolderBackend
+    from main import dispatch_actions, make_attachment_handler
+    from bench.stubs import LocalMailbox
+
+    submitted = {}
+
+    def on_complete(job):
+        recorder.add("end_to_end", time.perf_counter() - submitted.get(job["file_id"], time.perf_counter()))
+        results[job["sender_email"]] = {"invoice": job["invoice"], "is_valid": job["is_valid"]}
+
+    pipeline = build_invoice_pipeline(
+        act=dispatch_actions,
+        ocr_workers=args.ocr_workers,
+        llm_workers=args.llm_workers,
+        side_effect_workers=args.side_effect_workers,
+    )
+    pipeline.on_complete = on_complete
+    for stage in pipeline.stages:
+        inner = stage.func
+
+        def stamped(job, inner=inner, name=stage.name):
+            if name == "fetch":
+                submitted.setdefault(job["file_id"], time.perf_counter())
+            return inner(job)
+        stage.func = recorder.timed(stage.name, stamped)
+
+    if args.source == "imap":
+        source = DriveFolderSource(check_email=False)
+        pipeline.start()
+        selected = dict(manifest, invoices=entries)
+        LocalMailbox(selected, files_dir).deliver(make_attachment_handler(pipeline, source))
+        pipeline.close()
+        return
+    if args.source == "list":
+        for entry in entries:
+            stand_ins.drive.add_file(os.path.join(files_dir, entry["name"]), entry["name"], entry["sender_email"])
+        source = DriveFolderSource(check_email=False)
+    else:
+        # The watched folder holds links to just the selected invoices
+        folder = os.path.join(stand_ins.work_dir, "watched")
+        os.makedirs(folder, exist_ok=True)
+        for entry in entries:
+            os.symlink(os.path.join(files_dir, entry["name"]), os.path.join(folder, entry["name"]))
+            stand_ins.drive.set_owner(entry["name"], entry["sender_email"])
+        source = DriveChangesSource(ChangeWatcher(LocalFolderBackend(folder), state_path=None), check_email=False)
+    pipeline.run(source, poll_interval=None, report_interval=0)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.generate:
+        generate_corpus(args.corpus, args.generate, args.seed, args.noise_rate, args.multipage_rate,
+                        args.defect_rate, args.dpi)
+    manifest = load_manifest(args.corpus)
+    entries = manifest["invoices"][:args.limit] if args.limit else manifest["invoices"]
+    files_dir = os.path.abspath(os.path.join(args.corpus, "files"))
+
+    work_dir = tempfile.mkdtemp(prefix="invoice_bench_")
+    configure_environment(args, work_dir)
+    from bench.stubs import StandIns
+    from bench.report import LatencyRecorder, score_extraction, print_report, compare_reports
+    from helper.write_behind import flush_all
+    from helper.mailer import close_mailer
+    from helper import metrics
+
+    stand_ins = StandIns(work_dir, args.db_latency, args.smtp_latency, args.llm_latency, args.llm_per_char,
+                         args.llm_per_token, args.llm_in_flight).install()
+    recorder = LatencyRecorder()
+    results = {}
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    quiet = open(os.devnull, "w") if not args.verbose else None
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext():
+        if args.mode == "stages":
+            run_stages(entries, files_dir, recorder, results)
+        else:
+            run_pipeline(args, manifest, entries, files_dir, stand_ins, recorder, results)
+        # Buffered Supabase writes and queued emails are part of the cost of a run
+        recorder.timed("drain", lambda: (flush_all(), close_mailer()))()
+    elapsed = time.perf_counter() - started
+    if quiet:
+        quiet.close()
+
+    selected = dict(manifest, invoices=entries)
+    report = {
+        "config": {
+            "mode": args.mode,
+            "source": args.source if args.mode == "pipeline" else None,
+            "corpus": os.path.abspath(args.corpus),
+            "invoices": len(entries),
+            "seed": manifest["seed"],
+            "ocr_workers": args.ocr_workers,
+            "ocr_profile": args.ocr_profile,
+            "llm_workers": args.llm_workers,
+            "latencies": {"llm": args.llm_latency, "llm_per_char": args.llm_per_char,
+                          "llm_per_token": args.llm_per_token, "db": args.db_latency, "smtp": args.smtp_latency},
+            "llm_streaming": os.getenv("LLM_STREAMING", "true").lower() == "true",
+            "cache": args.cache,
+        },
+        "throughput": {
+            "invoices": len(results),
+            "elapsed_seconds": round(elapsed, 2),
+            "invoices_per_minute": round(len(results) / elapsed * 60, 2) if elapsed else 0.0,
+        },
+        "stages": recorder.summary(),
+        "spans": metrics.registry.snapshot()["spans"],
+        "memory": {
+            # ru_maxrss is in kilobytes on Linux; tesseract and poppler run as child processes
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "children_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+            "tracemalloc_peak_mb": round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+            if args.tracemalloc else None,
+        },
+        "accuracy": score_extraction(results, selected),
+        "stand_ins": stand_ins.stats(),
+    }
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"[Bench] Report written to {args.json_path}")
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            compare_reports(report, json.load(f))
+    return report
+
+
+if __name__ == "__main__":
+    main()
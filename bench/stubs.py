@@ -0,0 +1,476 @@
+import io
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from helper import clients
+from helper.ollama_stream import OllamaStreamClient
+from ocr.pre_extractor import parse_date
+
+
+class LocalResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class LocalSupabase:
+    """
+    In-memory stand-in for the supabase client, covering the PostgREST calls this repo makes.
+
+    Tables are lists of row dicts. Every execute() counts as one request and
+    sleeps `latency` seconds to model the network round trip.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.tables = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._clock = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    def table(self, name):
+        return LocalQuery(self, name)
+
+    def _created_at(self):
+        # Strictly increasing, so keyset pagination on created_at behaves like Postgres
+        self._clock += timedelta(microseconds=1)
+        return self._clock.isoformat()
+
+    def execute(self, query):
+        time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            rows = self.tables.setdefault(query.name, [])
+            if query.op == "insert":
+                for row in query.payload:
+                    rows.append({"created_at": self._created_at(), **row})
+                return LocalResponse([dict(r) for r in query.payload])
+            if query.op == "upsert":
+                key = query.on_conflict
+                for row in query.payload:
+                    existing = next((r for r in rows if r.get(key) == row.get(key)), None)
+                    if existing is None:
+                        rows.append({"created_at": self._created_at(), **row})
+                    else:
+                        existing.update(row)
+                return LocalResponse([dict(r) for r in query.payload])
+
+            matched = [r for r in rows if all(f(r) for f in query.filters)]
+            if query.op == "update":
+                for row in matched:
+                    row.update(query.payload)
+                return LocalResponse([dict(r) for r in matched])
+            for column, desc in reversed(query.ordering):
+                matched.sort(key=lambda r: (r.get(column) is None, r.get(column) or ""), reverse=desc)
+            if query.row_limit is not None:
+                matched = matched[:query.row_limit]
+            if query.columns:
+                matched = [{c: r.get(c) for c in query.columns} for r in matched]
+            return LocalResponse([dict(r) for r in matched])
+
+
+class LocalQuery:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.op = "select"
+        self.payload = None
+        self.on_conflict = None
+        self.columns = None
+        self.filters = []
+        self.ordering = []
+        self.row_limit = None
+
+    def select(self, columns="*"):
+        if columns.strip() != "*":
+            self.columns = [c.strip().strip('"') for c in columns.split(",")]
+        return self
+
+    def insert(self, rows):
+        self.op, self.payload = "insert", rows if isinstance(rows, list) else [rows]
+        return self
+
+    def upsert(self, rows, on_conflict="id"):
+        self.op, self.payload, self.on_conflict = "upsert", rows if isinstance(rows, list) else [rows], on_conflict
+        return self
+
+    def update(self, values):
+        self.op, self.payload = "update", values
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda r: r.get(column) == value)
+        return self
+
+    def in_(self, column, values):
+        values = set(values)
+        self.filters.append(lambda r: r.get(column) in values)
+        return self
+
+    @property
+    def not_(self):
+        self._negate = True
+        return self
+
+    def is_(self, column, value):
+        negate, self._negate = getattr(self, "_negate", False), False
+        wanted = None if value in (None, "null") else value
+        self.filters.append(lambda r: (r.get(column) is wanted) != negate)
+        return self
+
+    def neq(self, column, value):
+        self.filters.append(lambda r: r.get(column) != value)
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda r: r.get(column) is not None and r.get(column) > value)
+        return self
+
+    def or_(self, expression):
+        condition = _parse_logic(expression)
+        self.filters.append(lambda r: _evaluate(condition, r))
+        return self
+
+    def order(self, column, desc=False):
+        self.ordering.append((column, desc))
+        return self
+
+    def limit(self, count):
+        self.row_limit = count
+        return self
+
+    def execute(self):
+        return self.client.execute(self)
+
+
+_CONDITION_RE = re.compile(r'\s*(and|or)\(|\s*([\w ]+)\.(eq|neq|gt|gte|lt|lte)\.("(?:[^"]*)"|[^,()]*)')
+_OPERATORS = {
+    "eq": lambda a, b: a == b, "neq": lambda a, b: a != b,
+    "gt": lambda a, b: a > b, "gte": lambda a, b: a >= b,
+    "lt": lambda a, b: a < b, "lte": lambda a, b: a <= b,
+}
+
+
+def _parse_logic(expression):
+    """Parse a PostgREST or=() body such as `a.gt."x",and(a.eq."x",b.gt."y")` into a nested tuple"""
+    def parse_list(text, position):
+        items = []
+        while position < len(text) and text[position] != ")":
+            match = _CONDITION_RE.match(text, position)
+            if not match:
+                raise ValueError(f"Unsupported filter: {text[position:]}")
+            if match.group(1):
+                children, position = parse_list(text, match.end())
+                items.append((match.group(1), children))
+                position += 1  # closing parenthesis
+            else:
+                value = match.group(4)
+                items.append(("cmp", match.group(2).strip(), match.group(3), value.strip('"')))
+                position = match.end()
+            if position < len(text) and text[position] == ",":
+                position += 1
+        return items, position
+
+    items, _ = parse_list(expression, 0)
+    return ("or", items)
+
+
+def _evaluate(condition, row):
+    kind = condition[0]
+    if kind == "cmp":
+        _, column, op, value = condition
+        current = row.get(column)
+        return current is not None and _OPERATORS[op](str(current), value)
+    results = (_evaluate(child, row) for child in condition[1])
+    return all(results) if kind == "and" else any(results)
+
+
+class LocalSMTP:
+    """Stand-in for a logged-in smtplib.SMTP connection that records messages in a shared outbox"""
+
+    def __init__(self, outbox, latency=0.0):
+        self.outbox = outbox
+        self.latency = latency
+
+    def noop(self):
+        return 250, b"OK"
+
+    def send_message(self, msg):
+        time.sleep(self.latency)
+        self.outbox.append({"to": msg["To"], "subject": msg["Subject"], "body": msg.get_payload()})
+
+    def quit(self):
+        pass
+
+
+class LocalLLM:
+    """
+    Stand-in for the Ollama LLM that answers the extraction prompt by reading the labelled lines
+    of the synthetic invoice layout.
+
+    It returns what a well-behaved model would on this corpus, so accuracy
+    measures OCR quality and the prompt/parsing path rather than a model.
+    Latency is `latency` plus `per_char` seconds for each character of OCR text.
+    """
+
+    FIELDS_RE = re.compile(r"following fields:\s*(.*?)\.\s*\n", re.DOTALL)
+    TEXT_RE = re.compile(r"OCR Text:\s*\n(.*)\n\s*Return only JSON", re.DOTALL)
+
+    def __init__(self, latency=0.0, per_char=0.0):
+        self.latency = latency
+        self.per_char = per_char
+        self.calls = 0
+
+    def __call__(self, prompt):
+        prompt = prompt.to_string() if hasattr(prompt, "to_string") else str(prompt)
+        return self.invoke(prompt)
+
+    def invoke(self, prompt, **kwargs):
+        fields_match = self.FIELDS_RE.search(prompt)
+        text_match = self.TEXT_RE.search(prompt)
+        text = text_match.group(1) if text_match else prompt
+        fields = [f.strip() for f in fields_match.group(1).split(",")] if fields_match else []
+        self.calls += 1
+        time.sleep(self.latency + self.per_char * len(text))
+        return json.dumps({field: read_field(field, text) for field in fields})
+
+
+class LocalStreamLLM(OllamaStreamClient):
+    """
+    Streaming stand-in: the LocalLLM answer followed by the commentary a chatty model adds,
+    yielded in token-sized pieces with `per_token` seconds each.
+
+    Only the HTTP part of OllamaStreamClient is replaced, so the in-flight
+    limit and early termination run as they do against Ollama.
+    """
+
+    COMMENTARY = ("\n\nNote: every value above was copied from the OCR text; fields that could not "
+                  "be found were set to null. Let me know if you need the dates in another format.")
+
+    def __init__(self, llm, per_token=0.0, max_in_flight=4):
+        super().__init__(model="local", host="http://bench.local", max_in_flight=max_in_flight)
+        self.llm = llm
+        self.per_token = per_token
+        self.tokens = 0
+
+    def stream(self, prompt, format=None):
+        answer = self.llm.invoke(prompt) + self.COMMENTARY
+        for start in range(0, len(answer), 4):
+            time.sleep(self.per_token)
+            self.tokens += 1
+            yield answer[start:start + 4]
+
+    def preload(self):
+        pass
+
+
+_LABELS = {
+    "Invoice Number": r"Invoice\s*Number\s*[:\-]?\s*(\S+)",
+    "GSTIN": r"GSTIN\s*[:\-]?\s*([0-9A-Z]{15})",
+    "PAN": r"PAN\s*[:\-]?\s*([A-Z0-9]{10})",
+    "Payment Terms": r"Payment\s*Terms\s*[:\-]?\s*(.+)",
+    "Customer Name": r"Bill\s*To\s*[:\-]?\s*(.+)",
+    "Billing Address": r"Billing\s*Address\s*[:\-]?\s*(.+)",
+    "Shipping Address": r"Shipping\s*Address\s*[:\-]?\s*(.+)",
+}
+
+
+def read_field(field, text):
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if field in _LABELS:
+        match = re.search(_LABELS[field], text, re.IGNORECASE)
+        return match.group(1).strip() if match else None
+    if field == "Invoice Date":
+        match = re.search(r"Invoice\s*Date\s*[:\-]?\s*(.+)", text, re.IGNORECASE)
+        return parse_date(match.group(1)) if match else None
+    if field == "Total Amount":
+        match = re.search(r"Total\s*Amount\s*[:\-]?\s*(?:INR)?\s*([\d,]+\.\d{2})", text, re.IGNORECASE)
+        return float(match.group(1).replace(",", "")) if match else None
+    if field == "Taxes":
+        taxes = {name.strip(): float(amount.replace(",", ""))
+                 for name, amount in re.findall(r"((?:CGST|SGST|IGST)[^:\n]*):\s*([\d,]+\.\d{2})", text)}
+        return taxes or None
+    if field == "HSN/SAC":
+        match = re.search(r"^\s*[A-Za-z][A-Za-z ]+?\s+(\d{4,8})\s+\d+\s", text, re.MULTILINE)
+        return match.group(1) if match else None
+    if field == "Currency":
+        return "INR" if re.search(r"\bINR\b|₹", text) else None
+    if field == "Document Type":
+        return "Tax Invoice" if re.search(r"tax\s+invoice", text, re.IGNORECASE) else None
+    if field in ("Company Name", "Company Address"):
+        # The issuer's name and address are the two lines under the title
+        for position, line in enumerate(lines):
+            if re.fullmatch(r"tax\s+invoice", line, re.IGNORECASE):
+                offset = 1 if field == "Company Name" else 2
+                return lines[position + offset] if position + offset < len(lines) else None
+        return None
+    return None
+
+
+class LocalDriveFile(dict):
+    """Subset of pydrive.files.GoogleDriveFile used by the ingestion and watcher modules"""
+
+    def __init__(self, drive, metadata):
+        super().__init__(metadata)
+        self.drive = drive
+        self.content = None
+
+    def Upload(self):
+        self.setdefault("id", uuid.uuid4().hex)
+        self.setdefault("title", self["id"])
+        path = os.path.join(self.drive.root, self["id"])
+        if self.content is not None:
+            self.content.seek(0)
+            with open(path, "wb") as f:
+                shutil.copyfileobj(self.content, f)
+        with self.drive.lock:
+            self.drive.files[self["id"]] = {**self.drive.files.get(self["id"], {}),
+                                            **{k: v for k, v in self.items()}, "path": path}
+            self.drive.uploads += 1
+
+    def SetContentFile(self, path):
+        with open(path, "rb") as f:
+            self.content = io.BytesIO(f.read())
+
+    def FetchMetadata(self, fields=None):
+        with self.drive.lock:
+            stored = self.drive.files.get(self["id"], {})
+        self.update({k: v for k, v in stored.items() if k != "path"})
+
+    def GetContentFile(self, filename):
+        with self.drive.lock:
+            path = self.drive.files[self["id"]]["path"]
+        shutil.copyfile(path, filename)
+
+
+class LocalDrive:
+    """Directory-backed stand-in for pydrive.drive.GoogleDrive"""
+
+    def __init__(self, root):
+        self.root = root
+        self.files = {}
+        self.uploads = 0
+        self.lock = threading.Lock()
+        self.auth = _LocalAuth()
+        os.makedirs(root, exist_ok=True)
+
+    def CreateFile(self, metadata=None):
+        return LocalDriveFile(self, metadata or {})
+
+    def ListFile(self, params=None):
+        return _LocalFileList(self)
+
+    def add_file(self, path, title, owner_email, file_id=None):
+        """Seed the folder with an existing file, owned by `owner_email`"""
+        file_id = file_id or uuid.uuid4().hex
+        with self.lock:
+            self.files[file_id] = {
+                "id": file_id, "title": title, "path": path,
+                "owners": [{"emailAddress": owner_email}],
+                "modifiedDate": datetime.now(timezone.utc).isoformat(),
+            }
+        return file_id
+
+    def set_owner(self, file_id, owner_email):
+        with self.lock:
+            self.files.setdefault(file_id, {"id": file_id})["owners"] = [{"emailAddress": owner_email}]
+
+
+class _LocalFileList:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def GetList(self):
+        with self.drive.lock:
+            stored = [dict(m) for m in self.drive.files.values() if "path" in m]
+        stored.sort(key=lambda m: m.get("modifiedDate", ""), reverse=True)
+        return [LocalDriveFile(self.drive, {k: v for k, v in m.items() if k != "path"}) for m in stored]
+
+
+class _LocalRequest:
+    def __init__(self, body):
+        self.body = body
+
+    def execute(self):
+        return self.body
+
+
+class _LocalAuth:
+    """Just enough of auth.service for files().generateIds()"""
+
+    @property
+    def service(self):
+        return self
+
+    def files(self):
+        return self
+
+    def generateIds(self, maxResults=10, space="drive"):
+        return _LocalRequest({"ids": [uuid.uuid4().hex for _ in range(maxResults)]})
+
+
+class LocalMailbox:
+    """IMAP stand-in: replays corpus files as the attachment jobs ImapIdleIngestor hands to on_job"""
+
+    CONTENT_TYPES = {"pdf": "application/pdf", "png": "image/png", "jpg": "image/jpeg"}
+
+    def __init__(self, manifest, files_dir):
+        self.manifest = manifest
+        self.files_dir = files_dir
+
+    def deliver(self, on_job):
+        for uid, entry in enumerate(self.manifest["invoices"], start=1):
+            with open(os.path.join(self.files_dir, entry["name"]), "rb") as f:
+                payload = f.read()
+            on_job({
+                "uid": uid,
+                "sender_email": entry["sender_email"],
+                "subject": f"Invoice {entry['name']}",
+                "filename": entry["name"],
+                "content_type": self.CONTENT_TYPES[entry["format"]],
+                "payload": payload,
+            })
+
+
+class StandIns:
+    """Every local stand-in of one benchmark run, installed into helper.clients"""
+
+    def __init__(self, work_dir, db_latency=0.0, smtp_latency=0.0, llm_latency=0.0, llm_per_char=0.0,
+                 llm_per_token=0.0, llm_in_flight=4):
+        self.work_dir = work_dir
+        self.supabase = LocalSupabase(db_latency)
+        self.drive = LocalDrive(os.path.join(work_dir, "drive"))
+        self.llm = LocalLLM(llm_latency, llm_per_char)
+        self.llm_stream = LocalStreamLLM(self.llm, llm_per_token, llm_in_flight)
+        self.outbox = []
+        self.smtp_connections = 0
+        self.smtp_latency = smtp_latency
+
+    def _connect_smtp(self):
+        self.smtp_connections += 1
+        return LocalSMTP(self.outbox, self.smtp_latency)
+
+    def install(self):
+        clients.override("supabase", self.supabase)
+        clients.override("drive", self.drive)
+        clients.override("llm", self.llm)
+        clients.override("llm_stream", self.llm_stream)
+        # The mailer builds one connection per sender thread, so replace the factory too
+        clients.register("smtp", self._connect_smtp)
+        clients.reset("smtp")
+        return self
+
+    def stats(self):
+        return {
+            "supabase_requests": self.supabase.requests,
+            "llm_calls": self.llm.calls,
+            "llm_stream_tokens": self.llm_stream.tokens,
+            "drive_uploads": self.drive.uploads,
+            "emails_sent": len(self.outbox),
+            "smtp_connections": self.smtp_connections,
+        }
@@ -0,0 +1,245 @@
+import json
+import os
+import random
+from datetime import date, timedelta
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+from agent.rules import gstin_check_character
+
+PREFIXES = ["Apex", "Bharat", "Crescent", "Delta", "Everest", "Falcon", "Ganga", "Horizon", "Indus", "Jupiter",
+            "Kaveri", "Lotus", "Meridian", "Narmada", "Orion", "Pinnacle", "Quantum", "Sahyadri", "Trident", "Vertex"]
+NOUNS = ["Traders", "Logistics", "Textiles", "Engineering", "Pharma", "Electricals", "Foods", "Polymers",
+         "Steel", "Software", "Packaging", "Chemicals", "Motors", "Agro", "Papers", "Instruments"]
+SUFFIXES = ["Pvt Ltd", "Ltd", "LLP", "Enterprises", "Industries"]
+CUSTOMERS = ["Acme Retail Pvt Ltd", "Northwind Distributors", "Globex India Ltd", "Initech Services LLP",
+             "Umbrella Healthcare", "Stark Components Ltd", "Wayne Infra Projects", "Hooli Technologies"]
+CITIES = [("Mumbai", "27", "Maharashtra"), ("Bengaluru", "29", "Karnataka"), ("Chennai", "33", "Tamil Nadu"),
+          ("Ahmedabad", "24", "Gujarat"), ("Pune", "27", "Maharashtra"), ("Hyderabad", "36", "Telangana"),
+          ("New Delhi", "07", "Delhi"), ("Kolkata", "19", "West Bengal")]
+STREETS = ["MG Road", "Station Road", "Industrial Estate", "Link Road", "Ring Road", "Nehru Nagar", "Park Street"]
+ITEMS = [("Steel fasteners", "7318"), ("Corrugated boxes", "4819"), ("Cotton fabric", "5208"),
+         ("LED panels", "9405"), ("Software support", "998314"), ("Freight charges", "996511"),
+         ("Industrial valves", "8481"), ("Printed labels", "4821"), ("Copper wire", "7408")]
+PAYMENT_TERMS = ["Net 15", "Net 30", "Net 45", "Due on receipt", "50% advance, balance in 30 days"]
+TAX_RATES = [5, 12, 18]
+DATE_STYLES = ["%d/%m/%Y", "%d-%b-%Y", "%Y-%m-%d", "%d %B %Y"]
+
+# Defects that make an invoice fail the SOP checks, so validation is measured on both outcomes
+DEFECTS = ["missing_gstin", "missing_taxes", "duplicate_number"]
+
+def random_pan(rng):
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    return (''.join(rng.choice(letters) for _ in range(3)) + "C" + rng.choice(letters)
+            + f"{rng.randrange(10000):04d}" + rng.choice(letters))
+
+
+def random_invoice(rng, index, company, sender_email):
+    """Ground-truth field values for one synthetic invoice, keyed like ocr_main.REQUIRED_FIELDS"""
+    city, state_code, state = rng.choice(CITIES)
+    customer_city = rng.choice(CITIES)
+    pan = random_pan(rng)
+    gstin = f"{state_code}{pan}{rng.randrange(1, 10)}Z"
+    gstin += gstin_check_character(gstin)
+
+    items = []
+    for item, hsn in rng.sample(ITEMS, rng.randint(2, 6)):
+        quantity = rng.randint(1, 40)
+        rate = round(rng.uniform(50, 5000), 2)
+        items.append({"description": item, "hsn": hsn, "quantity": quantity, "rate": rate,
+                      "amount": round(quantity * rate, 2)})
+    subtotal = round(sum(item["amount"] for item in items), 2)
+    tax_rate = rng.choice(TAX_RATES)
+    if customer_city[1] == state_code:
+        half = round(subtotal * tax_rate / 200, 2)
+        taxes = {f"CGST @{tax_rate / 2:g}%": half, f"SGST @{tax_rate / 2:g}%": half}
+    else:
+        taxes = {f"IGST @{tax_rate}%": round(subtotal * tax_rate / 100, 2)}
+    invoice_date = date(2024, 1, 1) + timedelta(days=rng.randrange(365))
+
+    return {
+        "fields": {
+            "Company Name": company,
+            "Invoice Number": f"INV/{invoice_date.year}/{index + 1:05d}",
+            "Invoice Date": invoice_date.isoformat(),
+            "GSTIN": gstin,
+            "PAN": pan,
+            "HSN/SAC": items[0]["hsn"],
+            "Taxes": taxes,
+            "Total Amount": round(subtotal + sum(taxes.values()), 2),
+            "Payment Terms": rng.choice(PAYMENT_TERMS),
+            "Currency": "INR",
+            "Customer Name": rng.choice(CUSTOMERS),
+            "Billing Address": f"{rng.randint(1, 300)}, {rng.choice(STREETS)}, {customer_city[0]}, {customer_city[2]}",
+            "Shipping Address": f"{rng.randint(1, 300)}, {rng.choice(STREETS)}, {customer_city[0]}, {customer_city[2]}",
+            "Document Type": "Tax Invoice",
+            "Company Address": f"{rng.randint(1, 300)}, {rng.choice(STREETS)}, {city}, {state}",
+            "Received_From": sender_email,
+        },
+        "items": items,
+        "subtotal": subtotal,
+        "date_style": rng.choice(DATE_STYLES),
+    }
+
+
+def _font(size, bold=False, mono=False):
+    name = "DejaVuSansMono.ttf" if mono else "DejaVuSans-Bold.ttf" if bold else "DejaVuSans.ttf"
+    try:
+        return ImageFont.truetype(name, size)
+    except OSError:
+        return ImageFont.load_default(size)
+
+
+def _money(value):
+    return f"{value:,.2f}"
+
+
+def layout_lines(invoice):
+    """The document as (text, style) lines; fields set to None are left out, as on a defective invoice"""
+    f = invoice["fields"]
+    header = [("TAX INVOICE", "title"), (f["Company Name"], "bold"), (f["Company Address"], "normal")]
+    if f["GSTIN"]:
+        header.append((f"GSTIN: {f['GSTIN']}", "normal"))
+    header += [
+        (f"PAN: {f['PAN']}", "normal"),
+        ("", "normal"),
+        (f"Invoice Number: {f['Invoice Number']}", "normal"),
+        (f"Invoice Date: {date.fromisoformat(f['Invoice Date']).strftime(invoice['date_style'])}", "normal"),
+        ("", "normal"),
+        (f"Bill To: {f['Customer Name']}", "bold"),
+        (f"Billing Address: {f['Billing Address']}", "normal"),
+        (f"Shipping Address: {f['Shipping Address']}", "normal"),
+        ("", "normal"),
+        (f"{'Description':<22}{'HSN/SAC':<10}{'Qty':>5}{'Rate':>12}{'Amount':>14}", "mono"),
+    ]
+    items = [
+        (f"{i['description']:<22}{i['hsn']:<10}{i['quantity']:>5}{_money(i['rate']):>12}{_money(i['amount']):>14}", "mono")
+        for i in invoice["items"]
+    ]
+    footer = [("", "normal"), (f"Sub Total: {_money(invoice['subtotal'])}", "normal")]
+    if f["Taxes"]:
+        footer += [(f"{name}: {_money(amount)}", "normal") for name, amount in f["Taxes"].items()]
+    footer += [
+        (f"Total Amount: INR {_money(f['Total Amount'])}", "bold"),
+        (f"Payment Terms: {f['Payment Terms']}", "normal"),
+        ("", "normal"),
+        ("This is a computer generated invoice.", "normal"),
+    ]
+    return header, items, footer
+
+
+def render_pages(invoice, pages=1, dpi=150):
+    """Render the invoice on `pages` A4 pages, spreading the line items across them"""
+    width, height = int(8.27 * dpi), int(11.69 * dpi)
+    scale = dpi / 150
+    fonts = {
+        "title": _font(int(30 * scale), bold=True),
+        "bold": _font(int(20 * scale), bold=True),
+        "normal": _font(int(18 * scale)),
+        "mono": _font(int(16 * scale), mono=True),
+    }
+    header, items, footer = layout_lines(invoice)
+    pages = max(1, min(pages, len(items)))
+    per_page = -(-len(items) // pages)
+    chunks = [items[i:i + per_page] for i in range(0, len(items), per_page)]
+
+    images = []
+    for number, chunk in enumerate(chunks, start=1):
+        lines = (header if number == 1 else [(f"{invoice['fields']['Company Name']} - continued", "bold")])
+        lines = lines + chunk + (footer if number == len(chunks) else [])
+        lines.append((f"Page {number} of {len(chunks)}", "normal"))
+        image = Image.new("L", (width, height), 255)
+        draw = ImageDraw.Draw(image)
+        y = int(90 * scale)
+        for text, style in lines:
+            if text:
+                draw.text((int(90 * scale), y), text, fill=0, font=fonts[style])
+            y += int((44 if style == "title" else 30) * scale)
+        images.append(image)
+    return images
+
+
+def scan_noise(image, rng):
+    """Make a clean render look like a phone or flatbed scan: skew, blur, grain and specks"""
+    image = image.rotate(rng.uniform(-1.5, 1.5), resample=Image.BICUBIC, expand=False, fillcolor=255)
+    image = image.filter(ImageFilter.GaussianBlur(rng.uniform(0.3, 0.9)))
+    grain = Image.effect_noise(image.size, rng.uniform(20, 45))
+    image = Image.blend(image, grain, rng.uniform(0.08, 0.18))
+    draw = ImageDraw.Draw(image)
+    for _ in range(rng.randint(50, 300)):
+        x, y = rng.randrange(image.width), rng.randrange(image.height)
+        draw.point((x, y), fill=rng.randint(0, 120))
+    return image
+
+
+def save_document(images, path, fmt, dpi, quality):
+    if fmt == "pdf":
+        images[0].save(path, "PDF", resolution=dpi, save_all=True, append_images=images[1:])
+    elif fmt == "jpg":
+        images[0].save(path, "JPEG", quality=quality)
+    else:
+        images[0].save(path, "PNG")
+
+
+def generate_corpus(out_dir, count=50, seed=7, noise_rate=0.5, multipage_rate=0.2, defect_rate=0.2,
+                    dpi=150, formats=("png", "jpg", "pdf")):
+    """
+    Write `count` synthetic invoices to out_dir/files and their ground truth to out_dir/manifest.json.
+
+    Every invoice has a distinct company, so only the injected defects should
+    make validation fail. Multi-page invoices are always PDFs. PDFs are
+    image-only, like scanned documents, so they go through OCR.
+    """
+    rng = random.Random(seed)
+    files_dir = os.path.join(out_dir, "files")
+    os.makedirs(files_dir, exist_ok=True)
+    companies = rng.sample([f"{p} {n} {s}" for p in PREFIXES for n in NOUNS for s in SUFFIXES], count)
+
+    entries = []
+    for index in range(count):
+        sender = f"billing@{companies[index].split()[0].lower()}{index}.example.com"
+        invoice = random_invoice(rng, index, companies[index], sender)
+        fields = invoice["fields"]
+        defects = []
+        if rng.random() < defect_rate:
+            defect = rng.choice(DEFECTS)
+            if defect == "duplicate_number" and entries:
+                fields["Invoice Number"] = rng.choice(entries)["fields"]["Invoice Number"]
+            elif defect == "missing_gstin":
+                fields["GSTIN"] = None
+            elif defect == "missing_taxes":
+                fields["Taxes"] = None
+                fields["Total Amount"] = invoice["subtotal"]
+            if defect != "duplicate_number" or entries:
+                defects.append(defect)
+
+        pages = rng.randint(2, 3) if rng.random() < multipage_rate else 1
+        fmt = "pdf" if pages > 1 else rng.choice(formats)
+        noisy = rng.random() < noise_rate
+        images = render_pages(invoice, pages, dpi)
+        if noisy:
+            images = [scan_noise(image, rng) for image in images]
+        name = f"invoice_{index + 1:05d}.{fmt}"
+        save_document(images, os.path.join(files_dir, name), fmt, dpi, quality=rng.randint(55, 75) if noisy else 90)
+
+        entries.append({
+            "name": name,
+            "format": fmt,
+            "pages": len(images),
+            "noisy": noisy,
+            "sender_email": sender,
+            "defects": defects,
+            "expected_valid": not defects,
+            "fields": fields,
+        })
+
+    manifest = {"seed": seed, "dpi": dpi, "count": count, "invoices": entries}
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"[Bench] Wrote {count} synthetic invoices to {files_dir}")
+    return manifest
+
+
+def load_manifest(out_dir):
+    with open(os.path.join(out_dir, "manifest.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
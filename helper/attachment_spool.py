@@ -0,0 +1,132 @@
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+load_dotenv()
+
+SPOOL_DIR = os.getenv("ATTACHMENT_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "invoice_spool"))
+# Attachments up to this size stay in memory; larger ones are written to SPOOL_DIR
+SPOOL_MEMORY_LIMIT = int(float(os.getenv("ATTACHMENT_SPOOL_MEMORY_MB", "8")) * 1024 * 1024)
+# Total bytes the spool may keep on disk at once; writers wait for space beyond that
+SPOOL_DISK_QUOTA = int(float(os.getenv("ATTACHMENT_SPOOL_DISK_MB", "512")) * 1024 * 1024)
+
+
+class Attachment:
+    """
+    One ingested attachment, held in memory or in a spool file.
+
+    Attachments are reference counted: every consumer (OCR, Drive archival)
+    calls `retain()` and `release()`, and the spool file and its quota are
+    freed when the last reference is released.
+    """
+
+    def __init__(self, spool, filename, content_type=None, data=None, path=None, size=0):
+        self.spool = spool
+        self.filename = filename
+        self.content_type = content_type
+        self.data = data
+        self.path = path
+        self.size = size
+        self._sha256 = None
+        self._refs = 1
+        self._lock = threading.Lock()
+
+    def open(self):
+        """Return a fresh binary stream over the attachment bytes"""
+        if self.data is not None:
+            return io.BytesIO(self.data)
+        return open(self.path, "rb")
+
+    def read(self):
+        with self.open() as f:
+            return f.read()
+
+    def sha256(self):
+        if self._sha256 is None:
+            digest = hashlib.sha256()
+            with self.open() as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+            self._sha256 = digest.hexdigest()
+        return self._sha256
+
+    @contextmanager
+    def as_file(self):
+        """Yield a filesystem path for tools that cannot read from memory (pdftotext, pdfinfo)"""
+        if self.path is not None:
+            yield self.path
+            return
+        path = self.spool.write_temp(self.data, self.filename)
+        try:
+            yield path
+        finally:
+            self.spool.remove(path, len(self.data))
+
+    def retain(self):
+        with self._lock:
+            self._refs += 1
+        return self
+
+    def release(self):
+        with self._lock:
+            self._refs -= 1
+            last = self._refs == 0
+        if last:
+            if self.path is not None:
+                self.spool.remove(self.path, self.size)
+                self.path = None
+            self.data = None
+
+
+class AttachmentSpool:
+    """Hand attachments to the OCR stage without a Drive round trip, within a fixed disk quota"""
+
+    def __init__(self, directory=SPOOL_DIR, memory_limit=SPOOL_MEMORY_LIMIT, disk_quota=SPOOL_DISK_QUOTA):
+        self.directory = directory
+        self.memory_limit = memory_limit
+        self.disk_quota = disk_quota
+        self.disk_used = 0
+        self._cond = threading.Condition()
+        os.makedirs(directory, exist_ok=True)
+
+    def add(self, payload, filename, content_type=None):
+        if len(payload) <= self.memory_limit:
+            return Attachment(self, filename, content_type, data=payload, size=len(payload))
+        path = self.write_temp(payload, filename)
+        return Attachment(self, filename, content_type, path=path, size=len(payload))
+
+    def write_temp(self, payload, filename):
+        """Write bytes to a unique spool file, waiting while the disk quota is used up"""
+        size = len(payload)
+        if size > self.disk_quota:
+            raise ValueError(f"Attachment {filename} ({size} bytes) exceeds the spool disk quota")
+        with self._cond:
+            while self.disk_used + size > self.disk_quota:
+                self._cond.wait()
+            self.disk_used += size
+        _, ext = os.path.splitext(filename or "")
+        path = os.path.join(self.directory, f"{uuid.uuid4().hex}{ext.lower()}")
+        try:
+            with open(path, "wb") as f:
+                f.write(payload)
+        except Exception:
+            self._free(size)
+            raise
+        return path
+
+    def remove(self, path, size):
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"[Spool] Could not remove {path}: {e}")
+        self._free(size)
+
+    def _free(self, size):
+        with self._cond:
+            self.disk_used -= size
+            self._cond.notify_all()
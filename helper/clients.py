@@ -0,0 +1,171 @@
+import os
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# Reference point for the startup report: this module is imported first by the entry points
+_STARTED = time.perf_counter()
+
+_factories = {}
+_instances = {}
+_init_seconds = {}
+_milestones = []
+_lock = threading.RLock()
+_smtp_lock = threading.Lock()
+
+
+def register(name, factory):
+    """Register how to build a client; it is only called on first use"""
+    with _lock:
+        _factories[name] = factory
+
+
+def override(name, instance):
+    """Use a ready-made client (e.g. a local stand-in) instead of building one"""
+    with _lock:
+        _instances[name] = instance
+        _init_seconds[name] = 0.0
+
+
+def get(name):
+    """Return the shared client, building it on first use"""
+    instance = _instances.get(name)
+    if instance is not None:
+        return instance
+    with _lock:
+        instance = _instances.get(name)
+        if instance is None:
+            if name not in _factories:
+                raise KeyError(f"No client registered under '{name}'")
+            started = time.perf_counter()
+            instance = _factories[name]()
+            _init_seconds[name] = time.perf_counter() - started
+            _instances[name] = instance
+            print(f"[Clients] {name} ready in {_init_seconds[name] * 1000:.0f} ms")
+        return instance
+
+
+def build(name):
+    """Build a fresh, unshared client with the registered factory (e.g. one per pooled connection)"""
+    with _lock:
+        if name not in _factories:
+            raise KeyError(f"No client registered under '{name}'")
+        factory = _factories[name]
+    return factory()
+
+
+def reset(name):
+    """Forget a client so the next get() builds a fresh one"""
+    with _lock:
+        _instances.pop(name, None)
+
+
+def warm(*names):
+    """Build the named clients now (all registered ones when none are given)"""
+    for name in names or list(_factories):
+        get(name)
+
+
+def mark(label):
+    """Record a startup milestone, e.g. after imports finish"""
+    _milestones.append((label, time.perf_counter() - _STARTED))
+
+
+def startup_report():
+    """Print how long startup took and which clients were built, and return it as a dict"""
+    report = {
+        "milestones": {label: round(seconds * 1000, 1) for label, seconds in _milestones},
+        "clients_ms": {name: round(seconds * 1000, 1) for name, seconds in _init_seconds.items()},
+        "not_initialized": sorted(set(_factories) - set(_instances)),
+        "elapsed_ms": round((time.perf_counter() - _STARTED) * 1000, 1),
+    }
+    print("[Clients] Startup report")
+    for label, ms in report["milestones"].items():
+        print(f"  - {label}: {ms} ms")
+    for name, ms in report["clients_ms"].items():
+        print(f"  - client {name}: {ms} ms")
+    if report["not_initialized"]:
+        print(f"  - not initialized: {', '.join(report['not_initialized'])}")
+    return report
+
+
+def _build_drive():
+    from pydrive.auth import GoogleAuth
+    from pydrive.drive import GoogleDrive
+
+    gauth = GoogleAuth(settings_file="settings.yaml")
+    gauth.LocalWebserverAuth()
+    return GoogleDrive(gauth)
+
+
+def _build_supabase():
+    from supabase import create_client
+
+    return create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+
+
+def _build_llm():
+    from langchain_ollama import OllamaLLM
+
+    return OllamaLLM(model=os.getenv("OLLAMA_MODEL", "mistral"))  # Requires Ollama to be running
+
+
+def _build_llm_stream():
+    from helper.ollama_stream import OllamaStreamClient
+
+    return OllamaStreamClient()
+
+
+def _build_smtp():
+    server = smtplib.SMTP(os.getenv("SMTP_HOST"), int(os.getenv("SMTP_PORT")))
+    server.starttls()
+    server.login(os.getenv("SMTP_USER"), os.getenv("SMTP_PASS"))
+    return server
+
+
+register("drive", _build_drive)
+register("supabase", _build_supabase)
+register("llm", _build_llm)
+register("llm_stream", _build_llm_stream)
+register("smtp", _build_smtp)
+
+
+def get_drive():
+    return get("drive")
+
+
+def get_supabase():
+    return get("supabase")
+
+
+def get_llm():
+    return get("llm")
+
+
+def get_llm_stream():
+    return get("llm_stream")
+
+
+@contextmanager
+def smtp_session():
+    """
+    Yield the shared, logged-in SMTP connection, reconnecting if the server dropped it.
+
+    Callers hold the connection exclusively for the duration of the block.
+    """
+    with _smtp_lock:
+        server = get("smtp")
+        try:
+            server.noop()
+        except (smtplib.SMTPException, OSError):
+            reset("smtp")
+            server = get("smtp")
+        try:
+            yield server
+        except (smtplib.SMTPServerDisconnected, OSError):
+            reset("smtp")
+            raise
@@ -1,14 +1,9 @@
-from pydrive.auth import GoogleAuth
-from pydrive.drive import GoogleDrive
+from helper.clients import get_drive
 
 
-gauth = GoogleAuth(settings_file="settings.yaml")
-gauth.LocalWebserverAuth()  
-drive = GoogleDrive(gauth)
-
 def get_drive_uploader_email(file_id):
     try:
-        file = drive.CreateFile({'id': file_id})
+        file = get_drive().CreateFile({'id': file_id})
         file.FetchMetadata(fields='owners')
         owners = file.get('owners', [])
         if owners:
@@ -0,0 +1,270 @@
+import atexit
+import os
+import queue
+import smtplib
+import threading
+import time
+import traceback
+from email.mime.text import MIMEText
+
+from dotenv import load_dotenv
+from helper import clients, metrics
+load_dotenv()
+
+# Send rejection emails from background threads instead of the per-invoice path
+MAILER_ENABLED = os.getenv("SMTP_ASYNC", "true").lower() == "true"
+# Persistent SMTP connections, one per sender thread
+MAILER_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "1"))
+# Provider-friendly ceiling on messages sent per minute across the pool (0 = unlimited)
+MAILER_RATE_PER_MINUTE = float(os.getenv("SMTP_RATE_PER_MINUTE", "20"))
+# Seconds to collect rejections for the same sender into one digest email (0 = one email per invoice)
+MAILER_DIGEST_WINDOW = float(os.getenv("SMTP_DIGEST_WINDOW", "0"))
+# Connections idle longer than this are checked with NOOP before the next send
+MAILER_IDLE_CHECK = float(os.getenv("SMTP_IDLE_CHECK", "30"))
+
+REJECTION_SUBJECT = "Invoice Validation Failed"
+
+
+def log_send_result(recipient, ok, error):
+    """Callback used when the caller passes none: print the recipient and error of a failed email"""
+    if not ok:
+        print(f"[Mailer] Failed to email {recipient}: {error}")
+
+
+def build_message(recipient, subject, body):
+    msg = MIMEText(body)
+    msg["Subject"] = subject
+    msg["From"] = os.getenv("SMTP_USER")
+    msg["To"] = recipient
+    return msg
+
+
+def rejection_body(rejections):
+    """
+    Email body for a list of (invoice, reason) pairs.
+
+    `invoice` names the rejected invoice (its number, file name or file_id) so
+    a digest tells the sender which reason belongs to which invoice; it may be
+    None when nothing identifies it.
+    """
+    if len(rejections) == 1:
+        invoice, reason = rejections[0]
+        name = f"invoice {invoice}" if invoice else "invoice"
+        return f"Your {name} was rejected for this reason:\n\n{reason}"
+    lines = "\n".join(
+        f"{i}. {invoice}: {reason}" if invoice else f"{i}. {reason}"
+        for i, (invoice, reason) in enumerate(rejections, start=1)
+    )
+    return f"{len(rejections)} of your invoices were rejected for these reasons:\n\n{lines}"
+
+
+class RateLimiter:
+    """Space calls at least 60 / rate_per_minute seconds apart, shared by every sender thread"""
+
+    def __init__(self, rate_per_minute):
+        self.interval = 60.0 / rate_per_minute if rate_per_minute > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class Mailer:
+    """
+    Queue outgoing emails and send them over a small pool of persistent SMTP connections.
+
+    Each sender thread keeps its own logged-in connection, checks it with NOOP
+    after it has been idle and reconnects when the server dropped it. Sends are
+    spaced by a shared rate limit. With a digest window, rejections for the
+    same recipient are held for that long and sent as one email.
+    """
+
+    def __init__(self, pool_size=MAILER_POOL_SIZE, rate_per_minute=MAILER_RATE_PER_MINUTE,
+                 digest_window=MAILER_DIGEST_WINDOW, max_retries=3, retry_backoff=1.0):
+        self.pool_size = max(1, pool_size)
+        self.digest_window = digest_window
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.limiter = RateLimiter(rate_per_minute)
+        self.sent = 0
+        self.failed = 0
+        self.digested = 0
+        self._queue = queue.Queue()
+        self._digests = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._send_loop, name=f"smtp-sender-{i}", daemon=True)
+            for i in range(self.pool_size)
+        ]
+        if digest_window > 0:
+            self._threads.append(threading.Thread(target=self._digest_loop, name="smtp-digest", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def send(self, recipient, subject, body, callback=None):
+        """Queue one email; `callback(recipient, ok, error)` is called once it is sent or given up on"""
+        if self._closed:
+            raise RuntimeError("Mailer is closed")
+        self._queue.put((recipient, subject, body, [callback or log_send_result]))
+
+    def send_rejection(self, recipient, reason, callback=None, invoice=None):
+        """Queue a rejection notice for `invoice`, folding it into the recipient's pending digest if enabled"""
+        if self.digest_window <= 0:
+            return self.send(recipient, REJECTION_SUBJECT, rejection_body([(invoice, reason)]), callback)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Mailer is closed")
+            digest = self._digests.get(recipient)
+            if digest is None:
+                digest = self._digests[recipient] = {
+                    "due": time.monotonic() + self.digest_window, "reasons": [], "callbacks": [],
+                }
+                self._cond.notify()
+            else:
+                self.digested += 1
+            digest["reasons"].append((invoice, reason))
+            digest["callbacks"].append(callback or log_send_result)
+
+    def _digest_loop(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    now = time.monotonic()
+                    if any(d["due"] <= now for d in self._digests.values()):
+                        break
+                    if self._digests:
+                        self._cond.wait(min(d["due"] for d in self._digests.values()) - now)
+                    else:
+                        self._cond.wait()
+                closed = self._closed
+            self._release_digests(everything=closed)
+            if closed:
+                return
+
+    def _release_digests(self, everything=False):
+        now = time.monotonic()
+        with self._cond:
+            due = [r for r, d in self._digests.items() if everything or d["due"] <= now]
+            digests = [(r, self._digests.pop(r)) for r in due]
+        for recipient, digest in digests:
+            body = rejection_body(digest["reasons"])
+            self._queue.put((recipient, REJECTION_SUBJECT, body, digest["callbacks"]))
+
+    def _send_loop(self):
+        server, last_used = None, 0.0
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            recipient, subject, body, callbacks = item
+            try:
+                server, last_used, error = self._deliver(server, last_used, recipient, subject, body)
+            except Exception as e:
+                # Anything unexpected fails this message only; the thread moves on to the next one
+                print(f"[Mailer] Unexpected error emailing {recipient}: {e}")
+                traceback.print_exc()
+                server, error = _quit(server), e
+            if error is None:
+                self.sent += 1
+            else:
+                self.failed += 1
+            metrics.inc("emails", outcome="sent" if error is None else "failed")
+            for callback in callbacks:
+                try:
+                    callback(recipient, error is None, error)
+                except Exception as e:
+                    print(f"[Mailer] Callback error for {recipient}: {e}")
+        _quit(server)
+
+    def _deliver(self, server, last_used, recipient, subject, body):
+        """Send one email with retries; returns the (possibly new) connection, its last use and the error if any"""
+        msg = build_message(recipient, subject, body)
+        if server is not None and time.monotonic() - last_used > MAILER_IDLE_CHECK:
+            try:
+                server.noop()
+            except (smtplib.SMTPException, OSError):
+                # The server closed the idle connection; log in again below
+                server = _quit(server)
+        error = None
+        for attempt in range(self.max_retries):
+            try:
+                if server is None:
+                    with metrics.span("smtp.connect"):
+                        server = clients.build("smtp")
+                self.limiter.wait()
+                with metrics.span("smtp.send", recipient=recipient):
+                    server.send_message(msg)
+                return server, time.monotonic(), None
+            except (smtplib.SMTPException, OSError) as e:
+                error = e
+                # Address refusals will not succeed on a new connection either
+                if isinstance(e, (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused)):
+                    break
+                server = _quit(server)
+                time.sleep(self.retry_backoff * (2 ** attempt))
+        return server, last_used, error
+
+    def close(self):
+        """Send pending digests and queued emails, then close every connection"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        for thread in self._threads[self.pool_size:]:
+            thread.join()
+        for _ in range(self.pool_size):
+            self._queue.put(None)
+        for thread in self._threads[:self.pool_size]:
+            thread.join()
+
+    def stats(self):
+        with self._cond:
+            waiting = sum(len(d["reasons"]) for d in self._digests.values())
+        return {"queued": self._queue.qsize(), "in_digests": waiting, "sent": self.sent,
+                "failed": self.failed, "digested": self.digested}
+
+
+def _quit(server):
+    if server is not None:
+        try:
+            server.quit()
+        except Exception:
+            pass
+    return None
+
+
+_mailer = None
+_mailer_lock = threading.Lock()
+
+
+def get_mailer():
+    """Return the shared mailer, starting its sender threads on first use"""
+    global _mailer
+    with _mailer_lock:
+        if _mailer is None:
+            _mailer = Mailer()
+            metrics.register_gauge("mail_queue_depth", lambda: _mailer.stats()["queued"] if _mailer else 0)
+        return _mailer
+
+
+def close_mailer():
+    """Deliver everything still queued; registered to run at interpreter exit"""
+    global _mailer
+    with _mailer_lock:
+        mailer, _mailer = _mailer, None
+    if mailer is not None:
+        mailer.close()
+        print(f"[Mailer] {mailer.stats()}")
+
+
+atexit.register(close_mailer)
@@ -0,0 +1,288 @@
+import atexit
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from dotenv import load_dotenv
+load_dotenv()
+
+METRICS_ENABLED = os.getenv("METRICS", "true").lower() == "true"
+# JSON-lines file that receives one record per finished span (empty = no trace file)
+METRICS_TRACE_PATH = os.getenv("METRICS_TRACE_PATH", "")
+
+# Upper bounds, in seconds, of the span duration histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Attributes of the enclosing spans (file_id, stage, ...), inherited by nested spans on the same thread
+_context = contextvars.ContextVar("metrics_context", default={})
+# List that finished spans are also appended to inside collect(), e.g. in an OCR pool process
+_collected = contextvars.ContextVar("metrics_collected", default=None)
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+                break
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th observation (coarse, like Prometheus)"""
+        if not self.count:
+            return 0.0
+        target, seen = q * self.count, 0
+        for bound, n in zip(BUCKETS, self.buckets):
+            seen += n
+            if seen >= target:
+                return bound
+        return self.max
+
+
+class Registry:
+    """Counters, span histograms and gauges for one process, plus the optional trace file"""
+
+    def __init__(self, trace_path=METRICS_TRACE_PATH):
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+        self._trace = None
+        if trace_path:
+            self.open_trace(trace_path)
+
+    def open_trace(self, path):
+        """Append one JSON line per finished span to `path` from now on"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        trace = open(path, "a", encoding="utf-8", buffering=1)
+        with self._lock:
+            previous, self._trace = self._trace, trace
+        if previous is not None:
+            previous.close()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, span_name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(span_name)
+            if histogram is None:
+                histogram = self.histograms[span_name] = Histogram()
+            histogram.observe(seconds)
+
+    def register_gauge(self, name, read):
+        """`read()` returns a number, or a dict of label value -> number, whenever metrics are collected"""
+        with self._lock:
+            self.gauges[name] = read
+
+    def trace(self, record):
+        if self._trace is not None:
+            line = json.dumps(record, default=str)
+            with self._lock:
+                self._trace.write(line + "\n")
+
+    def read_gauges(self):
+        with self._lock:
+            gauges = dict(self.gauges)
+        values = {}
+        for name, read in gauges.items():
+            try:
+                values[name] = read()
+            except Exception as e:
+                print(f"[Metrics] Gauge {name} failed: {e}")
+        return values
+
+    def snapshot(self):
+        """Everything as plain dicts, for /metrics.json and reports"""
+        with self._lock:
+            counters = {}
+            for (name, labels), value in self.counters.items():
+                label = ",".join(f"{k}={v}" for k, v in labels)
+                counters[f"{name}{{{label}}}" if label else name] = value
+            spans = {
+                name: {
+                    "count": h.count,
+                    "sum_seconds": round(h.sum, 4),
+                    "mean_ms": round(h.sum / h.count * 1000, 2) if h.count else 0.0,
+                    "p50_ms_le": h.quantile(0.5) * 1000,
+                    "p90_ms_le": h.quantile(0.9) * 1000,
+                    "p99_ms_le": h.quantile(0.99) * 1000,
+                    "max_ms": round(h.max * 1000, 2),
+                }
+                for name, h in self.histograms.items()
+            }
+        return {"spans": spans, "counters": counters, "gauges": self.read_gauges()}
+
+    def render_prometheus(self):
+        """Prometheus text exposition format"""
+        lines = ["# TYPE invoice_span_seconds histogram"]
+        with self._lock:
+            for name, h in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, n in zip(BUCKETS, h.buckets):
+                    cumulative += n
+                    lines.append(f'invoice_span_seconds_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'invoice_span_seconds_bucket{{span="{name}",le="+Inf"}} {h.count}')
+                lines.append(f'invoice_span_seconds_sum{{span="{name}"}} {h.sum:.6f}')
+                lines.append(f'invoice_span_seconds_count{{span="{name}"}} {h.count}')
+            counters = sorted(self.counters.items())
+        typed = set()
+        for (name, labels), value in counters:
+            metric = f"invoice_{name}_total".replace(".", "_")
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            label = ",".join(f'{k}="{v}"' for k, v in labels)
+            lines.append(f"{metric}{{{label}}} {value}" if label else f"{metric} {value}")
+        for name, value in sorted(self.read_gauges().items()):
+            metric = f"invoice_{name}".replace(".", "_")
+            lines.append(f"# TYPE {metric} gauge")
+            if isinstance(value, dict):
+                for label, v in sorted(value.items()):
+                    lines.append(f'{metric}{{name="{label}"}} {v}')
+            else:
+                lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        if self._trace is not None:
+            with self._lock:
+                self._trace.close()
+                self._trace = None
+
+
+registry = Registry()
+atexit.register(registry.close)
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Time a block as span `name`, tagged with attributes such as file_id.
+
+    Attributes of enclosing spans are inherited, so a per-page OCR span inside
+    a stage span carries the invoice's file_id. Exceptions are counted under
+    span_errors and re-raised.
+    """
+    if not METRICS_ENABLED:
+        yield
+        return
+    parent = _context.get()
+    merged = {**parent, **{k: v for k, v in attrs.items() if v is not None}}
+    token = _context.set(merged)
+    started = time.perf_counter()
+    wall = time.time()
+    ok = True
+    try:
+        yield
+    except BaseException:
+        ok = False
+        registry.inc("span_errors", span=name)
+        raise
+    finally:
+        _context.reset(token)
+        _finish(name, time.perf_counter() - started, wall, ok, merged)
+
+
+def record(name, seconds, **attrs):
+    """Record a span timed by the caller, e.g. when the work happens inside a generator"""
+    if METRICS_ENABLED:
+        merged = {**_context.get(), **{k: v for k, v in attrs.items() if v is not None}}
+        _finish(name, seconds, time.time() - seconds, True, merged)
+
+
+def _finish(name, seconds, wall, ok, attrs):
+    collected = _collected.get()
+    if collected is not None:
+        collected.append((name, seconds, attrs))
+    registry.observe(name, seconds)
+    registry.trace({
+        "ts": round(wall, 6), "span": name, "duration_ms": round(seconds * 1000, 3), "ok": ok,
+        "thread": threading.current_thread().name, **attrs,
+    })
+
+
+@contextmanager
+def collect():
+    """
+    Yield a list that receives (name, seconds, attrs) for every span finished in the block.
+
+    Child processes have their own registry, so pool workers return this list
+    with their result and the parent passes it to replay().
+    """
+    spans = []
+    token = _collected.set(spans)
+    try:
+        yield spans
+    finally:
+        _collected.reset(token)
+
+
+def replay(spans):
+    """Record spans collected in another process, under the caller's span attributes"""
+    for name, seconds, attrs in spans:
+        record(name, seconds, **attrs)
+
+
+def timed(name):
+    """Decorator form of span()"""
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def inc(name, value=1, **labels):
+    if METRICS_ENABLED:
+        registry.inc(name, value, **labels)
+
+
+def register_gauge(name, read):
+    registry.register_gauge(name, read)
+
+
+def create_metrics_app(app=None):
+    """Add /metrics (Prometheus text) and /metrics.json to a FastAPI app, creating one if needed"""
+    from fastapi import FastAPI
+    from fastapi.responses import JSONResponse, PlainTextResponse
+
+    app = app or FastAPI(title="Invoice pipeline metrics")
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    def metrics():
+        return PlainTextResponse(registry.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+    @app.get("/metrics.json")
+    def metrics_json():
+        return JSONResponse(registry.snapshot())
+
+    return app
+
+
+def start_metrics_server(port, host="0.0.0.0"):
+    """Serve the metrics endpoints from a background thread"""
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(create_metrics_app(), host=host, port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="metrics-http", daemon=True).start()
+    print(f"[Metrics] Serving http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,166 @@
+import json
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+from helper import metrics
+
+load_dotenv()
+
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+# How long Ollama keeps the model in memory after a request (e.g. "30m", "-1" = until restarted)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# Generation requests sent to Ollama at once; the server needs OLLAMA_NUM_PARALLEL at least this high
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "2"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "300"))
+
+
+class JsonObjectScanner:
+    """
+    Follow a token stream and tell when its first top-level JSON object is complete.
+
+    Anything before the opening brace (a ```json fence, a preamble) is dropped.
+    Braces inside strings and escaped quotes are handled, so only the real
+    closing brace ends the object.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.started = False
+        self.done = False
+
+    def feed(self, chunk):
+        """Consume the next piece of output; True once the object has closed"""
+        if self.done:
+            return True
+        start = 0
+        for i, char in enumerate(chunk):
+            if not self.started:
+                if char == "{":
+                    self.started = True
+                    self.depth = 1
+                    start = i
+                continue
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == "{":
+                self.depth += 1
+            elif char == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.parts.append(chunk[start:i + 1])
+                    self.done = True
+                    return True
+        if self.started:
+            self.parts.append(chunk[start:])
+        return False
+
+    @property
+    def text(self):
+        return "".join(self.parts)
+
+
+class OllamaStreamClient:
+    """
+    Streaming client for Ollama's /api/generate, built for JSON extraction.
+
+    Tokens are read as they are generated and the request is closed as soon as
+    the JSON object in the answer is complete, which stops generation on the
+    server instead of waiting for the commentary models like to add after it.
+    At most `max_in_flight` requests run at once across all threads, and every
+    request asks Ollama to keep the model loaded for `keep_alive`.
+    """
+
+    def __init__(self, model=None, host=OLLAMA_HOST, keep_alive=OLLAMA_KEEP_ALIVE,
+                 max_in_flight=LLM_MAX_IN_FLIGHT, timeout=LLM_TIMEOUT, options=None):
+        self.model = model or os.getenv("OLLAMA_MODEL", "mistral")
+        self.url = f"{host.rstrip('/')}/api/generate"
+        self.keep_alive = keep_alive
+        self.max_in_flight = max(1, max_in_flight)
+        self.timeout = timeout
+        self.options = options or {}
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._local = threading.local()
+
+    def _session(self):
+        # One keep-alive connection per worker thread
+        session = getattr(self._local, "session", None)
+        if session is None:
+            import requests
+
+            session = self._local.session = requests.Session()
+        return session
+
+    def _payload(self, prompt, format=None):
+        payload = {"model": self.model, "prompt": prompt, "stream": True, "keep_alive": self.keep_alive}
+        if format is not None:
+            payload["format"] = format
+        if self.options:
+            payload["options"] = self.options
+        return payload
+
+    def stream(self, prompt, format=None):
+        """
+        Yield the answer's text pieces as Ollama generates them; closing the generator aborts the request.
+
+        `format` is passed through to Ollama: "json", or a JSON schema the answer is constrained to.
+        """
+        with self._session().post(self.url, json=self._payload(prompt, format), stream=True,
+                                  timeout=(10, self.timeout)) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("error"):
+                    raise RuntimeError(f"Ollama: {chunk['error']}")
+                if chunk.get("response"):
+                    yield chunk["response"]
+                if chunk.get("done"):
+                    return
+
+    def complete(self, prompt, format=None):
+        """
+        Return the first JSON object in the model's answer, stopping generation once it closes.
+
+        If the answer never closes an object, the raw text is returned for the caller to repair.
+        """
+        scanner = JsonObjectScanner()
+        raw = []
+        started = time.perf_counter()
+        with self._slots:
+            metrics.record("llm.wait", time.perf_counter() - started)
+            started = time.perf_counter()
+            tokens = self.stream(prompt, format)
+            try:
+                for piece in tokens:
+                    if not raw:
+                        metrics.record("llm.first_token", time.perf_counter() - started)
+                    raw.append(piece)
+                    if scanner.feed(piece):
+                        break
+            finally:
+                tokens.close()
+        if scanner.done:
+            metrics.inc("llm_early_stops")
+            return scanner.text
+        return "".join(raw)
+
+    def preload(self):
+        """Load the model into memory now (a request without a prompt) so the first invoice does not wait for it"""
+        with metrics.span("llm.preload", model=self.model):
+            response = self._session().post(
+                self.url, json={"model": self.model, "keep_alive": self.keep_alive}, timeout=(10, self.timeout)
+            )
+            response.raise_for_status()
@@ -0,0 +1,274 @@
+import atexit
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+from helper import metrics
+load_dotenv()
+
+WRITE_BEHIND_ENABLED = os.getenv("SUPABASE_WRITE_BEHIND", "true").lower() == "true"
+WRITE_BEHIND_MAX_ROWS = int(os.getenv("SUPABASE_WRITE_BEHIND_MAX_ROWS", "50"))
+WRITE_BEHIND_MAX_DELAY = float(os.getenv("SUPABASE_WRITE_BEHIND_MAX_DELAY", "2.0"))
+# Keys per UPDATE ... in_() request; PostgREST takes them in the URL
+UPDATE_KEYS_PER_REQUEST = 200
+# Postgres error for an ON CONFLICT target without a matching unique constraint
+NO_CONFLICT_TARGET = "42P10"
+
+
+def is_missing_conflict_target(error):
+    # postgrest raises APIError with the SQLSTATE in .code; other clients only put it in the message
+    return getattr(error, "code", None) == NO_CONFLICT_TARGET or NO_CONFLICT_TARGET in str(error)
+
+
+def missing_key_message(table, key):
+    return (f"{table} has no unique constraint on {key}, which bulk upserts need. Run "
+            f"'alter table public.{table} add constraint {table}_{key}_key unique ({key});' "
+            f"or set SUPABASE_WRITE_BEHIND=false")
+
+
+def check_upsert_key(client, table, key="file_id"):
+    """
+    Fail fast when `table` cannot take upserts on `key`.
+
+    Upserting no rows writes nothing, but Postgres still rejects the ON CONFLICT
+    target if no unique constraint covers it. Other errors are only reported, so
+    an unreachable database does not stop startup.
+    """
+    try:
+        client.table(table).upsert([], on_conflict=key).execute()
+    except Exception as e:
+        if is_missing_conflict_target(e):
+            raise RuntimeError(missing_key_message(table, key)) from e
+        print(f"[WriteBehind] Could not check the {table} upsert key: {e}")
+
+
+def log_write_result(table, key, ok, error):
+    """Default per-row callback: report failures, stay quiet on success"""
+    if not ok:
+        print(f"[WriteBehind] Failed to write {table} row {key}: {error}")
+
+
+_context = threading.local()
+
+
+@contextmanager
+def write_callback(callback):
+    """Use `callback` for rows queued (or written directly) by this thread inside the block"""
+    previous = getattr(_context, "callback", None)
+    _context.callback = callback
+    try:
+        yield callback
+    finally:
+        _context.callback = previous
+
+
+def current_callback():
+    return getattr(_context, "callback", None) or log_write_result
+
+
+def report_write(table, key, ok, error=None):
+    """Report a write made without the buffer to this thread's callback"""
+    metrics.inc("db_rows", table=table, outcome="written" if ok else "failed")
+    try:
+        current_callback()(table, key, ok, error)
+    except Exception as e:
+        print(f"[WriteBehind] Callback error for {key}: {e}")
+
+
+class WriteBehindBuffer:
+    """
+    Collect rows for one Supabase table and write them as bulk upserts.
+
+    Rows are merged by `key` while pending, so a flag update queued before its
+    insert is flushed becomes part of the same row. Updates to rows that are
+    not pending are sent as UPDATEs, never upserts, so they cannot create a
+    partial row when the insert failed. A batch is flushed when `max_rows`
+    rows are pending or the oldest has waited `max_delay` seconds. Failed
+    batches are retried, then written row by row so every callback is told
+    whether its own row made it.
+    """
+
+    def __init__(self, client, table, key="file_id", max_rows=WRITE_BEHIND_MAX_ROWS,
+                 max_delay=WRITE_BEHIND_MAX_DELAY, max_retries=3, retry_backoff=0.5):
+        self.client = client
+        self.table = table
+        self.key = key
+        self.max_rows = max(1, max_rows)
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self._pending = {}
+        self._updates = {}
+        self._callbacks = {}
+        self._oldest = None
+        self._cond = threading.Condition()
+        self._closed = False
+        self._flush_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=f"write-behind-{table}", daemon=True)
+        self._thread.start()
+
+    def add(self, row, callback=None, update=False):
+        """
+        Queue a row; `callback(table, key, ok, error)` is called once it is written or given up on.
+
+        With `update`, the row only changes an existing one: it is merged into a
+        pending insert for the same key, otherwise written with UPDATE.
+        """
+        key = row[self.key]
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"Write-behind buffer for {self.table} is closed")
+            if key in self._pending:
+                self._pending[key].update(row)
+            elif update:
+                self._updates.setdefault(key, {}).update(row)
+            else:
+                self._pending[key] = dict(row)
+            self._callbacks.setdefault(key, []).append(callback or current_callback())
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            if len(self._pending) + len(self._updates) >= self.max_rows:
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if len(self._pending) + len(self._updates) >= self.max_rows:
+                        break
+                    if self._oldest is not None:
+                        remaining = self.max_delay - (time.monotonic() - self._oldest)
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                closed = self._closed
+            self.flush()
+            if closed:
+                return
+
+    def flush(self):
+        """Write every pending row now"""
+        with self._flush_lock:
+            with self._cond:
+                rows, updates, callbacks = self._pending, self._updates, self._callbacks
+                self._pending, self._updates, self._callbacks, self._oldest = {}, {}, {}, None
+            # PostgREST bulk upserts need identical columns in every row, so group by column set
+            groups = {}
+            for row in rows.values():
+                groups.setdefault(frozenset(row), []).append(row)
+            for batch in groups.values():
+                self._write_batch(batch, callbacks)
+            # Updates after the inserts of the same flush; rows setting the same values share one UPDATE
+            changes = {}
+            for key, row in updates.items():
+                values = tuple(sorted((column, value) for column, value in row.items() if column != self.key))
+                changes.setdefault(values, []).append(key)
+            for values, keys in changes.items():
+                self._write_update(dict(values), keys, callbacks)
+
+    def _write_update(self, values, keys, callbacks):
+        # The keys travel in the query string, so long lists are split to keep URLs short
+        if len(keys) > UPDATE_KEYS_PER_REQUEST:
+            for start in range(0, len(keys), UPDATE_KEYS_PER_REQUEST):
+                self._write_update(values, keys[start:start + UPDATE_KEYS_PER_REQUEST], callbacks)
+            return
+        rows = [{self.key: key} for key in keys]
+        error = None
+        for attempt in range(self.max_retries):
+            try:
+                with metrics.span("db.update", table=self.table, rows=len(keys)):
+                    self.client.table(self.table).update(values).in_(self.key, keys).execute()
+                self.batches += 1
+                self._report(rows, callbacks, True, None)
+                return
+            except Exception as e:
+                error = e
+                time.sleep(self.retry_backoff * (2 ** attempt))
+        self._report(rows, callbacks, False, error)
+
+    def _write_batch(self, batch, callbacks):
+        error = None
+        for attempt in range(self.max_retries):
+            try:
+                with metrics.span("db.upsert", table=self.table, rows=len(batch)):
+                    self.client.table(self.table).upsert(batch, on_conflict=self.key).execute()
+                self.batches += 1
+                self._report(batch, callbacks, True, None)
+                return
+            except Exception as e:
+                error = e
+                if is_missing_conflict_target(e):
+                    # Every retry and every single row would fail the same way
+                    print(f"[WriteBehind] {missing_key_message(self.table, self.key)}")
+                    self._report(batch, callbacks, False, e)
+                    return
+                time.sleep(self.retry_backoff * (2 ** attempt))
+        print(f"[WriteBehind] Batch of {len(batch)} {self.table} rows failed ({error}), retrying row by row")
+        for row in batch:
+            try:
+                with metrics.span("db.upsert", table=self.table, rows=1):
+                    self.client.table(self.table).upsert([row], on_conflict=self.key).execute()
+                self._report([row], callbacks, True, None)
+            except Exception as e:
+                self._report([row], callbacks, False, e)
+
+    def _report(self, rows, callbacks, ok, error):
+        metrics.inc("db_rows", len(rows), table=self.table, outcome="written" if ok else "failed")
+        for row in rows:
+            if ok:
+                self.written += 1
+            else:
+                self.failed += 1
+            for callback in callbacks.get(row[self.key], []):
+                try:
+                    callback(self.table, row[self.key], ok, error)
+                except Exception as e:
+                    print(f"[WriteBehind] Callback error for {row[self.key]}: {e}")
+
+    def close(self):
+        """Flush what is left and stop the background thread"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._pending) + len(self._updates)
+        return {"pending": pending, "written": self.written, "failed": self.failed, "batches": self.batches}
+
+
+_buffers = {}
+_buffers_lock = threading.Lock()
+
+
+def get_write_buffer(client, table):
+    """Return the shared buffer for `table`, creating it on first use"""
+    with _buffers_lock:
+        buffer = _buffers.get(table)
+        if buffer is None:
+            buffer = WriteBehindBuffer(client, table)
+            _buffers[table] = buffer
+            metrics.register_gauge("db_pending_rows", lambda: {t: b.stats()["pending"] for t, b in list(_buffers.items())})
+        return buffer
+
+
+def flush_all():
+    """Flush every buffer and stop their threads; registered to run at interpreter exit"""
+    with _buffers_lock:
+        buffers = list(_buffers.values())
+        _buffers.clear()
+    for buffer in buffers:
+        buffer.close()
+
+
+atexit.register(flush_all)
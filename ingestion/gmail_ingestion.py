@@ -1,21 +1,25 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 import imaplib
 import email
 from email.header import decode_header
-import os
 import time
 import schedule
-from pydrive.auth import GoogleAuth
-from pydrive.drive import GoogleDrive
 from dotenv import load_dotenv
+from helper.clients import get_drive
+from helper import metrics
 import re
 import uuid
+import io
+import json
+import shutil
+import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 load_dotenv()
 
-gauth = GoogleAuth(settings_file="settings.yaml")
-gauth.LocalWebserverAuth()  
-drive = GoogleDrive(gauth)
-
 EMAIL_USER = os.getenv('EMAIL_USER')
 EMAIL_PASS = os.getenv('EMAIL_PASS')
 DRIVE_FOLDER_ID = os.getenv('DRIVE_FOLDER_ID')
@@ -23,6 +27,7 @@ DRIVE_FOLDER_ID = os.getenv('DRIVE_FOLDER_ID')
 DOWNLOAD_FOLDER = "temp_downloads"
 os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
 
+@metrics.timed("gmail.check")
 def check_email_and_upload():
     print("Checking inbox...")
     mail = None
@@ -128,11 +133,11 @@ def check_email_and_upload():
                                             print(f"Successfully uploaded. File ID: {file_id}")
                                             print(f"Sender: {sender_email}")
                                             
-                                            #try:
-                                                #os.remove(filepath)
-                                                #print(f"Cleaned up local file: {filepath}")
-                                            #except OSError as e:
-                                             #   print(f"Warning: Could not remove local file {filepath}: {e}")
+                                            try:
+                                                os.remove(filepath)
+                                                print(f"Cleaned up local file: {filepath}")
+                                            except OSError as e:
+                                                print(f"Warning: Could not remove local file {filepath}: {e}")
                                             
                                             return file_id, sender_email
                                         else:
@@ -190,13 +195,14 @@ def upload_to_drive(filepath):
         filename = os.path.basename(filepath)
         
         # Create file in Google Drive
-        file_drive = drive.CreateFile({
+        file_drive = get_drive().CreateFile({
             'title': filename, 
             "parents": [{"id": DRIVE_FOLDER_ID}]
         })
         
         file_drive.SetContentFile(filepath)
-        file_drive.Upload()
+        with metrics.span("drive.upload"):
+            file_drive.Upload()
         
         print(f"Uploaded to Google Drive: {filename}")
         return file_drive['id']
@@ -205,6 +211,210 @@ def upload_to_drive(filepath):
         print(f"Error uploading to Google Drive: {e}")
         return None
 
+# PyDrive shares one HTTP connection, so archival uploads run one at a time off the critical path
+_archive_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="drive-archive")
+# ID reservation has its own thread and HTTP connection, so it never queues behind uploads
+_reserve_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="drive-ids")
+_reserved_ids = []
+_reserved_ids_lock = threading.Lock()
+_refill = None
+RESERVE_BATCH = 100
+# Top the pool up in the background once it drops below this many IDs
+RESERVE_LOW_WATER = 20
+
+def _generate_file_ids(count):
+    import httplib2
+
+    drive = get_drive()
+    http = drive.auth.credentials.authorize(httplib2.Http())
+    response = drive.auth.service.files().generateIds(maxResults=count, space='drive').execute(http=http)
+    with _reserved_ids_lock:
+        _reserved_ids.extend(response['ids'])
+
+def prefetch_file_ids():
+    """Start filling the reserved ID pool (and authenticating with Drive) in the background; returns the Future"""
+    global _refill
+    with _reserved_ids_lock:
+        if _refill is None or _refill.done():
+            _refill = _reserve_executor.submit(_generate_file_ids, RESERVE_BATCH)
+        return _refill
+
+def reserve_file_id():
+    """Return a Drive file ID generated ahead of the upload, so processing need not wait for it"""
+    while True:
+        with _reserved_ids_lock:
+            remaining = len(_reserved_ids)
+            file_id = _reserved_ids.pop() if remaining else None
+        if remaining <= RESERVE_LOW_WATER:
+            refill = prefetch_file_ids()
+            if file_id is None:
+                # Only an empty pool waits, and then only for the ID request, never for uploads
+                refill.result()
+        if file_id is not None:
+            return file_id
+
+def upload_stream_to_drive(stream, filename, file_id=None, mime_type=None):
+    """Upload a binary stream to the Drive folder (optionally under a reserved ID) and return the file ID"""
+    metadata = {
+        'title': filename,
+        'parents': [{"id": DRIVE_FOLDER_ID}],
+        'mimeType': mime_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+    }
+    if file_id:
+        metadata['id'] = file_id
+    file_drive = get_drive().CreateFile(metadata)
+    file_drive.content = stream
+    with metrics.span("drive.upload", file_id=file_id):
+        file_drive.Upload()
+    print(f"Uploaded to Google Drive: {filename}")
+    return file_drive['id']
+
+# Attachments whose Drive upload kept failing wait here, under their reserved file ID, to be uploaded again
+ARCHIVE_RETRY_DIR = os.getenv("ARCHIVE_RETRY_DIR", os.path.join(".cache", "archive_retry"))
+# Minimum seconds between passes over ARCHIVE_RETRY_DIR
+ARCHIVE_RETRY_INTERVAL = float(os.getenv("ARCHIVE_RETRY_INTERVAL", "300"))
+_last_archive_retry = None
+_archive_retry_lock = threading.Lock()
+
+
+class ArchiveFailed(Exception):
+    """A Drive upload gave up; `kept` tells whether the bytes were saved for a later retry"""
+
+    def __init__(self, message, kept):
+        super().__init__(message)
+        self.kept = kept
+
+
+def _keep_for_retry(attachment, file_id):
+    """Copy a failed upload into ARCHIVE_RETRY_DIR next to a JSON note of its Drive metadata"""
+    os.makedirs(ARCHIVE_RETRY_DIR, exist_ok=True)
+    path = os.path.join(ARCHIVE_RETRY_DIR, file_id)
+    with attachment.open() as source, open(f"{path}.tmp", "wb") as target:
+        shutil.copyfileobj(source, target)
+    os.replace(f"{path}.tmp", path)
+    note = {"file_id": file_id, "filename": attachment.filename, "content_type": attachment.content_type,
+            "failed_at": time.time()}
+    with open(f"{path}.json.tmp", "w", encoding="utf-8") as f:
+        json.dump(note, f)
+    # The note is written last, so a listed entry always has its bytes
+    os.replace(f"{path}.json.tmp", f"{path}.json")
+
+
+def _touch_retry_note(path):
+    """Restart the wait for an entry whose retry failed as well"""
+    try:
+        with open(f"{path}.json", "r", encoding="utf-8") as f:
+            note = json.load(f)
+        note["failed_at"] = time.time()
+        with open(f"{path}.json.tmp", "w", encoding="utf-8") as f:
+            json.dump(note, f)
+        os.replace(f"{path}.json.tmp", f"{path}.json")
+    except (OSError, ValueError):
+        pass
+
+
+def pending_archives():
+    """File IDs whose upload failed and is waiting in ARCHIVE_RETRY_DIR"""
+    if not os.path.isdir(ARCHIVE_RETRY_DIR):
+        return []
+    return sorted(name[:-len(".json")] for name in os.listdir(ARCHIVE_RETRY_DIR) if name.endswith(".json"))
+
+
+def retry_failed_archives(min_age=0):
+    """
+    Upload the attachments kept in ARCHIVE_RETRY_DIR again; returns (uploaded, still_pending).
+
+    Entries that failed less than `min_age` seconds ago are left for a later pass.
+    """
+    uploaded = 0
+    pending = pending_archives()
+    for file_id in pending:
+        path = os.path.join(ARCHIVE_RETRY_DIR, file_id)
+        try:
+            with open(f"{path}.json", "r", encoding="utf-8") as f:
+                note = json.load(f)
+            if time.time() - note.get("failed_at", 0) < min_age:
+                continue
+            with open(path, "rb") as stream:
+                upload_stream_to_drive(stream, note["filename"], file_id, note.get("content_type"))
+        except Exception as e:
+            print(f"[Archive] Retry for {file_id} failed, keeping it for the next pass: {e}")
+            _touch_retry_note(path)
+            continue
+        os.remove(f"{path}.json")
+        os.remove(path)
+        uploaded += 1
+        metrics.inc("drive_archive", outcome="retried")
+    if uploaded:
+        print(f"[Archive] Re-uploaded {uploaded} of {len(pending)} failed archives")
+    return uploaded, len(pending) - uploaded
+
+
+def retry_failed_archives_async(force=False):
+    """Queue a retry pass behind the pending uploads, at most once per ARCHIVE_RETRY_INTERVAL unless forced"""
+    global _last_archive_retry
+    with _archive_retry_lock:
+        now = time.monotonic()
+        if not force and _last_archive_retry is not None and now - _last_archive_retry < ARCHIVE_RETRY_INTERVAL:
+            return None
+        _last_archive_retry = now
+    if not pending_archives():
+        return None
+    # Unforced passes only pick up uploads that have waited a full interval since they last failed
+    return _archive_executor.submit(retry_failed_archives, 0 if force else ARCHIVE_RETRY_INTERVAL)
+
+
+def archive_to_drive_async(attachment, file_id=None, retries=3):
+    """
+    Upload an attachment to Drive in the background and return a Future for its file ID.
+
+    The attachment is retained until the upload finishes, so OCR can release
+    its own reference independently. When every attempt fails, the bytes are
+    kept in ARCHIVE_RETRY_DIR for retry_failed_archives() and the Future
+    raises ArchiveFailed, so callers should attach a done-callback.
+    """
+    attachment.retain()
+    file_id = file_id or uuid.uuid4().hex
+
+    def upload():
+        try:
+            error = None
+            for attempt in range(1, retries + 1):
+                try:
+                    with attachment.open() as stream:
+                        uploaded = upload_stream_to_drive(stream, attachment.filename, file_id, attachment.content_type)
+                    metrics.inc("drive_archive", outcome="uploaded")
+                    return uploaded
+                except Exception as e:
+                    error = e
+                    print(f"Error archiving {attachment.filename} to Drive (attempt {attempt}/{retries}): {e}")
+                    if attempt < retries:
+                        time.sleep(attempt)
+            try:
+                _keep_for_retry(attachment, file_id)
+            except Exception as e:
+                metrics.inc("drive_archive", outcome="lost")
+                raise ArchiveFailed(f"Upload of {attachment.filename} as {file_id} failed ({error}) "
+                                    f"and it could not be kept for retry: {e}", kept=False)
+            metrics.inc("drive_archive", outcome="kept_for_retry")
+            raise ArchiveFailed(f"Upload of {attachment.filename} as {file_id} failed ({error}); "
+                                f"kept in {ARCHIVE_RETRY_DIR} for retry", kept=True)
+        finally:
+            attachment.release()
+
+    future = _archive_executor.submit(upload)
+    retry_failed_archives_async()
+    return future
+
+
+def log_archive_result(file_id):
+    """Done-callback for archive_to_drive_async futures that reports a failed upload"""
+    def report(future):
+        error = future.exception()
+        if error is not None:
+            print(f"[Archive] Drive copy of {file_id} is missing: {error}")
+    return report
+
 def extract_sender_email(message):
     """Extract sender email from message"""
     try:
@@ -0,0 +1,373 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import hmac
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+from ingestion.gmail_ingestion import (
+    clean_filename, reserve_file_id, prefetch_file_ids, archive_to_drive_async, log_archive_result,
+)
+from helper.attachment_spool import AttachmentSpool
+from helper import metrics
+
+load_dotenv()
+
+# Jobs accepted but not yet finished; further submissions get 503 until some complete
+INTAKE_MAX_PENDING = int(os.getenv('INTAKE_MAX_PENDING', '32'))
+INTAKE_MAX_UPLOAD_BYTES = int(float(os.getenv('INTAKE_MAX_UPLOAD_MB', '25')) * 1024 * 1024)
+# Finished jobs kept for the status endpoint, oldest forgotten first
+INTAKE_JOB_HISTORY = int(os.getenv('INTAKE_JOB_HISTORY', '1000'))
+# Shared secret Drive echoes back in X-Goog-Channel-Token on every notification
+DRIVE_WEBHOOK_TOKEN = os.getenv('DRIVE_WEBHOOK_TOKEN')
+# Keys accepted in X-API-Key on the submission routes; callers using a trusted key may also set
+# sender_email, everyone else's invoices are never answered by email
+INTAKE_API_KEYS = {key.strip() for key in os.getenv('INTAKE_API_KEYS', '').split(',') if key.strip()}
+INTAKE_TRUSTED_API_KEYS = {key.strip() for key in os.getenv('INTAKE_TRUSTED_API_KEYS', '').split(',') if key.strip()}
+INTAKE_HOST = os.getenv('INTAKE_HOST', '127.0.0.1')
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.png', '.jpg', '.jpeg')
+
+# How far a job has got, judged by what the stages have added to it
+_PROGRESS = (("is_valid", "validated"), ("invoice", "extracted"), ("ocr_text", "ocr_done"))
+
+
+class IntakeBusy(Exception):
+    pass
+
+
+class JobTracker:
+    """
+    Hand submitted jobs to the pipeline and keep their status by job ID.
+
+    Submissions only go onto an in-process queue, so the HTTP handler returns
+    at once; a feeder thread moves them into the pipeline, where the bounded
+    stage queues apply backpressure. At most `max_pending` jobs are accepted
+    and unfinished at a time. The tracker hooks the pipeline's completion,
+    error and drop callbacks, keeping any that were already set.
+    """
+
+    def __init__(self, pipeline, max_pending=INTAKE_MAX_PENDING, history=INTAKE_JOB_HISTORY):
+        self.pipeline = pipeline
+        self.max_pending = max(1, max_pending)
+        self.history = history
+        self.jobs = OrderedDict()
+        self._live = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._hook("on_complete", self._completed)
+        self._hook("on_error", self._failed)
+        self._hook("on_drop", self._dropped)
+        metrics.register_gauge("intake_pending", lambda: len(self._live))
+        threading.Thread(target=self._feed, name="intake-feeder", daemon=True).start()
+
+    def _hook(self, name, callback):
+        previous = getattr(self.pipeline, name)
+
+        def chained(*args):
+            # The tracker's own bookkeeping runs even if the hook it wraps fails
+            try:
+                if previous:
+                    previous(*args)
+            finally:
+                callback(*args)
+        setattr(self.pipeline, name, chained)
+
+    def full(self):
+        with self._lock:
+            return len(self._live) >= self.max_pending
+
+    def submit(self, job, source, filename=None):
+        """Queue a pipeline job and return its status record; raises IntakeBusy when at capacity"""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            if len(self._live) >= self.max_pending:
+                raise IntakeBusy(f"{len(self._live)} jobs pending")
+            job["job_id"] = job_id
+            job["on_write"] = lambda table, ok, error: self._written(job_id, table, ok, error)
+            self._live[job_id] = job
+            self.jobs[job_id] = {
+                "job_id": job_id,
+                "file_id": job["file_id"],
+                "source": source,
+                "filename": filename,
+                "status": "queued",
+                "submitted_at": time.time(),
+            }
+        self._queue.put(job)
+        metrics.inc("intake_jobs", source=source)
+        return self.status(job_id)
+
+    def _feed(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                record = self.jobs.get(job["job_id"])
+                if record is not None:
+                    record["status"] = "processing"
+            # Blocks while the first stage is saturated; the HTTP side never waits on this
+            try:
+                self.pipeline.submit(job)
+            except RuntimeError as e:
+                # The pipeline closed during shutdown; the job will not run
+                self._finish(job, "failed", stage="intake", error=str(e))
+
+    def _finish(self, job, status, **fields):
+        job_id = job.get("job_id") if isinstance(job, dict) else None
+        if job_id is None:
+            return  # polled from the Drive folder, not submitted through the service
+        with self._lock:
+            self._live.pop(job_id, None)
+            record = self.jobs.get(job_id)
+            if record is None:
+                return
+            if record.get("stage") == "storage":
+                status = "failed"  # a buffered write already failed before the job finished
+            record.update(status=status, finished_at=time.time(), **fields)
+            record.update(self._results(job))
+            self.jobs.move_to_end(job_id)
+            self._trim()
+
+    def _written(self, job_id, table, ok, error):
+        """Buffered Supabase writes land after the job completes; a failed one fails the job"""
+        with self._lock:
+            record = self.jobs.get(job_id)
+            if record is None:
+                return
+            record.setdefault("writes", {})[table] = "written" if ok else "failed"
+            if not ok:
+                record.update(status="failed", stage="storage", error=f"Could not write to {table}: {error}")
+
+    def archived(self, job_id, future):
+        """Record how the job's Drive archive upload ended; a failed one is kept for retry, not failed"""
+        error = future.exception()
+        with self._lock:
+            record = self.jobs.get(job_id)
+            if record is None:
+                return
+            if error is None:
+                record["archive"] = "uploaded"
+            else:
+                record.update(archive="pending_retry" if getattr(error, "kept", False) else "failed",
+                              archive_error=str(error))
+
+    def _trim(self):
+        finished = len(self.jobs) - len(self._live)
+        for job_id in list(self.jobs):
+            if finished <= self.history:
+                break
+            if job_id not in self._live:
+                del self.jobs[job_id]
+                finished -= 1
+
+    @staticmethod
+    def _results(job):
+        results = {"invoice": job.get("invoice")}
+        if "is_valid" in job:
+            results.update(is_valid=job["is_valid"], reason=job.get("reason"))
+        if "pages_skipped" in job:
+            results["pages_skipped"] = job["pages_skipped"]
+        return results
+
+    def _completed(self, job):
+        self._finish(job, "completed")
+
+    def _failed(self, stage, job, error):
+        self._finish(job, "failed", stage=stage, error=str(error))
+
+    def _dropped(self, stage, job):
+        self._finish(job, "rejected", stage=stage, error="No invoice fields could be extracted")
+
+    def status(self, job_id):
+        with self._lock:
+            record = self.jobs.get(job_id)
+            if record is None:
+                return None
+            record = dict(record)
+            job = self._live.get(job_id)
+        if job is not None:
+            record["progress"] = next((label for key, label in _PROGRESS if key in job), "received")
+            record.update(self._results(job))
+        return record
+
+    def recent(self, limit=50):
+        with self._lock:
+            job_ids = list(self.jobs)[-limit:]
+        return [self.status(job_id) for job_id in reversed(job_ids)]
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._live)
+            statuses = {}
+            for record in self.jobs.values():
+                statuses[record["status"]] = statuses.get(record["status"], 0) + 1
+        return {"pending": pending, "max_pending": self.max_pending, "jobs": statuses}
+
+
+def create_intake_app(pipeline, source, tracker=None, spool=None,
+                      api_keys=None, trusted_api_keys=None, webhook_token=None):
+    """
+    FastAPI app that queues invoices for `pipeline` and reports on them by job ID.
+
+    POST /invoices             multipart upload (file, sender_email?) -> 202 {job_id, ...}
+    POST /invoices/drive       {"file_id", "sender_email"?} for a file already in Drive -> 202
+    POST /webhooks/drive       Drive push notification; polls the watched folder now
+    GET  /jobs/{job_id}        status, extracted fields and validation result
+    GET  /jobs, /health        recent jobs, queue and pipeline counters
+    GET  /metrics(.json)       see helper/metrics.py
+
+    The two submission routes need an X-API-Key from `api_keys` or
+    `trusted_api_keys`; sender_email is only taken from trusted callers. The
+    webhook needs the channel token. With no keys configured every POST is refused.
+    """
+    from fastapi import Depends, FastAPI, File, Form, Header, HTTPException, Request, Response, UploadFile
+    from fastapi.concurrency import run_in_threadpool
+    from pydantic import BaseModel
+
+    tracker = tracker or JobTracker(pipeline)
+    spool = spool or AttachmentSpool()
+    trusted_api_keys = set(INTAKE_TRUSTED_API_KEYS if trusted_api_keys is None else trusted_api_keys)
+    api_keys = set(INTAKE_API_KEYS if api_keys is None else api_keys) | trusted_api_keys
+    webhook_token = webhook_token or DRIVE_WEBHOOK_TOKEN
+    app = FastAPI(title="Invoice intake")
+
+    class DriveJob(BaseModel):
+        file_id: str
+        sender_email: str | None = None
+
+    def busy():
+        return HTTPException(503, "Intake queue is full, retry shortly", headers={"Retry-After": "5"})
+
+    def caller(x_api_key: str | None = Header(None)):
+        """Whether the caller may name the sender; 401 without a known key"""
+        if not x_api_key or not any(hmac.compare_digest(x_api_key, key) for key in api_keys):
+            metrics.inc("intake_unauthorized")
+            raise HTTPException(401, "Missing or unknown X-API-Key")
+        return any(hmac.compare_digest(x_api_key, key) for key in trusted_api_keys)
+
+    def sender_job(sender_email, trusted):
+        # Anyone else's sender_email is ignored, so the intake cannot be used to send mail to arbitrary addresses
+        if trusted and sender_email:
+            return {"sender_email": sender_email}
+        if sender_email:
+            metrics.inc("intake_sender_ignored")
+        return {"sender_email": None}
+
+    @app.post("/invoices", status_code=202)
+    async def upload_invoice(file: UploadFile = File(...), sender_email: str | None = Form(None),
+                             trusted: bool = Depends(caller)):
+        filename = clean_filename(file.filename)
+        content_type = file.content_type or ""
+        if not (filename.lower().endswith(SUPPORTED_EXTENSIONS)
+                or content_type == "application/pdf" or content_type.startswith("image/")):
+            raise HTTPException(415, "Unsupported file type: must be PDF or image.")
+        if tracker.full():
+            raise busy()
+        payload = await file.read(INTAKE_MAX_UPLOAD_BYTES + 1)
+        if len(payload) > INTAKE_MAX_UPLOAD_BYTES:
+            raise HTTPException(413, f"File exceeds {INTAKE_MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+        attachment = await run_in_threadpool(spool.add, payload, filename, content_type)
+        try:
+            file_id = await run_in_threadpool(reserve_file_id)
+            # Uploads have no Drive owner to fall back on, so an unnamed sender stays unknown
+            record = tracker.submit(
+                {"file_id": file_id, "attachment": attachment, "sender_unknown": True,
+                 **sender_job(sender_email, trusted)},
+                source="upload", filename=filename,
+            )
+        except IntakeBusy:
+            attachment.release()
+            raise busy()
+        except Exception:
+            attachment.release()
+            raise
+        # Claim the ID so the folder poll skips the archived copy
+        source.claim(file_id)
+        archive = archive_to_drive_async(attachment, file_id)
+        archive.add_done_callback(log_archive_result(file_id))
+        archive.add_done_callback(lambda future: tracker.archived(record["job_id"], future))
+        return record
+
+    @app.post("/invoices/drive", status_code=202)
+    async def submit_drive_file(request: DriveJob, trusted: bool = Depends(caller)):
+        from agent.invoice_index import get_invoice_index
+        from helper.clients import get_supabase
+
+        index = await run_in_threadpool(lambda: get_invoice_index(get_supabase()))
+        if request.file_id in index:
+            raise HTTPException(409, f"File {request.file_id} has already been processed")
+        if not source.claim(request.file_id):
+            raise HTTPException(409, f"File {request.file_id} is already queued")
+        try:
+            return tracker.submit(
+                # Without a trusted sender the file's Drive owner is used, as for polled files
+                {"file_id": request.file_id, "fetch_metadata": True, **sender_job(request.sender_email, trusted)},
+                source="drive",
+            )
+        except IntakeBusy:
+            source.unclaim(request.file_id)
+            raise busy()
+
+    @app.post("/webhooks/drive")
+    async def drive_notification(request: Request):
+        token = request.headers.get("X-Goog-Channel-Token") or ""
+        if not webhook_token or not hmac.compare_digest(token, webhook_token):
+            raise HTTPException(403, "Unknown channel token")
+        state = request.headers.get("X-Goog-Resource-State", "")
+        metrics.inc("drive_notifications", state=state or "unknown")
+        # "sync" only confirms the channel; anything else means the changes feed moved
+        if state != "sync":
+            pipeline.wake()
+        return Response(status_code=200)
+
+    @app.get("/jobs/{job_id}")
+    async def job_status(job_id: str):
+        record = tracker.status(job_id)
+        if record is None:
+            raise HTTPException(404, f"Unknown job {job_id}")
+        return record
+
+    @app.get("/jobs")
+    async def recent_jobs(limit: int = 50):
+        return tracker.recent(max(1, min(limit, 500)))
+
+    @app.get("/health")
+    async def health():
+        return {"intake": tracker.stats(), "pipeline": pipeline.stats()}
+
+    metrics.create_metrics_app(app)
+    return app
+
+
+def keep_drive_webhook(backend, address, token=DRIVE_WEBHOOK_TOKEN, ttl_seconds=86400):
+    """Register a Drive changes channel for `address` and renew it before it expires, in the background"""
+    def renew():
+        while True:
+            try:
+                channel = backend.watch(address, uuid.uuid4().hex, token, ttl_seconds)
+                print(f"[Intake] Drive notifications for {address} until {channel.get('expiration')}")
+                time.sleep(ttl_seconds * 0.8)
+            except Exception as e:
+                print(f"[Intake] Could not register the Drive webhook: {e}")
+                time.sleep(60)
+
+    threading.Thread(target=renew, name="drive-webhook", daemon=True).start()
+
+
+def start_intake_server(pipeline, source, port, host=INTAKE_HOST):
+    """Serve the intake API from a background thread while the pipeline keeps polling"""
+    import uvicorn
+
+    if not (INTAKE_API_KEYS or INTAKE_TRUSTED_API_KEYS):
+        print("[Intake] INTAKE_API_KEYS is not set; invoice submissions will be refused")
+    app = create_intake_app(pipeline, source)
+    # Authenticate with Drive and fill the reserved ID pool before the first upload needs it
+    prefetch_file_ids()
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="intake-http", daemon=True).start()
+    print(f"[Intake] Accepting invoices on http://{host}:{port}/invoices")
+    return server
@@ -0,0 +1,477 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import base64
+import email
+import imaplib
+import io
+import json
+import quopri
+import re
+import select
+import ssl
+import time
+import traceback
+from email.header import decode_header, make_header
+
+from dotenv import load_dotenv
+from ingestion.gmail_ingestion import clean_filename, upload_stream_to_drive
+from helper import metrics
+
+load_dotenv()
+
+EMAIL_USER = os.getenv('EMAIL_USER')
+EMAIL_PASS = os.getenv('EMAIL_PASS')
+IMAP_HOST = os.getenv('IMAP_HOST', 'imap.gmail.com')
+IMAP_SEARCH = os.getenv('IMAP_SEARCH', 'UNSEEN SUBJECT "invoice"')
+IMAP_STATE_PATH = os.getenv('IMAP_STATE_PATH', os.path.join('.cache', 'imap_state.json'))
+# Servers drop IDLE after 30 minutes, so re-issue it a little earlier
+IDLE_TIMEOUT = float(os.getenv('IMAP_IDLE_TIMEOUT', str(25 * 60)))
+# Syncs a message whose jobs failed is retried on before it is left unread and skipped
+IMAP_MAX_RETRIES = int(os.getenv('IMAP_MAX_RETRIES', '5'))
+
+ATTACHMENT_TYPES = ('APPLICATION/PDF', 'IMAGE/')
+
+_TOKEN_RE = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|\{(\d+)\}$|([^\s()"\[]+(?:\[[^\]]*\][^\s()"]*)?))')
+
+
+def _tokenize(data):
+    """
+    Turn an imaplib FETCH response into a flat token list.
+
+    imaplib hands literals over as (prefix, literal) tuples; the literal is
+    injected as a bytes token where the {N} marker was.
+    """
+    tokens = []
+    for item in data:
+        if isinstance(item, tuple):
+            prefix, literal = item
+            tokens.extend(_tokenize_bytes(prefix))
+            tokens.append(literal)
+        elif item:
+            tokens.extend(_tokenize_bytes(item))
+    return tokens
+
+
+def _tokenize_bytes(chunk):
+    tokens = []
+    position = 0
+    while position < len(chunk):
+        match = _TOKEN_RE.match(chunk, position)
+        if not match or match.end() == position:
+            break
+        position = match.end()
+        opened, closed, quoted, literal, atom = match.groups()
+        if opened:
+            tokens.append('(')
+        elif closed:
+            tokens.append(')')
+        elif quoted is not None:
+            tokens.append(re.sub(rb'\\(.)', rb'\1', quoted).decode('utf-8', errors='replace'))
+        elif literal is not None:
+            continue  # the literal bytes follow as their own token
+        elif atom is not None:
+            value = atom.decode('utf-8', errors='replace')
+            tokens.append(None if value.upper() == 'NIL' else value)
+    return tokens
+
+
+def _parse(tokens, position=0):
+    """Parse tokens into nested lists; returns (items, next_position)"""
+    items = []
+    while position < len(tokens):
+        token = tokens[position]
+        position += 1
+        if token == '(':
+            nested, position = _parse(tokens, position)
+            items.append(nested)
+        elif token == ')':
+            return items, position
+        else:
+            items.append(token)
+    return items, position
+
+
+def parse_fetch_response(data):
+    """Return one dict per message mapping FETCH item names (UID, BODYSTRUCTURE, BODY[...]) to values"""
+    items, _ = _parse(_tokenize(data))
+    messages = []
+    for index, item in enumerate(items):
+        if isinstance(item, list) and index > 0 and isinstance(items[index - 1], str) and items[index - 1].isdigit():
+            fields = {}
+            for key, value in zip(item[::2], item[1::2]):
+                if isinstance(key, str):
+                    fields[re.sub(r'\.PEEK', '', key.upper())] = value
+            messages.append(fields)
+    return messages
+
+
+def _params(values):
+    """Turn an IMAP ("KEY" "value" ...) parameter list into a dict with upper-case keys"""
+    if not isinstance(values, list):
+        return {}
+    return {str(k).upper(): v for k, v in zip(values[::2], values[1::2])}
+
+
+def _decode_filename(value):
+    if not value:
+        return None
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', errors='replace')
+    try:
+        return str(make_header(decode_header(value)))
+    except Exception:
+        return value
+
+
+def find_attachments(structure, section=''):
+    """
+    Walk a BODYSTRUCTURE and list the parts worth downloading.
+
+    Returns dicts with the part's section number, filename, content type and
+    transfer encoding. PDFs and images are kept, whether marked as attachment
+    or inline with a filename.
+    """
+    if not isinstance(structure, list) or not structure:
+        return []
+    if isinstance(structure[0], list):
+        attachments = []
+        # Child parts come first; the subtype string and extension data follow them
+        for number, part in enumerate(structure):
+            if not isinstance(part, list):
+                break
+            child = f"{section}.{number + 1}" if section else str(number + 1)
+            attachments.extend(find_attachments(part, child))
+        return attachments
+
+    content_type = f"{structure[0]}/{structure[1]}".upper()
+    type_params = _params(structure[2]) if len(structure) > 2 else {}
+    encoding = str(structure[5]).upper() if len(structure) > 5 and structure[5] else '7BIT'
+    disposition, disposition_params = None, {}
+    for extension in structure[7:]:
+        if (isinstance(extension, list) and len(extension) == 2 and isinstance(extension[0], str)
+                and extension[0].upper() in ('ATTACHMENT', 'INLINE')):
+            disposition, disposition_params = extension[0].upper(), _params(extension[1])
+            break
+
+    filename = _decode_filename(disposition_params.get('FILENAME') or type_params.get('NAME'))
+    is_document = content_type.startswith(ATTACHMENT_TYPES)
+    if disposition == 'ATTACHMENT' or (is_document and filename):
+        return [{
+            'section': section or '1',
+            'filename': filename,
+            'content_type': content_type.lower(),
+            'encoding': encoding,
+        }]
+    return []
+
+
+def decode_part(payload, encoding):
+    if isinstance(payload, str):
+        payload = payload.encode('latin-1', errors='replace')
+    if payload is None:
+        return b''
+    if encoding == 'BASE64':
+        return base64.b64decode(payload)
+    if encoding == 'QUOTED-PRINTABLE':
+        return quopri.decodestring(payload)
+    return payload
+
+
+def _sender_from_headers(raw_headers):
+    message = email.message_from_bytes(raw_headers or b'')
+    from_field = message.get('From', '')
+    match = re.search(r'<(.*?)>', from_field)
+    if match:
+        return match.group(1), message
+    if '@' in from_field:
+        return from_field.strip(), message
+    return "unknown@sender.com", message
+
+
+class ImapIdleIngestor:
+    """
+    Keep one authenticated IMAP connection open and push every new invoice attachment as a job.
+
+    New messages are found by UID (the last processed UID is persisted), their
+    BODYSTRUCTURE is fetched first and only the attachment parts are downloaded,
+    in as few batched FETCH commands as possible. Between syncs the connection
+    waits in IDLE, so new mail is picked up within about a second.
+
+    A message is marked \\Seen only once `on_job` has returned for all its
+    attachments. If `on_job` raises, the message is kept in the state file with
+    the parts already handed over, and retried on the next sync.
+    """
+
+    def __init__(self, on_job, host=IMAP_HOST, user=EMAIL_USER, password=EMAIL_PASS,
+                 mailbox='inbox', search=IMAP_SEARCH, state_path=IMAP_STATE_PATH,
+                 idle_timeout=IDLE_TIMEOUT, max_retries=IMAP_MAX_RETRIES):
+        self.on_job = on_job
+        self.host = host
+        self.user = user
+        self.password = password
+        self.mailbox = mailbox
+        self.search = search
+        self.state_path = state_path
+        self.idle_timeout = idle_timeout
+        self.max_retries = max_retries
+        self.mail = None
+        self.uidvalidity = None
+        self.last_uid = 0
+        # {uid: {"attempts": n, "done": [sections handed over]}} for messages whose jobs failed
+        self.retry = {}
+        self._stopping = False
+        self._load_state()
+
+    def _load_state(self):
+        if self.state_path and os.path.exists(self.state_path):
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            self.uidvalidity = state.get('uidvalidity')
+            self.last_uid = int(state.get('last_uid', 0))
+            self.retry = {int(uid): entry for uid, entry in state.get('retry', {}).items()}
+
+    def _save_state(self):
+        if not self.state_path:
+            return
+        directory = os.path.dirname(self.state_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.state_path, 'w', encoding='utf-8') as f:
+            json.dump({'uidvalidity': self.uidvalidity, 'last_uid': self.last_uid,
+                       'retry': {str(uid): entry for uid, entry in self.retry.items()}}, f)
+
+    def connect(self):
+        self.mail = imaplib.IMAP4_SSL(self.host)
+        self.mail.login(self.user, self.password)
+        self.mail.select(self.mailbox)
+        _, values = self.mail.response('UIDVALIDITY')
+        uidvalidity = values[0].decode() if values and values[0] else None
+        if uidvalidity != self.uidvalidity:
+            # UIDs from another mailbox generation mean nothing here; start over
+            print(f"[IMAP] UIDVALIDITY changed ({self.uidvalidity} -> {uidvalidity}), resetting UID cursor")
+            self.uidvalidity = uidvalidity
+            self.last_uid = 0
+            self.retry = {}
+            self._save_state()
+        print(f"[IMAP] Connected to {self.host} as {self.user}")
+
+    def close(self):
+        if self.mail:
+            try:
+                self.mail.logout()
+            except Exception:
+                pass
+            self.mail = None
+
+    @metrics.timed("imap.sync")
+    def sync(self):
+        """Emit jobs for all attachments of every message newer than the last processed UID"""
+        status, data = self.mail.uid('SEARCH', None, f'UID {self.last_uid + 1}:*', self.search)
+        if status != 'OK':
+            print("[IMAP] Search failed")
+            return 0
+        # "N:*" always matches the newest message, even when its UID is below N
+        uids = [uid for uid in (int(u) for u in data[0].split()) if uid > self.last_uid]
+        # Messages whose jobs failed last time are fetched again with the new ones
+        uids = sorted(set(uids) | set(self.retry))
+        if not uids:
+            return 0
+
+        uid_set = ','.join(str(uid) for uid in uids)
+        status, data = self.mail.uid(
+            'FETCH', uid_set, '(UID BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS (FROM SUBJECT)])'
+        )
+        if status != 'OK':
+            print("[IMAP] Failed to fetch message structure")
+            return 0
+
+        messages = {}
+        for fields in parse_fetch_response(data):
+            uid = int(fields.get('UID', 0))
+            header_key = next((k for k in fields if k.startswith('BODY[HEADER')), None)
+            sender, headers = _sender_from_headers(fields.get(header_key))
+            messages[uid] = {
+                'sender_email': sender,
+                'subject': _decode_filename(headers.get('Subject', '')) or '',
+                'attachments': find_attachments(fields.get('BODYSTRUCTURE')),
+            }
+
+        # Messages with the same part layout share one FETCH for all their attachments
+        groups = {}
+        handled = set()
+        for uid, message in messages.items():
+            sections = tuple(part['section'] for part in message['attachments'])
+            if sections:
+                groups.setdefault(sections, []).append(uid)
+            else:
+                print(f"[IMAP] Message UID {uid} has no invoice attachments")
+                handled.add(uid)
+
+        emitted = 0
+        done = {}
+        for sections, group_uids in groups.items():
+            items = ' '.join(f'BODY.PEEK[{section}]' for section in sections)
+            status, data = self.mail.uid('FETCH', ','.join(str(u) for u in group_uids), f'(UID {items})')
+            if status != 'OK':
+                print(f"[IMAP] Failed to fetch attachments for UIDs {group_uids}")
+                continue
+            for fields in parse_fetch_response(data):
+                uid = int(fields.get('UID', 0))
+                message = messages.get(uid)
+                if not message:
+                    continue
+                ok, done[uid], count = self._emit(uid, message, fields)
+                emitted += count
+                if ok:
+                    handled.add(uid)
+
+        # Only messages fully handed over are marked read; the rest are retried next sync
+        if handled:
+            self.mail.uid('STORE', ','.join(str(uid) for uid in sorted(handled)), '+FLAGS', '(\\Seen)')
+        for uid in uids:
+            if uid in handled:
+                self.retry.pop(uid, None)
+                continue
+            attempts = self.retry.get(uid, {}).get('attempts', 0) + 1
+            if attempts >= self.max_retries:
+                print(f"[IMAP] Giving up on UID {uid} after {attempts} attempts; it stays unread")
+                metrics.inc("imap_messages_abandoned")
+                self.retry.pop(uid, None)
+            else:
+                self.retry[uid] = {'attempts': attempts, 'done': sorted(done.get(uid, []))}
+        self.last_uid = max(self.last_uid, max(uids))
+        self._save_state()
+        print(f"[IMAP] Synced {len(uids)} message(s), {emitted} attachment(s)"
+              + (f", {len(self.retry)} to retry" if self.retry else ""))
+        return emitted
+
+    def _emit(self, uid, message, fields):
+        """Hand each attachment of one message to on_job; returns (all handed over, sections done, count)"""
+        done = set(self.retry.get(uid, {}).get('done', []))
+        ok, emitted = True, 0
+        for part in message['attachments']:
+            if part['section'] in done:
+                continue
+            payload = decode_part(fields.get(f"BODY[{part['section']}]"), part['encoding'])
+            if not payload:
+                continue
+            try:
+                self.on_job({
+                    'uid': uid,
+                    'sender_email': message['sender_email'],
+                    'subject': message['subject'],
+                    'filename': part['filename'],
+                    'content_type': part['content_type'],
+                    'payload': payload,
+                })
+            except Exception as e:
+                print(f"[IMAP] Could not hand over {part['filename']} from UID {uid}: {e}")
+                metrics.inc("imap_job_failures")
+                ok = False
+                continue
+            done.add(part['section'])
+            emitted += 1
+        return ok, done, emitted
+
+    def _response_waiting(self):
+        """
+        True if a response line can be read without waiting on the socket.
+
+        imaplib reads through a buffered file, so an untagged EXISTS that arrived in the
+        same packet as the IDLE continuation sits in that buffer where select() cannot see it.
+        """
+        sock = self.mail.sock
+        if getattr(sock, 'pending', lambda: 0)():
+            return True
+        reader = getattr(self.mail, 'file', None)
+        if reader is None or not hasattr(reader, 'peek'):
+            return False
+        timeout = sock.gettimeout()
+        # peek() only reads the socket when the buffer is empty; non-blocking, that read cannot hang
+        sock.setblocking(False)
+        try:
+            return bool(reader.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            sock.settimeout(timeout)
+
+    def idle(self):
+        """Block in IDLE until the server reports new mail or the timeout passes"""
+        tag = self.mail._new_tag()
+        self.mail.send(tag + b' IDLE\r\n')
+        response = self.mail.readline()
+        if not response.startswith(b'+'):
+            raise imaplib.IMAP4.error(f"IDLE rejected: {response!r}")
+        got_mail = False
+        deadline = time.monotonic() + self.idle_timeout
+        try:
+            while not got_mail and not self._stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if not self._response_waiting():
+                    readable, _, _ = select.select([self.mail.sock], [], [], min(remaining, 5))
+                    if not readable:
+                        continue
+                line = self.mail.readline()
+                if not line:
+                    raise imaplib.IMAP4.abort("Connection closed during IDLE")
+                if b'EXISTS' in line or b'RECENT' in line:
+                    got_mail = True
+        finally:
+            self.mail.send(b'DONE\r\n')
+            while True:
+                line = self.mail.readline()
+                if not line or line.startswith(tag):
+                    break
+        return got_mail
+
+    def run_forever(self, reconnect_delay=5):
+        while not self._stopping:
+            try:
+                if self.mail is None:
+                    self.connect()
+                self.sync()
+                self.idle()
+            except (imaplib.IMAP4.abort, imaplib.IMAP4.error, OSError) as e:
+                print(f"[IMAP] Connection error: {e}, reconnecting in {reconnect_delay}s")
+                self.close()
+                time.sleep(reconnect_delay)
+            except Exception as e:
+                # Anything else would end ingestion silently; the connection may be mid-command, so start over
+                print(f"[IMAP] Unexpected error: {e}, reconnecting in {reconnect_delay}s")
+                traceback.print_exc()
+                self.close()
+                time.sleep(reconnect_delay)
+        self.close()
+
+    def stop(self):
+        self._stopping = True
+
+
+def upload_job_to_drive(job):
+    """Default job handler: upload the attachment bytes straight to Drive and return the file ID"""
+    filename = clean_filename(job['filename'] or f"invoice_{job['uid']}")
+    try:
+        file_id = upload_stream_to_drive(io.BytesIO(job['payload']), filename, mime_type=job['content_type'])
+    except Exception as e:
+        print(f"[IMAP] Error uploading {filename} to Google Drive: {e}")
+        return None
+    print(f"[IMAP] Uploaded {filename} from {job['sender_email']} as {file_id}")
+    return file_id
+
+
+def main():
+    ingestor = ImapIdleIngestor(on_job=upload_job_to_drive)
+    print("IDLE ingestion running... (Ctrl+C to stop)")
+    try:
+        ingestor.run_forever()
+    except KeyboardInterrupt:
+        ingestor.stop()
+        ingestor.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,84 +1,145 @@
 import sys
 import os
 import json
+import time
+import argparse
+import threading
 
 # Ensure the parent folder is on the path for imports
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), 'watcher')))
 
-from langchain.agents import initialize_agent, AgentType
-from langchain.agents import Tool
-from langchain_community.llms import Ollama
-from ocr.ocr_main import process_latest_invoice
+# Imported first so the startup report measures everything that follows
+from helper import clients
 from agent import tools as t
 from agent.prompt_loader import load_prompt
-from agent.validation_helper import validate_invoice
-
-# Initialize the language model
-llm = Ollama(model="mistral")
-
-# Define available tools
-tools = [
-    Tool.from_function(
-        func=t.update_flagged,
-        name='update_flagged',
-        description=(
-            "Update the flagged status of a document. "
-            "Pass a JSON string with file_id and is_valid fields. "
-            "Use is_valid=true for valid invoices, is_valid=false for invalid invoices."
-        )
-    ),
-    Tool.from_function(
-        func=t.fetch_other_invoices,
-        name='fetch_other_invoices',
-        description='Fetch all invoice records except the current one. Pass the current file_id as parameter.'
-    ),
-    Tool.from_function(
-        func=t.push_invoice,
-        name='push_invoice',
-        description='Push valid invoices to invoice_db table. Pass the invoice data as JSON string.'
-    ),
-    Tool.from_function(
-        func=t.send_invalid_email,
-        name='send_invalid_email',
-        description=(
-            "Send emails for invalid invoices. "
-            "Pass a JSON string with recipient_email and reason fields."
-        )
-    )
-]
-
-# Initialize the agent executor with parsing error handling enabled
-agent_executor = initialize_agent(
-    tools=tools,
-    llm=llm,
-    agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
-    verbose=True,
-    handle_parsing_errors=True  # Retry on parsing errors
+from pipeline.stages import DriveFolderSource, DriveChangesSource, build_invoice_pipeline
+from helper.write_behind import WRITE_BEHIND_ENABLED, check_upsert_key, flush_all
+from helper.mailer import close_mailer
+from helper import metrics
+from helper.ollama_stream import LLM_MAX_IN_FLIGHT
+from ingestion.imap_idle import ImapIdleIngestor
+from ingestion.gmail_ingestion import (
+    clean_filename, reserve_file_id, archive_to_drive_async, log_archive_result, retry_failed_archives_async,
 )
+from helper.attachment_spool import AttachmentSpool
+from file_watcher import FOLDER_ID
+from change_watcher import ChangeWatcher, DriveChangesBackend, LocalFolderBackend
 
+clients.mark("imports")
 
-def main():
-    # Load the updated system prompt
-    system_prompt = load_prompt('prompt/agent_prompt.md')
-    invoice, file_id = process_latest_invoice()
-    if not invoice:
-        print("No invoice to process.")
-        return
+# "direct" calls the tools from the validation result; "agent" routes every invoice through the LLM agent
+EXECUTION_MODE = os.getenv("EXECUTION_MODE", "direct")
 
-    try:
-        invoice_dict = json.loads(invoice) if isinstance(invoice, str) else invoice
-        is_valid, validation_reason = validate_invoice(invoice_dict)
-        print(f"Validation Result: {'VALID' if is_valid else 'INVALID'}")
-        print(f"Validation Reason: {validation_reason}")
-    except Exception as e:
-        is_valid = False
-        validation_reason = f"Error during validation: {str(e)}"
-        print(f"Validation Error: {validation_reason}")
+_agent_executor = None
+_agent_lock = threading.Lock()
+
+
+def build_tools():
+    """Define available tools"""
+    from langchain.agents import Tool
+
+    return [
+        Tool.from_function(
+            func=t.update_flagged,
+            name='update_flagged',
+            description=(
+                "Update the flagged status of a document. "
+                "Pass a JSON string with file_id and is_valid fields. "
+                "Use is_valid=true for valid invoices, is_valid=false for invalid invoices."
+            )
+        ),
+        Tool.from_function(
+            func=t.fetch_other_invoices,
+            name='fetch_other_invoices',
+            description='Fetch all invoice records except the current one. Pass the current file_id as parameter.'
+        ),
+        Tool.from_function(
+            func=t.push_invoice,
+            name='push_invoice',
+            description='Push valid invoices to invoice_db table. Pass the invoice data as JSON string.'
+        ),
+        Tool.from_function(
+            func=t.send_invalid_email,
+            name='send_invalid_email',
+            description=(
+                "Send emails for invalid invoices. "
+                "Pass a JSON string with recipient_email, reason and invoice fields."
+            )
+        )
+    ]
+
+
+def get_agent_executor():
+    """Build the tools and agent executor on first use; direct mode never needs them"""
+    global _agent_executor
+    with _agent_lock:
+        if _agent_executor is None:
+            from langchain.agents import initialize_agent, AgentType
 
+            # Initialize the agent executor with parsing error handling enabled,
+            # sharing the Ollama client used for field extraction
+            _agent_executor = initialize_agent(
+                tools=build_tools(),
+                llm=clients.get_llm(),
+                agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
+                verbose=True,
+                handle_parsing_errors=True  # Retry on parsing errors
+            )
+        return _agent_executor
+
+
+def call_tool(tool, payload):
+    """Call a tool's function directly with a JSON payload, timed as its own span"""
+    with metrics.span(f"tool.{tool.func.__name__}"):
+        return tool.func(json.dumps(payload))
+
+
+def invoice_label(invoice_dict, file_id):
+    """How a rejection email names the invoice: its number when extracted, else the Drive file_id"""
+    return invoice_dict.get('Invoice Number') or file_id
+
+
+def dispatch_actions(invoice_dict, file_id, is_valid, validation_reason):
+    """
+    Apply the flag update and follow-up action by calling the tools directly.
+
+    Invoices the rules could not decide (is_valid is None) fall back to the agent.
+    """
+    if is_valid is None:
+        print(f"[Dispatch] Rules could not decide file_id={file_id}, falling back to agent")
+        return run_agent(invoice_dict, file_id, is_valid, validation_reason)
+
+    started = time.perf_counter()
+    print(call_tool(t.update_flagged, {"file_id": file_id, "is_valid": is_valid}))
+    if is_valid:
+        print(call_tool(t.push_invoice, invoice_dict))
+    elif invoice_dict.get('Received_From'):
+        print(call_tool(t.send_invalid_email, {
+            "recipient_email": invoice_dict['Received_From'],
+            "reason": validation_reason,
+            "invoice": invoice_label(invoice_dict, file_id),
+        }))
+    print(f"[Dispatch] Tool calls for file_id={file_id} took {(time.perf_counter() - started) * 1000:.1f} ms")
+
+
+def run_agent(invoice_dict, file_id, is_valid, validation_reason):
+    """Let the agent apply the flag update and the follow-up action for one validated invoice"""
+    # Load the updated system prompt
+    system_prompt = load_prompt('prompt/agent_prompt.md')
     recipient_email = invoice_dict.get('Received_From', 'unknown')
 
     # Construct agent input using strict Action/Action Input format
-    if is_valid:
+    if is_valid is None:
+        agent_input = f"""
+{system_prompt}
+
+The rule-based validation could not decide this invoice: {validation_reason}
+Apply the SOP to the invoice below, using file_id "{file_id}".
+
+Invoice data: {json.dumps(invoice_dict)}
+"""
+    elif is_valid:
         agent_input = f"""
 {system_prompt}
 
@@ -100,16 +161,155 @@ Action Input: {{"file_id": "{file_id}", "is_valid": false}}
 
 Thought: Flag updated. Sending invalid email.
 Action: send_invalid_email
-Action Input: {{"recipient_email": "{recipient_email}", "reason": "{validation_reason}"}}
+Action Input: {json.dumps({"recipient_email": recipient_email, "reason": validation_reason,
+                           "invoice": invoice_label(invoice_dict, file_id)})}
 """
 
     try:
-        result = agent_executor.invoke({"input": agent_input})
+        with metrics.span("agent.run", file_id=file_id):
+            result = get_agent_executor().invoke({"input": agent_input})
         print("Agent execution completed successfully")
         print(f"Result: {result}")
     except Exception as e:
         print(f"Error during agent execution: {e}")
 
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Process every unvisited invoice in the Drive folder.")
+    parser.add_argument("--once", action="store_true",
+                        help="Drain the folder once and exit instead of polling.")
+    parser.add_argument("--poll-interval", type=float, default=60,
+                        help="Seconds between folder polls in long-running mode (default: 60).")
+    parser.add_argument("--fetch-workers", type=int, default=1,
+                        help="Concurrent Drive downloads (PyDrive shares one connection, default: 1).")
+    parser.add_argument("--ocr-workers", type=int, default=os.cpu_count() or 2,
+                        help="Concurrent OCR jobs (default: CPU count).")
+    parser.add_argument("--llm-workers", type=int, default=LLM_MAX_IN_FLIGHT,
+                        help=f"Concurrent Ollama extraction calls (default: LLM_MAX_IN_FLIGHT={LLM_MAX_IN_FLIGHT}).")
+    parser.add_argument("--validation-workers", type=int, default=1)
+    parser.add_argument("--side-effect-workers", type=int, default=2,
+                        help="Concurrent Supabase/agent side-effect jobs (default: 2).")
+    parser.add_argument("--queue-size", type=int, default=8,
+                        help="Capacity of the queue in front of each stage (default: 8).")
+    parser.add_argument("--ingestion", choices=["poll", "idle"], default=os.getenv("INGESTION_MODE", "poll"),
+                        help="Check Gmail on every folder poll (default) or keep an IMAP IDLE connection open.")
+    parser.add_argument("--watcher", choices=["changes", "list"], default=os.getenv("WATCHER_MODE", "changes"),
+                        help="Follow the Drive changes feed (default) or list the whole folder on every poll.")
+    parser.add_argument("--local-folder",
+                        help="Watch this local directory instead of Drive (offline runs).")
+    parser.add_argument("--mode", choices=["direct", "agent"], default=EXECUTION_MODE,
+                        help="Call the tools directly (default) or route every invoice through the LLM agent.")
+    parser.add_argument("--warm", default=os.getenv("WARM_CLIENTS", ""),
+                        help="Comma-separated clients to build before the first invoice "
+                             "(drive, supabase, llm, llm_stream, smtp or all; default: none, built on first use).")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="Print import and client initialization times once the pipeline is running.")
+    parser.add_argument("--metrics-port", type=int, default=int(os.getenv("METRICS_PORT", "0")),
+                        help="Serve /metrics and /metrics.json on this port (default: off).")
+    parser.add_argument("--trace-file", default=os.getenv("METRICS_TRACE_PATH", ""),
+                        help="Append one JSON line per timing span to this file.")
+    parser.add_argument("--intake-port", type=int, default=int(os.getenv("INTAKE_PORT", "0")),
+                        help="Accept invoices over HTTP on this port alongside polling (default: off).")
+    parser.add_argument("--drive-webhook", default=os.getenv("DRIVE_WEBHOOK_URL", ""),
+                        help="Public URL of /webhooks/drive to register for Drive change notifications.")
+    return parser.parse_args(argv)
+
+
+def make_attachment_handler(pipeline, source, spool=None):
+    """
+    Return an `on_job` callback that hands ingested attachments to the pipeline in memory.
+
+    Each attachment gets a pre-generated Drive file ID and is archived to Drive
+    asynchronously, so OCR starts without waiting for an upload and download.
+    """
+    spool = spool or AttachmentSpool()
+
+    def on_job(job):
+        filename = clean_filename(job['filename'] or f"invoice_{job['uid']}")
+        attachment = spool.add(job['payload'], filename, job['content_type'])
+        file_id = reserve_file_id()
+        # Claim the ID first so the Drive folder poll skips the archived copy
+        source.claim(file_id)
+        archive_to_drive_async(attachment, file_id).add_done_callback(log_archive_result(file_id))
+        pipeline.submit({"file_id": file_id, "attachment": attachment, "sender_email": job['sender_email']})
+
+    return on_job
+
+
+def start_idle_ingestion(pipeline, source):
+    """Run IMAP IDLE ingestion in the background, feeding attachments straight to the pipeline"""
+    ingestor = ImapIdleIngestor(on_job=make_attachment_handler(pipeline, source))
+    threading.Thread(target=ingestor.run_forever, name="imap-idle", daemon=True).start()
+    return ingestor
+
+
+def build_source(args):
+    check_email = args.ingestion == "poll" and not args.local_folder
+    if args.local_folder:
+        return DriveChangesSource(ChangeWatcher(LocalFolderBackend(args.local_folder), state_path=None), check_email)
+    if args.watcher == "changes":
+        return DriveChangesSource(ChangeWatcher(DriveChangesBackend(FOLDER_ID)), check_email)
+    return DriveFolderSource(check_email=check_email)
+
+
+def warm_clients(spec):
+    names = [name.strip() for name in spec.split(",") if name.strip()]
+    if not names:
+        return
+    clients.warm(*([] if "all" in names else names))
+    if "all" in names or "llm_stream" in names:
+        # Building the client does not touch Ollama; load the model too so the first invoice skips it
+        try:
+            clients.get_llm_stream().preload()
+        except Exception as e:
+            print(f"[Clients] Could not preload the Ollama model: {e}")
+    clients.mark("warm")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.trace_file and args.trace_file != metrics.METRICS_TRACE_PATH:
+        metrics.registry.open_trace(args.trace_file)
+    if args.metrics_port:
+        metrics.start_metrics_server(args.metrics_port)
+    warm_clients(args.warm)
+    if WRITE_BEHIND_ENABLED:
+        # Without the constraint every buffered invoice_db flush would fail
+        check_upsert_key(clients.get_supabase(), "invoice_db")
+    pipeline = build_invoice_pipeline(
+        act=dispatch_actions if args.mode == "direct" else run_agent,
+        fetch_workers=args.fetch_workers,
+        ocr_workers=args.ocr_workers,
+        llm_workers=args.llm_workers,
+        validation_workers=args.validation_workers,
+        side_effect_workers=args.side_effect_workers,
+        queue_size=args.queue_size,
+    )
+    source = build_source(args)
+    # Uploads that failed in an earlier run are retried behind the new ones
+    retry_failed_archives_async(force=True)
+    if args.ingestion == "idle":
+        start_idle_ingestion(pipeline, source)
+    if args.intake_port:
+        from ingestion.http_intake import start_intake_server, keep_drive_webhook
+
+        start_intake_server(pipeline, source, args.intake_port)
+        if args.drive_webhook:
+            keep_drive_webhook(DriveChangesBackend(FOLDER_ID), args.drive_webhook)
+    clients.mark("ready")
+    if args.startup_report:
+        clients.startup_report()
+    try:
+        pipeline.run(
+            source,
+            # The intake service needs the pipeline to stay up, so it overrides --once
+            poll_interval=None if args.once and not args.intake_port else args.poll_interval,
+        )
+    finally:
+        # Write out any buffered Supabase rows and queued emails before exiting
+        flush_all()
+        close_mailer()
+
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+from helper import metrics
+load_dotenv()
+
+CACHE_ENABLED = os.getenv("EXTRACTION_CACHE", "true").lower() == "true"
+CACHE_PATH = os.getenv("EXTRACTION_CACHE_PATH", os.path.join(".cache", "extraction_cache.sqlite3"))
+CACHE_MAX_BYTES = int(float(os.getenv("EXTRACTION_CACHE_MAX_MB", "512")) * 1024 * 1024)
+
+OCR_KIND = "ocr"
+FIELDS_KIND = "fields"
+
+
+def sha256_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def sha256_text(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ExtractionCache:
+    """
+    Persistent, content-addressed cache for OCR output and parsed LLM fields.
+
+    OCR results are keyed by the SHA-256 of the file bytes; field dicts by the
+    OCR-text hash, prompt version and model name. Entries are evicted least
+    recently used first once the stored values exceed `max_bytes`.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = {OCR_KIND: 0, FIELDS_KIND: 0}
+        self.misses = {OCR_KIND: 0, FIELDS_KIND: 0}
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " kind TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+            " size INTEGER NOT NULL, accessed REAL NOT NULL, PRIMARY KEY (kind, key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    @staticmethod
+    def fields_key(text_hash, prompt_version, model):
+        return f"{text_hash}:{prompt_version}:{model}"
+
+    def get(self, kind, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM entries WHERE kind = ? AND key = ?", (kind, key)
+            ).fetchone()
+            if row is None:
+                self.misses[kind] = self.misses.get(kind, 0) + 1
+                return None
+            self.hits[kind] = self.hits.get(kind, 0) + 1
+            self._conn.execute(
+                "UPDATE entries SET accessed = ? WHERE kind = ? AND key = ?", (time.time(), kind, key)
+            )
+            self._conn.commit()
+            return json.loads(row[0])
+
+    def put(self, kind, key, value):
+        payload = json.dumps(value)
+        size = len(payload.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._conn.execute(
+                "SELECT size FROM entries WHERE kind = ? AND key = ?", (kind, key)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (kind, key, value, size, accessed) VALUES (?, ?, ?, ?, ?)",
+                (kind, key, payload, size, time.time()),
+            )
+            self._total_bytes += size - (previous[0] if previous else 0)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT kind, key, size FROM entries ORDER BY accessed LIMIT 64"
+            ).fetchall()
+            if not rows:
+                self._total_bytes = 0
+                return
+            for kind, key, size in rows:
+                self._conn.execute("DELETE FROM entries WHERE kind = ? AND key = ?", (kind, key))
+                self._total_bytes -= size
+                if self._total_bytes <= self.max_bytes:
+                    break
+
+    def get_ocr(self, file_hash):
+        return self.get(OCR_KIND, file_hash)
+
+    def put_ocr(self, file_hash, pages):
+        self.put(OCR_KIND, file_hash, pages)
+
+    def get_fields(self, text_hash, prompt_version, model):
+        return self.get(FIELDS_KIND, self.fields_key(text_hash, prompt_version, model))
+
+    def put_fields(self, text_hash, prompt_version, model, fields):
+        self.put(FIELDS_KIND, self.fields_key(text_hash, prompt_version, model), fields)
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            return {
+                "entries": entries,
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": dict(self.hits),
+                "misses": dict(self.misses),
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the shared cache, or None when EXTRACTION_CACHE is disabled"""
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ExtractionCache()
+            metrics.register_gauge("cache_hits", lambda: dict(_cache.hits))
+            metrics.register_gauge("cache_misses", lambda: dict(_cache.misses))
+        return _cache
@@ -0,0 +1,150 @@
+import os
+import re
+
+from dotenv import load_dotenv
+from helper import metrics
+
+load_dotenv()
+
+COMPACTION_ENABLED = os.getenv("OCR_COMPACTION", "true").lower() == "true"
+# Estimated tokens of OCR text allowed into the extraction prompt (0 = no limit, only clean up)
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))
+
+# Pages are joined with this, so compaction can tell which lines repeat on every page
+PAGE_BREAK = "\n\f"
+
+# Rough stand-in for a BPE tokenizer: words count one token per four characters, punctuation one each
+TOKEN_RE = re.compile(r"\w{1,4}|[^\w\s]")
+RULE_RE = re.compile(r"([-_=~.*|+#:•])\1{2,}")
+SPACE_RE = re.compile(r"\s+")
+PAGE_NUMBER_RE = re.compile(r"^(?:page\s*\d+(?:\s*(?:of|/)\s*\d+)?|\d+\s*of\s*\d+)$", re.IGNORECASE)
+
+KEYWORD_RE = re.compile(
+    r"\b(?:invoice|inv|bill|billing|ship|shipping|gst|gstin|pan|hsn|sac|tax|taxes|cgst|sgst|igst|cess|"
+    r"total|amount|payable|due|date|dated|payment|terms|customer|buyer|consignee|seller|supplier|"
+    r"address|currency|inr|usd|eur|rs|qty|rate|subtotal|grand)\b",
+    re.IGNORECASE,
+)
+NUMBER_RE = re.compile(
+    r"\d[\d,]*\.\d{2}\b"                       # amounts
+    r"|\b\d{1,4}[/.\-]\d{1,2}[/.\-]\d{2,4}\b"  # dates
+    r"|\b\d{2}[A-Z]{5}\d{4}[A-Z]\w{3}\b"       # GSTIN
+    r"|\b[A-Z]{5}\d{4}[A-Z]\b"                 # PAN
+    r"|[₹$€]"
+)
+BOILERPLATE_RE = re.compile(
+    r"\b(?:hereby|shall|liable|liability|jurisdiction|warranty|indemnify|subject to|interest @|"
+    r"goods once sold|computer generated|e\.\s*&\s*o\.\s*e|declaration)\b",
+    re.IGNORECASE,
+)
+# Lines at the top of the first page carry the issuer's name and address, usually without keywords
+HEADER_LINES = 8
+# Only this many lines at the top and bottom of a page can be a repeated header or footer
+EDGE_LINES = 6
+
+
+def estimate_tokens(text):
+    return len(TOKEN_RE.findall(text))
+
+
+def clean_line(line):
+    """Collapse whitespace and ruled-line runs; empty when nothing readable is left"""
+    line = SPACE_RE.sub(" ", RULE_RE.sub(" ", line)).strip()
+    visible = line.replace(" ", "")
+    alnum = sum(char.isalnum() for char in visible)
+    # Scanner speckle comes out as short runs of punctuation and stray letters
+    if alnum < 2 or alnum * 2 < len(visible) or PAGE_NUMBER_RE.match(line):
+        return ""
+    return line
+
+
+def score_line(line, page, position):
+    """Relevance of a line to the extraction prompt; higher is kept first under the budget"""
+    score = 0
+    if KEYWORD_RE.search(line):
+        score += 3
+    if NUMBER_RE.search(line):
+        score += 2
+    if page == 0 and position < HEADER_LINES:
+        score += 2
+    if BOILERPLATE_RE.search(line) or (len(line) > 160 and not NUMBER_RE.search(line)):
+        score -= 3
+    return score
+
+
+def compact_text(text, budget=None):
+    """
+    Shrink OCR text for the extraction prompt and return (text, stats).
+
+    Whitespace and ruled-line runs are collapsed, noise lines and page numbers
+    dropped, and headers and footers kept once: a line within EDGE_LINES of the
+    top or bottom of a page is dropped if it was also at the edge of an earlier
+    page, while repeated lines in the body (line items) are all kept.
+    If the rest is still over `budget` estimated tokens, lines are ranked by
+    invoice keywords, numbers and their neighbours, and the best that fit are
+    kept in their original order.
+    """
+    budget = PROMPT_TOKEN_BUDGET if budget is None else budget
+    lines = []
+    first_page = {}
+    noise = duplicates = 0
+    for page_number, page in enumerate(text.split("\f")):
+        cleaned = []
+        for raw in page.splitlines():
+            line = clean_line(raw)
+            if line:
+                cleaned.append(line)
+            else:
+                noise += bool(raw.strip())
+        position = 0
+        for index, line in enumerate(cleaned):
+            if index < EDGE_LINES or index >= len(cleaned) - EDGE_LINES:
+                key = line.lower()
+                if first_page.setdefault(key, page_number) != page_number:
+                    duplicates += 1
+                    continue
+            lines.append((line, page_number, position, estimate_tokens(line)))
+            position += 1
+
+    kept = lines
+    total = sum(tokens for *_, tokens in lines)
+    if budget and total > budget:
+        scores = [score_line(line, page, position) for line, page, position, _ in lines]
+        # A value often sits on the line after its label, so neighbours of relevant lines gain a little
+        boosted = [
+            score + (1 if max(scores[i - 1] if i else 0, scores[i + 1] if i + 1 < len(scores) else 0) >= 3 else 0)
+            for i, score in enumerate(scores)
+        ]
+        ranked = sorted(range(len(lines)), key=lambda i: (-boosted[i], i))
+        chosen, used = set(), 0
+        for i in ranked:
+            if used + lines[i][3] <= budget:
+                chosen.add(i)
+                used += lines[i][3]
+        kept = [lines[i] for i in sorted(chosen)]
+
+    compacted = "\n".join(line for line, *_ in kept)
+    stats = {
+        "tokens_before": estimate_tokens(text),
+        "tokens_after": sum(tokens for *_, tokens in kept),
+        "lines_before": len(text.splitlines()),
+        "lines_after": len(kept),
+        "noise_lines": noise,
+        "duplicate_lines": duplicates,
+        "over_budget_lines": len(lines) - len(kept),
+    }
+    return compacted, stats
+
+
+def compact_for_prompt(text):
+    """compact_text() with the configured budget, recording before/after token counts; no-op when disabled"""
+    if not COMPACTION_ENABLED:
+        return text
+    with metrics.span("llm.compact"):
+        compacted, stats = compact_text(text)
+    metrics.inc("prompt_tokens", stats["tokens_before"], text="raw")
+    metrics.inc("prompt_tokens", stats["tokens_after"], text="compacted")
+    print(f"[Compaction] {stats['tokens_before']} -> {stats['tokens_after']} tokens "
+          f"({stats['lines_before']} -> {stats['lines_after']} lines, {stats['duplicate_lines']} repeated, "
+          f"{stats['noise_lines']} noise, {stats['over_budget_lines']} over budget)")
+    return compacted
@@ -2,43 +2,184 @@ import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'watcher')))
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-import re
 from file_watcher import get_latest_file_in_folder
-from pdf2image import convert_from_path
-import pytesseract
-from langchain_ollama import OllamaLLM
-from langchain.prompts import PromptTemplate
+from PIL import Image
 import os
 import json
-from supabase import create_client
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from ingestion.gmail_ingestion import check_email_and_upload
 from helper.drive_uploader import get_drive_uploader_email
+from ocr.rasterizer import RASTER_MAX_BYTES, get_pdf_info, iter_page_windows
+from ocr.text_layer import TEXT_LAYER_ENABLED, TEXT_LAYER_MIN_CHARS, extract_text_layer, is_usable_text
+from ocr.cache import get_cache, sha256_file, sha256_text
+from ocr.pre_extractor import PRE_EXTRACT_ENABLED, pre_extract_fields
+from ocr.compaction import PAGE_BREAK, compact_for_prompt
+from ocr.preprocess import OCR_IMAGE_PROFILE, OCR_PROFILE, get_profile
+from ocr.tesseract_pool import (
+    OCR_BATCH_PAGES, init_pool_worker, ocr_batch, ocr_batch_collected, ocr_image, resolve_backend, split_batches,
+)
+from ocr.structured_output import (
+    LLM_FIELD_RETRIES, LLM_JSON_SCHEMA, coerce_fields, extraction_schema, parse_response, record_call,
+)
+from helper.write_behind import WRITE_BEHIND_ENABLED, get_write_buffer, report_write
+from helper.clients import get_llm, get_llm_stream, get_supabase
+from helper import metrics
 
 from dotenv import load_dotenv
 load_dotenv()
 
+# Number of tesseract processes used to OCR the pages of one PDF (1 = serial)
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", os.cpu_count() or 1))
+# Read page 1 (and the last page) of a PDF first, and later pages only while these fields are still missing
+OCR_LAZY = os.getenv("OCR_LAZY", "true").lower() == "true"
+OCR_LAZY_LAST_PAGE = os.getenv("OCR_LAZY_LAST_PAGE", "true").lower() == "true"
+OCR_LAZY_FIELDS = [field.strip() for field in os.getenv(
+    "OCR_LAZY_FIELDS", "Company Name,Invoice Number,Invoice Date,GSTIN,Total Amount,Customer Name"
+).split(",") if field.strip()]
+# Bounds on the later pages read for missing fields, which may simply not be on the document
+OCR_LAZY_MAX_EXTRA_PAGES = int(os.getenv("OCR_LAZY_MAX_EXTRA_PAGES", "8"))
+OCR_LAZY_MAX_IDLE_PAGES = int(os.getenv("OCR_LAZY_MAX_IDLE_PAGES", "4"))
+# Later pages are OCRed this many at a time through the OCR pool
+OCR_LAZY_BATCH_PAGES = int(os.getenv("OCR_LAZY_BATCH_PAGES", str(max(2, OCR_WORKERS))))
+
+# Pools are created from pipeline worker threads, and forking a multithreaded process can leave
+# the child blocked on a lock another thread held (HTTP sessions, metrics, sqlite), so never fork
+OCR_POOL_START_METHOD = os.getenv(
+    "OCR_POOL_START_METHOD", "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
 
+_ocr_pools = {}
+_ocr_pools_lock = threading.Lock()
 
 
-def extract_text_from_image(image_path):
-    return pytesseract.image_to_string(image_path)
-
-def extract_text_from_pdf(pdf_path):
-    images = convert_from_path(pdf_path)
-    texts = [pytesseract.image_to_string(image) for image in images]
-    return ' '.join(texts)
-
+def get_ocr_pool(workers):
+    """Return the shared process pool with `workers` processes, creating it on first use"""
+    with _ocr_pools_lock:
+        pool = _ocr_pools.get(workers)
+        if pool is None:
+            pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context(OCR_POOL_START_METHOD),
+                initializer=init_pool_worker,
+            )
+            _ocr_pools[workers] = pool
+        return pool
 
-llm = OllamaLLM(model="mistral")  # Requires Ollama to be running
 
-prompt_template = PromptTemplate(
-    input_variables=["text", "sender_email"],
-    template="""
+def extract_text_from_image(image_path):
+    with metrics.span("ocr.page", page=1):
+        return ocr_image(image_path, OCR_IMAGE_PROFILE)
+
+def ocr_pdf_pages(pdf_path, pages=None, workers=None):
+    """OCR the given PDF pages (all when None) and return {page_number: text}"""
+    workers = OCR_WORKERS if workers is None else workers
+    profile = get_profile(OCR_PROFILE)
+    backend = resolve_backend()
+    texts = {}
+    # Rasterize one window of pages at a time so memory stays flat with page count.
+    # A full window gives every worker an OCR_BATCH_PAGES batch, but the RASTER_MAX_MB
+    # budget caps it before batching. Pages sent to the pool are also copied into the
+    # worker processes, and the pool is shared with every other document being OCR'd,
+    # so the pooled path plans with an equal share of the budget per worker process.
+    budget = RASTER_MAX_BYTES // workers if workers > 1 else RASTER_MAX_BYTES
+    windows = iter_page_windows(pdf_path, window=max(1, workers) * OCR_BATCH_PAGES, dpi=profile["dpi"],
+                                max_bytes=budget, pages=pages)
+    while True:
+        started = time.perf_counter()
+        window = next(windows, None)
+        if window is None:
+            break
+        numbers = [number for number, _ in window]
+        images = [image for _, image in window]
+        metrics.record("ocr.rasterize", time.perf_counter() - started, pages=numbers)
+        batches = split_batches(images, workers)
+        with metrics.span("ocr.pages", pages=numbers, backend=backend):
+            if workers <= 1 or len(batches) <= 1:
+                results = [text for batch in batches
+                           for text in ocr_batch(batch, profile["name"], profile["dpi"], backend)]
+            else:
+                # map() yields results in submission order, so pages stay in sequence
+                results = []
+                for batch_texts, spans in get_ocr_pool(workers).map(
+                    ocr_batch_collected, batches, repeat(profile["name"]), repeat(profile["dpi"]), repeat(backend)
+                ):
+                    results.extend(batch_texts)
+                    metrics.replay(spans)
+        texts.update(zip(numbers, results))
+    return texts
+
+def _page_runs(pages):
+    """Group sorted page numbers into (first, last) runs of consecutive pages"""
+    runs = []
+    for number in sorted(pages):
+        if runs and number == runs[-1][1] + 1:
+            runs[-1][1] = number
+        else:
+            runs.append([number, number])
+    return runs
+
+def _text_layer_pages(pdf_path, pages):
+    """{page_number: text} from the text layer for `pages` (all when None), or None without one"""
+    if pages is None:
+        layer = extract_text_layer(pdf_path)
+        return dict(enumerate(layer, start=1)) if layer else None
+    texts = {}
+    # Only the requested ranges, so reading one more page does not re-read the whole document
+    for first, last in _page_runs(pages):
+        layer = extract_text_layer(pdf_path, first=first, last=last)
+        if not layer:
+            return None
+        texts.update(zip(range(first, last + 1), layer))
+    return texts
+
+def extract_pdf_pages(pdf_path, workers=None, pages=None):
+    """
+    Extract every page of a PDF (or only the 1-based `pages`), preferring the embedded text layer.
+
+    Returns a list of {"page", "source", "text"} dicts in page order, where source
+    is "text_layer" for pages read directly and "ocr" for pages sent to tesseract.
+    """
+    with metrics.span("ocr.text_layer"):
+        layer = _text_layer_pages(pdf_path, pages) if TEXT_LAYER_ENABLED else None
+    if not layer:
+        return [
+            {"page": number, "source": "ocr", "text": text}
+            for number, text in sorted(ocr_pdf_pages(pdf_path, pages=pages, workers=workers).items())
+        ]
+
+    records = [
+        {"page": number, "source": "text_layer", "text": text}
+        for number, text in sorted(layer.items())
+    ]
+    scanned = [page["page"] for page in records if not is_usable_text(page["text"])]
+    if scanned:
+        ocr_texts = ocr_pdf_pages(pdf_path, pages=scanned, workers=workers)
+        for page in records:
+            if page["page"] in ocr_texts:
+                page["source"] = "ocr"
+                page["text"] = ocr_texts[page["page"]]
+    print(f"[OCR] {os.path.basename(pdf_path)}: {len(records) - len(scanned)} text-layer page(s), "
+          f"{len(scanned)} OCR page(s)")
+    return records
+
+def extract_text_from_pdf(pdf_path, workers=None):
+    return PAGE_BREAK.join(page["text"] for page in extract_pdf_pages(pdf_path, workers))
+
+
+MODEL_NAME = os.getenv("OLLAMA_MODEL", "mistral")
+# Stream the answer from Ollama and stop at the end of the JSON object (false = blocking LangChain call)
+LLM_STREAMING = os.getenv("LLM_STREAMING", "true").lower() == "true"
+# Bump whenever the extraction prompt changes so cached field dicts are not reused
+PROMPT_VERSION = "3"
+
+EXTRACTION_PROMPT = """
 You are an expert at extracting structured data from documents. Given the OCR text from a document, extract and return a JSON with the following fields:
 
-Company Name, Invoice Number, Invoice Date, GSTIN, PAN, HSN/SAC, Taxes, Total Amount, Payment Terms, Currency, Customer Name, Billing Address, Shipping Address, Document Type, Company Address, Received_From.
-
-Received_From = {{sender_email}}
+{fields}.
 
 - Only use information explicitly present in the text.
 - If a field is not found in the text, set its value to null.
@@ -52,38 +193,86 @@ OCR Text:
 Return only JSON:
 Return only a valid JSON object (no explanations, no markdown).
 """
-)
 
-chain = prompt_template | llm
+_chain = None
+_chain_lock = threading.Lock()
+
 
-def extract_json_from_response(text: str) -> str:
-    code_block_match = re.search(r"```json\s*(\{.*?\})\s*```", text, re.DOTALL)
-    if not code_block_match:
-        code_block_match = re.search(r"```\s*(\{.*?\})\s*```", text, re.DOTALL)
-    if code_block_match:
-        return code_block_match.group(1)
-    json_match = re.search(r"(\{.*\})", text, re.DOTALL)
-    if json_match:
-        return json_match.group(1)
-    # If no JSON found, return original text (likely invalid)
-    return text
+def get_chain():
+    """Build the prompt | LLM chain on first use, so importing this module does not touch Ollama"""
+    global _chain
+    with _chain_lock:
+        if _chain is None:
+            from langchain_core.prompts import PromptTemplate
 
+            prompt_template = PromptTemplate(input_variables=["text", "fields"], template=EXTRACTION_PROMPT)
+            _chain = prompt_template | get_llm()
+        return _chain
 
 def extract_fields_with_llm(ocr_text, sender_email):
-    result = chain.invoke({"text": ocr_text, "sender_email": sender_email}).strip()
-    # If result doesn't start with {
-    if not result.startswith('{'):
-        result = '{' + result
-    if not result.endswith('}'):
-        result = result + '}'
-    try:
-        return json.loads(result)
-    except Exception as e:
-        return {
-            "error": "Failed to parse JSON",
-            "exception": str(e),
-            "raw_output": result
-        }
+    cache = get_cache()
+    text_hash = sha256_text(ocr_text) if cache else None
+    if cache:
+        cached = cache.get_fields(text_hash, PROMPT_VERSION, MODEL_NAME)
+        if cached is not None:
+            print("[Cache] Reusing extracted fields for known OCR text")
+            metrics.inc("llm_skipped", reason="cache")
+            return cached
+
+    # Fill the rigidly formatted fields with regexes and only ask the LLM for the rest
+    fields = pre_extract_fields(ocr_text) if PRE_EXTRACT_ENABLED else {}
+    missing = [field for field in LLM_FIELDS if field not in fields]
+    if not missing:
+        print("[INFO] All fields matched by the pre-extractor, skipping LLM call")
+        metrics.inc("llm_skipped", reason="pre_extractor")
+    else:
+        llm_fields = _invoke_extraction_chain(ocr_text, missing)
+        if "error" in llm_fields:
+            return llm_fields
+        fields = {**llm_fields, **fields}
+
+    if cache:
+        cache.put_fields(text_hash, PROMPT_VERSION, MODEL_NAME, fields)
+    return fields
+
+
+def _generate(ocr_text, field_names):
+    if LLM_STREAMING:
+        prompt = EXTRACTION_PROMPT.format(text=ocr_text, fields=", ".join(field_names))
+        schema = extraction_schema(field_names) if LLM_JSON_SCHEMA else None
+        return get_llm_stream().complete(prompt, format=schema).strip()
+    return get_chain().invoke({"text": ocr_text, "fields": ", ".join(field_names)}).strip()
+
+
+def _invoke_extraction_chain(ocr_text, field_names):
+    """
+    Ask the LLM for `field_names` and return them typed, or an error dict if no answer could be parsed.
+
+    Fields that come back missing or mistyped are asked for again on their own,
+    up to LLM_FIELD_RETRIES times, instead of rerunning the whole document;
+    whatever still fails is left to enforce_nulls.
+    """
+    ocr_text = compact_for_prompt(ocr_text)
+    fields, pending, raw_outputs = {}, list(field_names), []
+    for attempt in range(1 + max(0, LLM_FIELD_RETRIES)):
+        if attempt:
+            metrics.inc("llm_field_retries", len(pending))
+            print(f"[LLM] Asking again for {', '.join(pending)}")
+        with metrics.span("llm.extract", fields=len(pending), attempt=attempt):
+            result = _generate(ocr_text, pending)
+        with metrics.span("llm.json_repair"):
+            parsed, repaired = parse_response(result)
+        record_call(parsed is not None, repaired)
+        if parsed is None:
+            raw_outputs.append(result)
+            continue
+        values, pending = coerce_fields(parsed, pending)
+        fields.update(values)
+        if not pending:
+            break
+    if not fields and raw_outputs:
+        return {"error": "Failed to parse JSON", "raw_output": raw_outputs[-1]}
+    return fields
 
 
 REQUIRED_FIELDS = [
@@ -92,27 +281,227 @@ REQUIRED_FIELDS = [
     "Billing Address", "Shipping Address", "Document Type", "Company Address", "Received_From"
 ]
 
+# Received_From comes from the email/Drive metadata, never from the document text
+LLM_FIELDS = [field for field in REQUIRED_FIELDS if field != "Received_From"]
+
 def enforce_nulls(output_dict):
     if isinstance(output_dict, dict) and "error" not in output_dict:
         return {field: output_dict.get(field, None) for field in REQUIRED_FIELDS}
     return output_dict
 
-def extract_fields(filepath, sender_email):
-    if filepath.lower().endswith(('.png', '.jpg', '.jpeg')):
-        ocr_text = extract_text_from_image(filepath)
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+def _cached_pages(content_hash, extract, label):
+    cache = get_cache()
+    if not cache:
+        return extract()
+    pages = cache.get_ocr(content_hash)
+    if pages is not None:
+        print(f"[Cache] Reusing OCR text for {label}")
+        return pages
+    pages = extract()
+    cache.put_ocr(content_hash, pages)
+    return pages
+
+def _ocr_cache_key(content_hash, profile, pages):
+    # Text produced by another backend or text-layer setting must not be reused
+    text_layer = f"layer{TEXT_LAYER_MIN_CHARS}" if TEXT_LAYER_ENABLED else "nolayer"
+    key = f"{content_hash}:{profile}:{resolve_backend()}:{text_layer}"
+    return f"{key}:{','.join(map(str, sorted(pages)))}" if pages else key
+
+def extract_pages(filepath, pages=None):
+    """Return per-page {"page", "source", "text"} records for an image or PDF (only `pages` of a PDF when given)"""
+    if filepath.lower().endswith(IMAGE_EXTENSIONS):
+        extract = lambda: [{"page": 1, "source": "ocr", "text": extract_text_from_image(filepath)}]
+        pages = None
     elif filepath.lower().endswith('.pdf'):
-        ocr_text = extract_text_from_pdf(filepath)
+        extract = lambda: extract_pdf_pages(filepath, pages=pages)
     else:
         raise ValueError("Unsupported file type: must be PDF or image.")
 
+    if not get_cache():
+        return extract()
+    profile = OCR_IMAGE_PROFILE if filepath.lower().endswith(IMAGE_EXTENSIONS) else OCR_PROFILE
+    return _cached_pages(_ocr_cache_key(sha256_file(filepath), profile, pages), extract, os.path.basename(filepath))
+
+def extract_pages_from_attachment(attachment, pages=None, path=None):
+    """
+    Like extract_pages, for an in-memory or spooled helper.attachment_spool.Attachment.
+
+    `path` is a file already holding the attachment's bytes, reused instead of writing another copy.
+    """
+    name = (attachment.filename or "").lower()
+    content_type = attachment.content_type or ""
+    profile = OCR_PROFILE
+    if name.endswith(IMAGE_EXTENSIONS) or content_type.startswith("image/"):
+        profile = OCR_IMAGE_PROFILE
+        pages = None
+
+        def extract():
+            with attachment.open() as stream:
+                return [{"page": 1, "source": "ocr", "text": extract_text_from_image(Image.open(stream))}]
+    elif name.endswith('.pdf') or content_type == "application/pdf":
+        def extract():
+            if path is not None:
+                return extract_pdf_pages(path, pages=pages)
+            # poppler tools need a real file; spooled attachments already have one
+            with attachment.as_file() as pdf_path:
+                return extract_pdf_pages(pdf_path, pages=pages)
+    else:
+        raise ValueError("Unsupported file type: must be PDF or image.")
+
+    if not get_cache():
+        return extract()
+    return _cached_pages(_ocr_cache_key(attachment.sha256(), profile, pages), extract, attachment.filename)
+
+class PageReader:
+    """
+    Read the pages of a file or attachment on demand, for lazy OCR.
+
+    With OCR_LAZY on, `first_pages()` is page 1 plus the last page (where the
+    totals usually are) and the rest are only read by `read_until_complete`
+    while required fields are still missing. Images always have one page.
+
+    `open()` gives an in-memory PDF attachment one file on disk for every
+    later read; `close()` removes it and releases the file or attachment
+    through `release`, once.
+    """
+
+    def __init__(self, filepath=None, attachment=None, release=None):
+        self.filepath = filepath
+        self.attachment = attachment
+        self._release = release
+        self._page_count = None
+        self._path = None
+        self._as_file = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def is_pdf(self):
+        if self.attachment is not None:
+            return ((self.attachment.filename or "").lower().endswith(".pdf")
+                    or self.attachment.content_type == "application/pdf")
+        return self.filepath.lower().endswith(".pdf")
+
+    def open(self):
+        if self.attachment is not None and self.is_pdf() and self._as_file is None:
+            self._as_file = self.attachment.as_file()
+            self._path = self._as_file.__enter__()
+        return self
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self._as_file is not None:
+            self._as_file.__exit__(None, None, None)
+            self._as_file = self._path = None
+        if self._release:
+            self._release()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def page_count(self):
+        if self._page_count is None:
+            self._page_count = 1
+            if self.is_pdf():
+                try:
+                    if self._path is None and self.attachment is not None:
+                        with self.attachment.as_file() as path:
+                            self._page_count = int(get_pdf_info(path).get("Pages", 0)) or None
+                    else:
+                        self._page_count = int(get_pdf_info(self._path or self.filepath).get("Pages", 0)) or None
+                except Exception as e:
+                    print(f"[OCR] Could not count pages, reading all of them: {e}")
+                    self._page_count = None
+        return self._page_count
+
+    def first_pages(self):
+        """Pages to read up front; None means all of them"""
+        count = self.page_count()
+        if not OCR_LAZY or count is None or count <= 1 + OCR_LAZY_LAST_PAGE:
+            return None
+        return [1, count] if OCR_LAZY_LAST_PAGE else [1]
+
+    def remaining_pages(self, read):
+        count = self.page_count() or 0
+        done = {page["page"] for page in read}
+        return [number for number in range(1, count + 1) if number not in done]
+
+    def read(self, pages=None):
+        if self.attachment is not None:
+            return extract_pages_from_attachment(self.attachment, pages, path=self._path)
+        return extract_pages(self.filepath, pages)
+
+
+def missing_required_fields(fields):
+    return [field for field in OCR_LAZY_FIELDS if fields.get(field) in (None, "")]
+
+
+def read_until_complete(reader, pending, fields):
+    """
+    OCR later pages while required fields are still missing, a batch at a time.
+
+    At most OCR_LAZY_MAX_EXTRA_PAGES are read, and reading stops after
+    OCR_LAZY_MAX_IDLE_PAGES pages in a row add nothing, so a field that is
+    simply absent does not OCR the whole document page by page. Each batch
+    goes through the OCR pool together; the regex pre-extractor runs on it,
+    then one LLM call asks for the fields still missing from all the later
+    pages read so far. Returns (fields, pages read, pages skipped).
+    """
+    fields = dict(fields)
+    total = len(pending)
+    pending = pending[:OCR_LAZY_MAX_EXTRA_PAGES]
+    read, idle = [], 0
+    batch_size = max(1, OCR_LAZY_BATCH_PAGES)
+    for start in range(0, len(pending), batch_size):
+        missing = missing_required_fields(fields)
+        if not missing or idle >= OCR_LAZY_MAX_IDLE_PAGES:
+            break
+        batch = pending[start:start + batch_size]
+        print(f"[OCR] Reading page(s) {', '.join(map(str, batch))} for {', '.join(missing)}")
+        records = reader.read(batch)
+        read += records
+        text = PAGE_BREAK.join(page["text"] for page in records)
+        found = {field: value for field, value in (pre_extract_fields(text) if PRE_EXTRACT_ENABLED else {}).items()
+                 if field in missing}
+        still_missing = [field for field in missing if field not in found]
+        if still_missing:
+            gathered = PAGE_BREAK.join(page["text"] for page in read)
+            llm_fields = _invoke_extraction_chain(gathered, still_missing)
+            if "error" not in llm_fields:
+                found.update({field: value for field, value in llm_fields.items() if value not in (None, "")})
+        fields.update(found)
+        idle = 0 if found else idle + len(batch)
+    skipped = total - len(read)
+    if skipped:
+        metrics.inc("ocr_pages_skipped", skipped)
+    return fields, read, skipped
+
+
+def extract_text(filepath):
+    return PAGE_BREAK.join(page["text"] for page in extract_pages(filepath))
+
+def extract_fields(filepath, sender_email):
+    reader = PageReader(filepath)
+    pages = reader.read(reader.first_pages())
+    ocr_text = PAGE_BREAK.join(page["text"] for page in pages)
+
     print("\n[INFO] OCR Text \n", ocr_text)
     raw_result = extract_fields_with_llm(ocr_text, sender_email)
+    pending = reader.remaining_pages(pages)
+    if pending and isinstance(raw_result, dict) and "error" not in raw_result:
+        raw_result, _, skipped = read_until_complete(reader, pending, raw_result)
+        print(f"[OCR] Skipped {skipped} of {reader.page_count()} page(s)")
     validated_result = enforce_nulls(raw_result)
     return validated_result
 
 
-supabase = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
-
 def insert_to_supabase(data: dict):
     try:
         if isinstance(data.get("Taxes"), dict):
@@ -120,7 +509,17 @@ def insert_to_supabase(data: dict):
 
         if isinstance(data.get("Billing Address"), dict):
             data["Billing Address"] = json.dumps(data["Billing Address"])
-        response = supabase.table("extracted_information").insert([data]).execute()
+        if WRITE_BEHIND_ENABLED and data.get("file_id"):
+            get_write_buffer(get_supabase(), "extracted_information").add(data)
+            print(f"Queued extracted data for file_id={data['file_id']}")
+            return
+        try:
+            with metrics.span("db.insert", table="extracted_information"):
+                response = get_supabase().table("extracted_information").insert([data]).execute()
+        except Exception as e:
+            report_write("extracted_information", data.get("file_id"), False, e)
+            raise
+        report_write("extracted_information", data.get("file_id"), True)
         print("Successfully inserted data:")
         print(response)
     except Exception as e:
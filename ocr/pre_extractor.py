@@ -0,0 +1,122 @@
+import os
+import re
+from datetime import datetime
+
+from dotenv import load_dotenv
+load_dotenv()
+
+PRE_EXTRACT_ENABLED = os.getenv("PRE_EXTRACT", "true").lower() == "true"
+
+# Patterns are compiled once at import; every match must be unambiguous to be used,
+# otherwise the field is left for the LLM.
+
+GSTIN_RE = re.compile(r"\b(\d{2}[A-Z]{5}\d{4}[A-Z][1-9A-Z]Z[0-9A-Z])\b")
+PAN_RE = re.compile(r"\bPAN(?:\s*(?:No|Number))?\.?\s*[:#\-]?\s*([A-Z]{5}\d{4}[A-Z])\b", re.IGNORECASE)
+HSN_RE = re.compile(r"\b(?:HSN|SAC)(?:\s*/\s*SAC)?(?:\s*Code)?\s*[:#\-]?\s*(\d{4,8})\b", re.IGNORECASE)
+INVOICE_NUMBER_RE = re.compile(
+    r"\bInvoice\s*(?:No|Number|#)\.?\s*[:#\-]?\s*([A-Z0-9][A-Z0-9/\-]{2,})",
+    re.IGNORECASE,
+)
+INVOICE_DATE_RE = re.compile(
+    r"\b(?:Invoice\s*Date|Date\s*of\s*Invoice|Dated)\s*[:\-]?\s*"
+    r"(\d{4}-\d{1,2}-\d{1,2}|\d{1,2}[/.\-]\d{1,2}[/.\-]\d{4}|\d{1,2}[\s\-][A-Za-z]{3,9}[\s\-,]+\d{4})",
+    re.IGNORECASE,
+)
+TOTAL_RE = re.compile(
+    r"\b(Grand\s*Total|Total\s*Amount(?:\s*Payable)?|Amount\s*Payable|Invoice\s*Total|Total\s*Due|Net\s*Payable)"
+    r"\s*(?:\([A-Za-z ]*\))?\s*[:\-]?\s*(?:INR|USD|EUR|Rs\.?|₹|\$|€)?\s*([\d,]+(?:\.\d{1,2})?)",
+    re.IGNORECASE,
+)
+# Labels that name the final amount outrank a plain "Total Amount", which may be a pre-tax subtotal
+FINAL_TOTAL_RE = re.compile(r"grand|payable", re.IGNORECASE)
+CURRENCY_RE = re.compile(r"(\bINR\b|\bUSD\b|\bEUR\b|\bRs\.?(?=\s*\d)|₹|\$|€)")
+PAYMENT_TERMS_RE = re.compile(r"\bPayment\s*Terms\s*[:\-]\s*([^\n]{2,80})", re.IGNORECASE)
+DOCUMENT_TYPE_RE = re.compile(
+    r"^\s*(Tax\s+Invoice|Proforma\s+Invoice|Commercial\s+Invoice|Credit\s+Note|Debit\s+Note|Receipt|Bill\s+of\s+Supply|Invoice)\s*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+CURRENCY_SYMBOLS = {"₹": "INR", "RS": "INR", "RS.": "INR", "$": "USD", "€": "EUR"}
+DATE_FORMATS = (
+    "%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y",
+    "%d %b %Y", "%d %B %Y", "%d-%b-%Y", "%d-%B-%Y", "%d %b, %Y", "%d %B, %Y",
+)
+
+
+def _unique(values):
+    """Return the single distinct value, or None when there are zero or several"""
+    distinct = set(values)
+    return distinct.pop() if len(distinct) == 1 else None
+
+
+def parse_date(value):
+    """Normalize a matched date to yyyy-mm-dd; Indian day-first order is assumed for numeric dates"""
+    cleaned = re.sub(r"\s+", " ", value.strip())
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(cleaned, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+
+def normalize_currency(token):
+    token = token.strip()
+    return CURRENCY_SYMBOLS.get(token.upper(), token.upper())
+
+
+def pre_extract_fields(text):
+    """
+    Extract the rigidly formatted invoice fields with regular expressions.
+
+    Returns a dict containing only the fields matched with high confidence:
+    a single distinct value or, for totals, the last "grand total" / "amount
+    payable" (else the last labelled total) as a float. Fields that are absent
+    or ambiguous are omitted so the LLM can handle them.
+    """
+    fields = {}
+
+    gstin = _unique(GSTIN_RE.findall(text))
+    if gstin:
+        fields["GSTIN"] = gstin
+
+    pan = _unique(m.upper() for m in PAN_RE.findall(text))
+    if pan:
+        fields["PAN"] = pan
+
+    hsn = _unique(HSN_RE.findall(text))
+    if hsn:
+        fields["HSN/SAC"] = hsn
+
+    invoice_number = _unique(m.strip("-/") for m in INVOICE_NUMBER_RE.findall(text))
+    if invoice_number and any(ch.isdigit() for ch in invoice_number):
+        fields["Invoice Number"] = invoice_number
+
+    dates = [parse_date(m) for m in INVOICE_DATE_RE.findall(text)]
+    invoice_date = _unique(d for d in dates if d)
+    if invoice_date:
+        fields["Invoice Date"] = invoice_date
+
+    totals = TOTAL_RE.findall(text)
+    if totals:
+        final = [amount for label, amount in totals if FINAL_TOTAL_RE.search(label)]
+        # Otherwise the last labelled total is the grand total on itemised invoices
+        amount = (final or [amount for _, amount in totals])[-1].replace(",", "")
+        try:
+            fields["Total Amount"] = float(amount)
+        except ValueError:
+            pass
+
+    currency = _unique(normalize_currency(m) for m in CURRENCY_RE.findall(text))
+    if currency:
+        fields["Currency"] = currency
+
+    terms = _unique(m.strip() for m in PAYMENT_TERMS_RE.findall(text))
+    if terms:
+        fields["Payment Terms"] = terms
+
+    document_type = DOCUMENT_TYPE_RE.search(text)
+    if document_type:
+        fields["Document Type"] = re.sub(r"\s+", " ", document_type.group(1)).title()
+
+    return fields
@@ -0,0 +1,135 @@
+import os
+
+from PIL import Image, ImageOps
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Speed/quality trade-off for OCR; image uploads (often phone photos) can use their own profile
+OCR_PROFILE = os.getenv("OCR_PROFILE", "balanced")
+OCR_IMAGE_PROFILE = os.getenv("OCR_IMAGE_PROFILE", OCR_PROFILE)
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+
+# dpi: resolution PDFs are rendered at and photos are scaled down to
+# threshold: binarize with Otsu's threshold after converting to grayscale
+# deskew: straighten pages tilted by up to MAX_SKEW_DEGREES
+# psm/oem: tesseract page segmentation mode and engine (1 = LSTM only); variables are passed as -c name=value
+PROFILES = {
+    "fast": {"dpi": 150, "grayscale": True, "threshold": True, "deskew": False, "psm": 6, "oem": 1,
+             "variables": {"tessedit_do_invert": "0"}},
+    "balanced": {"dpi": 200, "grayscale": True, "threshold": False, "deskew": False, "psm": 3, "oem": 1,
+                 "variables": {"tessedit_do_invert": "0"}},
+    "accurate": {"dpi": 300, "grayscale": True, "threshold": False, "deskew": True, "psm": 3, "oem": 1,
+                 "variables": {"preserve_interword_spaces": "1"}},
+}
+
+MAX_SKEW_DEGREES = 5.0
+SKEW_STEP_DEGREES = 0.5
+# Width the skew search works at; the angle is then applied to the full page
+SKEW_SAMPLE_WIDTH = 600
+# Photos without DPI metadata are assumed to show a full A4 page across their width
+A4_WIDTH_INCHES = 8.27
+
+
+def get_profile(name=None):
+    """The named profile (OCR_PROFILE when None); RASTER_DPI, if set, overrides its dpi"""
+    name = name or OCR_PROFILE
+    if name not in PROFILES:
+        raise ValueError(f"Unknown OCR profile '{name}' (choose from {', '.join(PROFILES)})")
+    profile = dict(PROFILES[name], name=name)
+    if os.getenv("RASTER_DPI"):
+        profile["dpi"] = int(os.getenv("RASTER_DPI"))
+    return profile
+
+
+def tesseract_args(profile):
+    """Command-line options for the tesseract binary"""
+    args = ["-l", OCR_LANG, "--oem", str(profile["oem"]), "--psm", str(profile["psm"])]
+    for name, value in profile["variables"].items():
+        args += ["-c", f"{name}={value}"]
+    return args
+
+
+def source_dpi(image):
+    """DPI the image was captured at, from its metadata or assuming an A4 page across its width"""
+    dpi = image.info.get("dpi")
+    # Cameras often write a nominal 72 DPI; only trust metadata that implies a page-sized image
+    if dpi and dpi[0] and 3 <= image.width / float(dpi[0]) <= 17:
+        return float(dpi[0])
+    return image.width / A4_WIDTH_INCHES
+
+
+def otsu_threshold(image):
+    """Grey level that best separates ink from paper in an 8-bit grayscale image"""
+    histogram = image.histogram()[:256]
+    total = sum(histogram)
+    weighted_total = sum(level * count for level, count in enumerate(histogram))
+    background = weighted_background = 0
+    best_level, best_variance = 127, -1.0
+    for level, count in enumerate(histogram):
+        background += count
+        if not background:
+            continue
+        foreground = total - background
+        if not foreground:
+            break
+        weighted_background += level * count
+        mean_background = weighted_background / background
+        mean_foreground = (weighted_total - weighted_background) / foreground
+        variance = background * foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_level, best_variance = level, variance
+    return best_level
+
+
+def _row_profile_score(image):
+    # Text lines aligned with the rows give sharply alternating row darkness, i.e. a high variance
+    rows = list(image.resize((1, image.height), Image.BOX).getdata())
+    mean = sum(rows) / len(rows)
+    return sum((value - mean) ** 2 for value in rows)
+
+
+def estimate_skew(image):
+    """Angle in degrees that makes the text lines of a grayscale page horizontal"""
+    scale = SKEW_SAMPLE_WIDTH / image.width
+    sample = image if scale >= 1 else image.resize((SKEW_SAMPLE_WIDTH, max(1, int(image.height * scale))))
+    sample = ImageOps.invert(sample)
+    steps = int(MAX_SKEW_DEGREES / SKEW_STEP_DEGREES)
+    angles = [step * SKEW_STEP_DEGREES for step in range(-steps, steps + 1)]
+    return max(angles, key=lambda angle: (_row_profile_score(sample.rotate(angle, resample=Image.BILINEAR)),
+                                          -abs(angle)))
+
+
+def preprocess_image(image, profile, rendered_dpi=None):
+    """
+    Prepare a page image for tesseract according to `profile`.
+
+    Images captured above the profile's DPI are scaled down to it (pages
+    rendered from PDFs at a known `rendered_dpi` are left alone), then
+    converted to grayscale, deskewed and binarized as the profile asks.
+    """
+    if isinstance(image, (str, os.PathLike)):
+        image = Image.open(image)
+    gray = profile["grayscale"] or profile["threshold"] or profile["deskew"]
+    dpi = rendered_dpi or source_dpi(image)
+    scale = profile["dpi"] / dpi if dpi > profile["dpi"] * 1.25 else 1.0
+    if scale < 1 and image.format == "JPEG":
+        # Let the JPEG decoder skip detail we would throw away (scales by powers of two, never below the target)
+        target_width = int(image.width * scale)
+        image.draft("L" if gray else image.mode, (target_width, int(image.height * scale)))
+        scale = target_width / image.width if image.width > target_width * 1.25 else 1.0
+    # Phone cameras store the orientation in EXIF instead of rotating the pixels
+    image = ImageOps.exif_transpose(image)
+    if gray:
+        image = image.convert("L")
+    if scale < 1:
+        image = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))), Image.LANCZOS)
+    if profile["deskew"]:
+        angle = estimate_skew(image)
+        if angle:
+            image = image.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+    if profile["threshold"]:
+        level = otsu_threshold(image)
+        image = image.point(lambda value: 255 if value > level else 0)
+    return image
+
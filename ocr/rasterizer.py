@@ -0,0 +1,148 @@
+import math
+import os
+import re
+
+from pdf2image import convert_from_path, pdfinfo_from_path
+from dotenv import load_dotenv
+load_dotenv()
+
+RASTER_DPI = int(os.getenv("RASTER_DPI", "200"))
+RASTER_GRAYSCALE = os.getenv("RASTER_GRAYSCALE", "true").lower() == "true"
+# Upper bound on decoded page bitmaps held in memory at once for a single document
+RASTER_MAX_BYTES = int(float(os.getenv("RASTER_MAX_MB", "256")) * 1024 * 1024)
+
+# A4 in points, used when pdfinfo does not report a page size
+_DEFAULT_PAGE_POINTS = (595.0, 842.0)
+# Upper page bound passed to pdfinfo for per-page sizes; pdfinfo clamps it to the real page count
+_PDFINFO_ALL_PAGES = 1_000_000
+_PAGE_SIZE_KEY_RE = re.compile(r"^Page\s+(\d+)\s+size$")
+
+
+def get_pdf_info(pdf_path, page_sizes=False):
+    """
+    Return pdfinfo metadata for the document (page count, page size, ...).
+
+    With `page_sizes`, pdfinfo also reports every page's size ("Page    3 size"
+    entries), so mixed-size documents can be planned page by page.
+    """
+    if page_sizes:
+        try:
+            return pdfinfo_from_path(pdf_path, first_page=1, last_page=_PDFINFO_ALL_PAGES)
+        except TypeError:
+            pass  # pdf2image before 1.16.1 has no page range for pdfinfo
+    return pdfinfo_from_path(pdf_path)
+
+
+def page_size_points(info, key="Page size"):
+    """Parse a page size entry from pdfinfo, e.g. '612 x 792 pts (letter)'"""
+    match = re.search(r"([\d.]+)\s*x\s*([\d.]+)", str(info.get(key, "")))
+    if not match:
+        return _DEFAULT_PAGE_POINTS
+    return float(match.group(1)), float(match.group(2))
+
+
+def page_sizes_points(info):
+    """{page_number: (width, height)} for every page pdfinfo listed individually"""
+    sizes = {}
+    for key in info:
+        match = _PAGE_SIZE_KEY_RE.match(str(key).strip())
+        if match:
+            sizes[int(match.group(1))] = page_size_points(info, key)
+    return sizes
+
+
+def estimate_page_bytes(width_pts, height_pts, dpi, grayscale):
+    """Size of one decoded page bitmap at the given DPI (1 byte per pixel for grayscale, 3 for RGB)"""
+    channels = 1 if grayscale else 3
+    return int(width_pts / 72 * dpi) * int(height_pts / 72 * dpi) * channels
+
+
+def plan_rasterization(info, dpi, grayscale, max_bytes, window):
+    """
+    Pick the DPI and page-window size that keep one window of bitmaps under `max_bytes`.
+
+    The DPI is lowered until the largest page pdfinfo reported fits on its own;
+    the window is capped by how many of the smallest pages fit, and
+    iter_page_windows packs each window from the actual page sizes within that.
+    """
+    sizes = list(page_sizes_points(info).values()) or [page_size_points(info)]
+    area = lambda size: size[0] * size[1]
+    page_bytes = estimate_page_bytes(*max(sizes, key=area), dpi, grayscale)
+    if page_bytes > max_bytes:
+        scaled_dpi = max(1, int(dpi * math.sqrt(max_bytes / page_bytes)))
+        print(f"[Rasterizer] Lowering DPI from {dpi} to {scaled_dpi} to stay under {max_bytes} bytes per page")
+        dpi = scaled_dpi
+    smallest_bytes = estimate_page_bytes(*min(sizes, key=area), dpi, grayscale)
+    window = max(1, min(window, max_bytes // max(1, smallest_bytes)))
+    return dpi, window
+
+
+def image_bytes(image):
+    return image.width * image.height * len(image.getbands())
+
+
+def _page_runs(pages, window):
+    """Split sorted page numbers into runs of consecutive pages no longer than `window`"""
+    run = []
+    for page in pages:
+        if run and (page != run[-1] + 1 or len(run) >= window):
+            yield run
+            run = []
+        run.append(page)
+    if run:
+        yield run
+
+
+def iter_page_windows(pdf_path, window=1, dpi=None, grayscale=None, max_bytes=None,
+                      first_page=1, last_page=None, pages=None):
+    """
+    Rasterize a PDF a few pages at a time.
+
+    Yields lists of (page_number, PIL image) with at most `window` pages, using
+    pdf2image page ranges so only the current window is ever decoded. Each window
+    is packed from the pages' own sizes before it is rendered, so peak memory is
+    bounded by `max_bytes` regardless of the page count or mixed page sizes. Pass
+    `pages` to render only those (1-based) page numbers.
+    """
+    dpi = RASTER_DPI if dpi is None else dpi
+    grayscale = RASTER_GRAYSCALE if grayscale is None else grayscale
+    max_bytes = RASTER_MAX_BYTES if max_bytes is None else max_bytes
+
+    info = get_pdf_info(pdf_path, page_sizes=True)
+    page_count = int(info.get("Pages", 0))
+    if pages is None:
+        last_page = page_count if last_page is None else min(last_page, page_count)
+        pages = range(first_page, last_page + 1)
+    else:
+        pages = sorted(p for p in set(pages) if 1 <= p <= page_count)
+    dpi, window = plan_rasterization(info, dpi, grayscale, max_bytes, window)
+    sizes = page_sizes_points(info)
+    default_size = page_size_points(info)
+
+    def page_bytes(page):
+        return estimate_page_bytes(*sizes.get(page, default_size), dpi, grayscale)
+
+    pending = list(pages)
+    while pending:
+        run = next(_page_runs(pending, window))
+        # Stop the window before the page that would take it over budget
+        used = page_bytes(run[0])
+        for count, page in enumerate(run[1:], start=1):
+            used += page_bytes(page)
+            if used > max_bytes:
+                run = run[:count]
+                break
+        pending = pending[len(run):]
+        images = convert_from_path(pdf_path, dpi=dpi, grayscale=grayscale,
+                                   first_page=run[0], last_page=run[-1])
+        used = sum(image_bytes(image) for image in images)
+        if used > max_bytes and len(images) > 1:
+            # Pages are larger than the first one suggested; fall back to one page per window
+            window = 1
+        yield list(zip(run, images))
+
+
+def iter_pages(pdf_path, **kwargs):
+    """Yield (page_number, PIL image) one page at a time"""
+    for window in iter_page_windows(pdf_path, window=1, **kwargs):
+        yield from window
@@ -0,0 +1,161 @@
+import json
+import os
+import re
+import threading
+
+from dotenv import load_dotenv
+from helper import metrics
+from helper.ollama_stream import JsonObjectScanner
+from ocr.pre_extractor import parse_date
+
+load_dotenv()
+
+# Send a JSON schema of the requested fields as Ollama's `format`, so decoding can only produce that object
+LLM_JSON_SCHEMA = os.getenv("LLM_JSON_SCHEMA", "true").lower() == "true"
+# Follow-up calls that ask again only for the fields that came back missing or mistyped
+LLM_FIELD_RETRIES = int(os.getenv("LLM_FIELD_RETRIES", "1"))
+
+NUMBER_FIELDS = {"Total Amount"}
+DATE_FIELDS = {"Invoice Date"}
+OBJECT_FIELDS = {"Taxes"}
+
+NULL_STRINGS = {"", "null", "none", "n/a", "na", "nil", "not found", "not available", "not mentioned", "-"}
+TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+PYTHON_LITERALS_RE = re.compile(r":\s*(None|True|False)\b")
+AMOUNT_RE = re.compile(r"-?\d[\d,]*(?:\.\d+)?")
+
+_stats = {"calls": 0, "parse_failures": 0, "repaired": 0}
+_stats_lock = threading.Lock()
+_gauges_registered = False
+
+
+def field_schema(name):
+    if name in NUMBER_FIELDS:
+        return {"type": ["number", "null"]}
+    if name in OBJECT_FIELDS:
+        # Tax name -> amount, e.g. {"CGST @9%": 45.0, "SGST @9%": 45.0}
+        return {"type": ["object", "null"], "additionalProperties": {"type": "number"}}
+    if name in DATE_FIELDS:
+        return {"type": ["string", "null"], "description": "yyyy-mm-dd"}
+    return {"type": ["string", "null"]}
+
+
+def extraction_schema(field_names):
+    """JSON schema for an object with exactly `field_names`, in prompt order"""
+    return {
+        "type": "object",
+        "properties": {name: field_schema(name) for name in field_names},
+        "required": list(field_names),
+    }
+
+
+def repair_json(text):
+    """
+    Cheap fixes for the ways models break JSON, returning a dict or None.
+
+    Takes the first object (ignoring fences and commentary), closes an
+    unterminated string and open braces, drops trailing commas and maps
+    Python's None/True/False to JSON.
+    """
+    start = text.find("{")
+    if start < 0:
+        if not text.strip():
+            return None
+        # The opening brace is sometimes left out entirely
+        text, start = "{" + text, 0
+    scanner = JsonObjectScanner()
+    scanner.feed(text[start:])
+    body = scanner.text
+    if not scanner.done:
+        if scanner.escaped:
+            # Cut off after a backslash; the closing quote must not be escaped
+            body = body[:-1]
+        if scanner.in_string:
+            body += '"'
+        body = body.rstrip().rstrip(",") + "}" * scanner.depth
+    body = TRAILING_COMMA_RE.sub(r"\1", body)
+    body = PYTHON_LITERALS_RE.sub(lambda m: ": " + {"None": "null", "True": "true", "False": "false"}[m.group(1)], body)
+    try:
+        fields = json.loads(body)
+    except ValueError:
+        return None
+    return fields if isinstance(fields, dict) else None
+
+
+def parse_response(text):
+    """(fields, repaired) for a model answer; fields is None when even the repair pass fails"""
+    try:
+        fields = json.loads(text)
+        if isinstance(fields, dict):
+            return fields, False
+    except ValueError:
+        pass
+    fields = repair_json(text)
+    return fields, fields is not None
+
+
+def coerce_field(name, value):
+    """Return (value, ok): the value in its schema type, or the value as given and False when it does not fit"""
+    if isinstance(value, str) and value.strip().lower() in NULL_STRINGS:
+        return None, True
+    if value is None:
+        return None, True
+    if name in NUMBER_FIELDS:
+        if isinstance(value, bool):
+            return value, False
+        if isinstance(value, (int, float)):
+            return value, True
+        match = AMOUNT_RE.search(str(value))
+        return (float(match.group().replace(",", "")), True) if match else (value, False)
+    if name in DATE_FIELDS:
+        parsed = parse_date(str(value))
+        return (parsed, True) if parsed else (value, False)
+    if name in OBJECT_FIELDS:
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                # Free-text taxes ("CGST 9%: 45.00") are still read by the validator
+                return value.strip(), True
+        return (value, True) if isinstance(value, dict) else (value, False)
+    if isinstance(value, dict):
+        # Addresses sometimes come back split into parts
+        return ", ".join(str(part) for part in value.values() if part), True
+    if isinstance(value, list):
+        return ", ".join(str(part) for part in value if part), True
+    return str(value).strip(), True
+
+
+def coerce_fields(fields, field_names):
+    """Coerce the requested fields of a parsed answer; returns (values, names that are missing or mistyped)"""
+    values, failed = {}, []
+    for name in field_names:
+        if name not in fields:
+            failed.append(name)
+            continue
+        values[name], ok = coerce_field(name, fields[name])
+        if not ok:
+            failed.append(name)
+    return values, failed
+
+
+def record_call(parsed, repaired):
+    """Count one extraction call towards the parse-failure rate"""
+    global _gauges_registered
+    with _stats_lock:
+        _stats["calls"] += 1
+        _stats["parse_failures"] += not parsed
+        _stats["repaired"] += repaired
+        if not _gauges_registered:
+            metrics.register_gauge("llm_parse_failure_rate", lambda: round(
+                _stats["parse_failures"] / _stats["calls"], 4) if _stats["calls"] else 0.0)
+            _gauges_registered = True
+    if not parsed:
+        metrics.inc("llm_parse_failures")
+    elif repaired:
+        metrics.inc("llm_repaired")
+
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,144 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from dotenv import load_dotenv
+from helper import metrics
+from ocr.preprocess import OCR_LANG, get_profile, preprocess_image, tesseract_args
+
+load_dotenv()
+
+# tesserocr: engines kept loaded in each OCR worker, images passed in memory (pip install tesserocr)
+# batch: one tesseract process per batch of pages instead of one per page
+# pytesseract: one tesseract process per page, as before
+# auto: tesserocr when installed, otherwise batch
+OCR_BACKEND = os.getenv("OCR_BACKEND", "auto")
+# Pages handed to one OCR worker at a time, so each engine or tesseract process covers several pages
+OCR_BATCH_PAGES = int(os.getenv("OCR_BATCH_PAGES", "4"))
+OCR_PAGE_TIMEOUT = int(os.getenv("OCR_PAGE_TIMEOUT", "60"))
+
+BACKENDS = ("tesserocr", "batch", "pytesseract")
+
+_local = threading.local()
+
+
+def resolve_backend(name=None):
+    name = name or OCR_BACKEND
+    if name == "auto":
+        try:
+            import tesserocr  # noqa: F401
+            return "tesserocr"
+        except ImportError:
+            return "batch" if shutil.which("tesseract") else "pytesseract"
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown OCR backend '{name}' (choose from auto, {', '.join(BACKENDS)})")
+    return name
+
+
+def get_engine(profile):
+    """This thread's tesserocr engine for the profile's settings, loaded on first use and kept for the process"""
+    engines = getattr(_local, "engines", None)
+    if engines is None:
+        engines = _local.engines = {}
+    key = (OCR_LANG, profile["psm"], profile["oem"], tuple(sorted(profile["variables"].items())))
+    engine = engines.get(key)
+    if engine is None:
+        import tesserocr
+
+        with metrics.span("ocr.engine_load", profile=profile["name"]):
+            engine = tesserocr.PyTessBaseAPI(lang=OCR_LANG, psm=profile["psm"], oem=profile["oem"])
+            for name, value in profile["variables"].items():
+                engine.SetVariable(name, value)
+        engines[key] = engine
+    return engine
+
+
+def _recognize_tesserocr(images, profile):
+    engine = get_engine(profile)
+    texts = []
+    for image in images:
+        engine.SetImage(image)
+        texts.append(engine.GetUTF8Text())
+    return texts
+
+
+def _recognize_batch(images, profile):
+    # tesseract reads a text file listing image paths as one multi-page job and separates the pages with form feeds
+    with tempfile.TemporaryDirectory(prefix="ocr_batch_") as directory:
+        paths = []
+        for number, image in enumerate(images):
+            # Uncompressed PNM is much cheaper to write than PNG and leptonica reads it natively
+            path = os.path.join(directory, f"{number:04d}.pnm")
+            image.save(path, "PPM")
+            paths.append(path)
+        listing = os.path.join(directory, "pages.txt")
+        with open(listing, "w", encoding="utf-8") as f:
+            f.write("\n".join(paths) + "\n")
+        completed = subprocess.run(
+            ["tesseract", listing, "stdout", *tesseract_args(profile)],
+            capture_output=True,
+            timeout=OCR_PAGE_TIMEOUT * len(images),
+        )
+    if completed.returncode != 0:
+        raise RuntimeError(f"tesseract failed: {completed.stderr.decode('utf-8', errors='replace').strip()}")
+    texts = completed.stdout.decode("utf-8", errors="replace").split("\f")
+    if len(texts) == len(images) + 1 and not texts[-1].strip():
+        texts = texts[:-1]
+    if len(texts) != len(images):
+        raise RuntimeError(f"tesseract returned {len(texts)} pages for {len(images)} images")
+    return texts
+
+
+def _recognize_pytesseract(images, profile):
+    import pytesseract
+
+    config = " ".join(tesseract_args(profile)[2:])
+    return [pytesseract.image_to_string(image, lang=OCR_LANG, config=config) for image in images]
+
+
+_RECOGNIZERS = {
+    "tesserocr": _recognize_tesserocr,
+    "batch": _recognize_batch,
+    "pytesseract": _recognize_pytesseract,
+}
+
+
+def ocr_batch(images, profile_name=None, rendered_dpi=None, backend=None):
+    """
+    Preprocess and OCR several page images in one go, returning their texts in order.
+
+    Module-level so process pools can pickle it: each pool process keeps its
+    own warm engines, and a batch of pages costs one engine lookup or one
+    tesseract process instead of one per page.
+    """
+    profile = get_profile(profile_name)
+    backend = resolve_backend(backend)
+    with metrics.span("ocr.preprocess", profile=profile["name"], pages=len(images)):
+        images = [preprocess_image(image, profile, rendered_dpi) for image in images]
+    with metrics.span("ocr.recognize", backend=backend, pages=len(images)):
+        return _RECOGNIZERS[backend](images, profile)
+
+
+def ocr_batch_collected(images, profile_name=None, rendered_dpi=None, backend=None):
+    """ocr_batch() for pool processes: returns (texts, spans) so the parent can record the worker's timings"""
+    with metrics.collect() as spans:
+        texts = ocr_batch(images, profile_name, rendered_dpi, backend)
+    return texts, spans
+
+
+def init_pool_worker():
+    """Pool process initializer: spans go back to the parent, so the child must not write the trace file too"""
+    metrics.registry.close()
+
+
+def ocr_image(image, profile_name=None, rendered_dpi=None, backend=None):
+    """OCR one page image (a path or PIL image)"""
+    return ocr_batch([image], profile_name, rendered_dpi, backend)[0]
+
+
+def split_batches(items, workers, batch_size=OCR_BATCH_PAGES):
+    """Contiguous chunks of at most `batch_size`, spread over at least `workers` chunks when there are enough items"""
+    size = max(1, min(batch_size, -(-len(items) // max(1, workers))))
+    return [items[start:start + size] for start in range(0, len(items), size)]
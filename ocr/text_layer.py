@@ -0,0 +1,49 @@
+import os
+import subprocess
+
+from dotenv import load_dotenv
+load_dotenv()
+
+TEXT_LAYER_ENABLED = os.getenv("TEXT_LAYER", "true").lower() == "true"
+# Pages with fewer letters/digits than this in their text layer are treated as scanned
+TEXT_LAYER_MIN_CHARS = int(os.getenv("TEXT_LAYER_MIN_CHARS", "40"))
+
+
+def extract_text_layer(pdf_path, timeout=60, first=None, last=None):
+    """
+    Return the embedded text of every page (or of pages `first`..`last`) using poppler's pdftotext.
+
+    pdftotext separates pages with form feeds, so one process covers the whole
+    range. Returns None when pdftotext is unavailable or fails, which callers
+    treat as "no text layer".
+    """
+    page_range = (["-f", str(first)] if first else []) + (["-l", str(last)] if last else [])
+    try:
+        completed = subprocess.run(
+            ["pdftotext", "-layout", "-enc", "UTF-8", *page_range, pdf_path, "-"],
+            capture_output=True,
+            timeout=timeout,
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        print(f"[TextLayer] pdftotext unavailable for {pdf_path}: {e}")
+        return None
+    if completed.returncode != 0:
+        return None
+    pages = completed.stdout.decode("utf-8", errors="replace").split("\f")
+    # pdftotext ends the last page with a form feed as well
+    if pages and not pages[-1].strip():
+        pages = pages[:-1]
+    return pages
+
+
+def is_usable_text(text, min_chars=None):
+    """True if a page's text layer looks like real content rather than an empty or garbled layer"""
+    min_chars = TEXT_LAYER_MIN_CHARS if min_chars is None else min_chars
+    if not text:
+        return False
+    alnum = sum(ch.isalnum() for ch in text)
+    if alnum < min_chars:
+        return False
+    # Broken font encodings come out as replacement characters or (cid:NN) escapes
+    garbage = text.count("�") + text.count("(cid:")
+    return garbage * 10 < alnum
@@ -0,0 +1,267 @@
+import queue
+import threading
+import time
+import traceback
+
+from helper import metrics
+
+# Marker passed down the queues to tell a stage's workers to exit
+_STOP = object()
+
+
+class Stage:
+    """A named pipeline step backed by its own worker pool and bounded input queue"""
+
+    def __init__(self, name, func, workers=1, queue_size=8):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+        self._alive = 0
+
+    def record(self, outcome, elapsed):
+        with self._lock:
+            self.busy_seconds += elapsed
+            if outcome == "ok":
+                self.processed += 1
+            elif outcome == "dropped":
+                self.dropped += 1
+            else:
+                self.failed += 1
+
+
+class Pipeline:
+    """
+    Run jobs through a chain of stages connected by bounded queues.
+
+    Each stage function receives a job dict and returns the (updated) job for the
+    next stage, or None to drop it. Exceptions are logged and count as failures.
+    A full downstream queue blocks the upstream workers, so a slow stage applies
+    backpressure instead of letting memory grow. `on_complete(job)`,
+    `on_error(stage_name, job, exc)` and `on_drop(stage_name, job)` are called
+    from the worker threads; `on_close()` once the workers have exited. A hook
+    that raises is logged and does not stop the worker. A closed pipeline
+    cannot be restarted: `submit()` and `start()` raise RuntimeError.
+    """
+
+    def __init__(self, stages, on_complete=None, on_error=None, on_drop=None, on_close=None):
+        if not stages:
+            raise ValueError("Pipeline needs at least one stage")
+        self.stages = stages
+        self.on_complete = on_complete
+        self.on_error = on_error
+        self.on_drop = on_drop
+        self.on_close = on_close
+        self.completed = 0
+        self.submitted = 0
+        self.started_at = None
+        self._threads = []
+        self._lock = threading.Lock()
+        # Signalled when the last in-progress submit() has queued its job
+        self._submits_done = threading.Condition(self._lock)
+        self._submitting = 0
+        self._closed = False
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._wake = threading.Event()
+
+    def start(self):
+        if self._closed:
+            raise RuntimeError("Pipeline is closed")
+        self._start()
+
+    def _start(self):
+        with self._start_lock:
+            if self._threads:
+                return
+            self.started_at = time.monotonic()
+            metrics.register_gauge("queue_depth", lambda: {s.name: s.queue.qsize() for s in self.stages})
+            metrics.register_gauge("invoices_completed", lambda: self.completed)
+            for index, stage in enumerate(self.stages):
+                stage._alive = stage.workers
+                for n in range(stage.workers):
+                    thread = threading.Thread(
+                        target=self._worker,
+                        args=(index,),
+                        name=f"{stage.name}-{n}",
+                        daemon=True,
+                    )
+                    thread.start()
+                    self._threads.append(thread)
+
+    def submit(self, job):
+        """Queue a job for the first stage, blocking while that stage is saturated"""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Pipeline is closed")
+            self._submitting += 1
+        queued = False
+        try:
+            # Admitted before close(), so the workers may still be started
+            self._start()
+            self.stages[0].queue.put(job)
+            queued = True
+        finally:
+            with self._lock:
+                self._submitting -= 1
+                self.submitted += queued
+                self._submits_done.notify_all()
+
+    def close(self):
+        """Refuse further jobs, then wait for the in-flight ones to drain; later calls do nothing"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            # A submit() that got in before the flag must queue its job ahead of the stop markers
+            while self._submitting:
+                self._submits_done.wait()
+        if not self._threads:
+            self._call_hook("on_close")
+            return
+        first = self.stages[0]
+        for _ in range(first.workers):
+            first.queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._call_hook("on_close")
+
+    def _call_hook(self, name, *args):
+        hook = getattr(self, name)
+        if not hook:
+            return
+        try:
+            hook(*args)
+        except Exception as e:
+            metrics.inc("pipeline_hook_errors", hook=name)
+            print(f"[Pipeline] {name} hook failed: {e}")
+            traceback.print_exc()
+
+    def run(self, source, poll_interval=None, report_interval=60, max_backoff=300):
+        """
+        Feed every job yielded by `source()` through the pipeline.
+
+        With `poll_interval` unset the source is drained once and the call returns
+        after all jobs finish. Otherwise the source is polled again every
+        `poll_interval` seconds until `stop()` is called or Ctrl+C is pressed.
+        A poll that raises is logged and retried, backing off up to `max_backoff` seconds.
+        """
+        self.start()
+        last_report = time.monotonic()
+        failures = 0
+        try:
+            while not self._stopping.is_set() and not self._closed:
+                try:
+                    for job in source():
+                        if self._stopping.is_set():
+                            break
+                        self.submit(job)
+                    failures = 0
+                except Exception as e:
+                    failures += 1
+                    metrics.inc("source_poll_errors")
+                    print(f"[Pipeline] Polling the source failed ({failures} in a row): {e}")
+                    traceback.print_exc()
+                if poll_interval is None:
+                    break
+                if report_interval and time.monotonic() - last_report >= report_interval:
+                    self.print_report()
+                    last_report = time.monotonic()
+                # Back off while the source keeps failing; a wake() still polls at once
+                delay = min(max(poll_interval, 1) * 2 ** failures, max_backoff) if failures else poll_interval
+                self._wake.wait(delay)
+                self._wake.clear()
+        except KeyboardInterrupt:
+            print("[Pipeline] Interrupted, draining in-flight jobs...")
+        finally:
+            self.close()
+        self.print_report()
+        return self.stats()
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+
+    def wake(self):
+        """Poll the source now instead of waiting for the rest of the poll interval"""
+        self._wake.set()
+
+    def _worker(self, index):
+        stage = self.stages[index]
+        downstream = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        while True:
+            job = stage.queue.get()
+            if job is _STOP:
+                break
+            started = time.perf_counter()
+            try:
+                with metrics.span(f"stage.{stage.name}", file_id=job.get("file_id") if isinstance(job, dict) else None):
+                    result = stage.func(job)
+            except Exception as e:
+                stage.record("failed", time.perf_counter() - started)
+                metrics.inc("stage_jobs", stage=stage.name, outcome="failed")
+                print(f"[Pipeline] Stage '{stage.name}' failed: {e}")
+                traceback.print_exc()
+                self._call_hook("on_error", stage.name, job, e)
+                continue
+            if result is None:
+                stage.record("dropped", time.perf_counter() - started)
+                metrics.inc("stage_jobs", stage=stage.name, outcome="dropped")
+                self._call_hook("on_drop", stage.name, job)
+                continue
+            stage.record("ok", time.perf_counter() - started)
+            metrics.inc("stage_jobs", stage=stage.name, outcome="ok")
+            if downstream is not None:
+                downstream.queue.put(result)
+            else:
+                with self._lock:
+                    self.completed += 1
+                self._call_hook("on_complete", result)
+
+        # The last worker out of a stage forwards the stop signal downstream
+        with stage._lock:
+            stage._alive -= 1
+            last_out = stage._alive == 0
+        if last_out and downstream is not None:
+            for _ in range(downstream.workers):
+                downstream.queue.put(_STOP)
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0.0
+        per_minute = (self.completed / elapsed * 60) if elapsed > 0 else 0.0
+        return {
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "elapsed_seconds": round(elapsed, 2),
+            "invoices_per_minute": round(per_minute, 2),
+            "stages": {
+                stage.name: {
+                    "workers": stage.workers,
+                    "queued": stage.queue.qsize(),
+                    "processed": stage.processed,
+                    "dropped": stage.dropped,
+                    "failed": stage.failed,
+                    "busy_seconds": round(stage.busy_seconds, 2),
+                }
+                for stage in self.stages
+            },
+        }
+
+    def print_report(self):
+        stats = self.stats()
+        print(
+            f"[Pipeline] {stats['completed']}/{stats['submitted']} invoices in "
+            f"{stats['elapsed_seconds']}s ({stats['invoices_per_minute']} invoices/min)"
+        )
+        for name, s in stats["stages"].items():
+            print(
+                f"  - {name}: workers={s['workers']} processed={s['processed']} "
+                f"dropped={s['dropped']} failed={s['failed']} queued={s['queued']} "
+                f"busy={s['busy_seconds']}s"
+            )
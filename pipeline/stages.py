@@ -0,0 +1,269 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'watcher')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import json
+import threading
+
+from file_watcher import list_files_in_folder, download_file, get_file
+from ocr.ocr_main import (
+    extract_fields_with_llm,
+    enforce_nulls,
+    PageReader,
+    read_until_complete,
+    PAGE_BREAK,
+    insert_to_supabase,
+)
+from ingestion.gmail_ingestion import check_email_and_upload
+from helper.drive_uploader import get_drive_uploader_email
+from agent.validation_helper import validate_invoice
+from agent.invoice_index import get_invoice_index
+from helper.clients import get_supabase
+from helper.write_behind import log_write_result, write_callback
+from helper import metrics
+from pipeline.engine import Pipeline, Stage
+
+
+class DriveFolderSource:
+    """
+    Yield a job for every file in the Drive folder that is not yet in extracted_information.
+
+    Stored files are recognised through the incrementally synced invoice index,
+    so a poll does not read every file_id from the table.
+
+    Files already handed to the pipeline are remembered, so repeated polls do not
+    resubmit invoices that are still in flight. When `check_email` is set, the
+    inbox is checked first so invoices ingested from Gmail keep their sender.
+    """
+
+    def __init__(self, folder_id=None, check_email=True):
+        self.folder_id = folder_id
+        self.check_email = check_email
+        self.seen = set()
+        self.senders = {}
+        self._lock = threading.Lock()
+
+    def claim(self, file_id):
+        """Mark a file as handed to the pipeline; False if it already was"""
+        with self._lock:
+            if file_id in self.seen:
+                return False
+            self.seen.add(file_id)
+            return True
+
+    def unclaim(self, file_id):
+        """Let a later poll pick the file up again"""
+        with self._lock:
+            self.seen.discard(file_id)
+
+    def check_inbox(self):
+        if self.check_email:
+            gmail_result = check_email_and_upload()
+            if gmail_result:
+                file_id, sender_email = gmail_result
+                self.senders[file_id] = sender_email
+
+    def __call__(self):
+        self.check_inbox()
+        index = get_invoice_index(get_supabase())
+        index.sync_if_stale()
+        kwargs = {"folder_id": self.folder_id} if self.folder_id else {}
+        for drive_file in list_files_in_folder(**kwargs):
+            file_id = drive_file['id']
+            if file_id in index or not self.claim(file_id):
+                continue
+            yield {
+                "file_id": file_id,
+                "drive_file": drive_file,
+                "sender_email": self.senders.pop(file_id, None),
+            }
+
+
+class DriveChangesSource(DriveFolderSource):
+    """
+    Yield a job for every file the change watcher reports since its last poll.
+
+    Files are already downloaded by the watcher; ones the invoice index knows
+    about (already in extracted_information) are skipped before download.
+    """
+
+    def __init__(self, watcher, check_email=True):
+        super().__init__(check_email=check_email)
+        self.watcher = watcher
+
+    def __call__(self):
+        self.check_inbox()
+        index = get_invoice_index(get_supabase())
+        index.sync_if_stale()
+        skip = lambda file_id: file_id in index or not self.claim(file_id)
+        # A failed download is retried on the next poll, so it must not stay claimed
+        for change in self.watcher.poll(skip=skip, on_failure=self.unclaim):
+            yield {
+                "file_id": change["file_id"],
+                "filepath": change["filepath"],
+                "sender_email": self.senders.pop(change["file_id"], None),
+                "release_file": self.watcher.release,
+            }
+
+
+def fetch_stage(job):
+    # Jobs submitted by Drive file ID carry only the ID; look up the title before downloading
+    if job.pop("fetch_metadata", False):
+        with metrics.span("drive.metadata"):
+            job["drive_file"] = get_file(job["file_id"])
+    # Jobs from the change watcher or in-memory ingestion arrive with their content already
+    if "drive_file" in job:
+        with metrics.span("drive.download"):
+            job["filepath"] = download_file(job.pop("drive_file"))
+    # Intake uploads without a trusted sender have no one to answer; the archived copy's owner is us
+    if not job.get("sender_email") and not job.pop("sender_unknown", False):
+        with metrics.span("drive.uploader_email"):
+            job["sender_email"] = get_drive_uploader_email(job["file_id"])
+    return job
+
+
+def _release(job, attachment, filepath):
+    if attachment:
+        attachment.release()
+    elif "release_file" in job:
+        job.pop("release_file")(filepath)
+    elif filepath and os.path.exists(filepath):
+        os.remove(filepath)
+
+
+# Readers handed from the OCR stage to extraction, so whatever is left can be released at close
+_open_readers = set()
+_open_readers_lock = threading.Lock()
+
+
+def release_job(job):
+    """Close a job's page reader, releasing its file or attachment; safe to call more than once"""
+    reader = job.pop("page_reader", None) if isinstance(job, dict) else None
+    if reader:
+        with _open_readers_lock:
+            _open_readers.discard(reader)
+        reader.close()
+
+
+def release_open_readers():
+    with _open_readers_lock:
+        readers = list(_open_readers)
+        _open_readers.clear()
+    for reader in readers:
+        reader.close()
+
+
+def ocr_stage(job):
+    attachment = job.pop("attachment", None)
+    filepath = job.get("filepath")
+    reader = PageReader(filepath, attachment, release=lambda: _release(job, attachment, filepath))
+    try:
+        # Any spool copy of an in-memory PDF is written here, never by the extraction workers
+        # that hold attachments while they wait for the LLM
+        reader.open()
+        pages = reader.read(reader.first_pages())
+        job["ocr_text"] = PAGE_BREAK.join(page["text"] for page in pages)
+        # Keep the per-page text-layer/OCR decision without holding the page text twice
+        job["pages"] = [{"page": page["page"], "source": page["source"]} for page in pages]
+        pending = reader.remaining_pages(pages)
+    except Exception:
+        reader.close()
+        raise
+    if not pending:
+        reader.close()
+        return job
+    # The extraction stage reads these only if page 1 and the last page leave fields missing
+    job["page_reader"], job["pending_pages"] = reader, pending
+    with _open_readers_lock:
+        _open_readers.add(reader)
+    return job
+
+
+def extraction_stage(job):
+    reader, pending = job.get("page_reader"), job.pop("pending_pages", None)
+    try:
+        result = extract_fields_with_llm(job["ocr_text"], job["sender_email"])
+        if reader and isinstance(result, dict) and "error" not in result:
+            result, read, skipped = read_until_complete(reader, pending, result)
+            job["pages"] += [{"page": page["page"], "source": page["source"]} for page in read]
+            job["pages_skipped"] = skipped
+            print(f"[{job['file_id']}] Read {len(job['pages'])} of {reader.page_count()} page(s), "
+                  f"skipped {skipped}")
+    finally:
+        release_job(job)
+    result = enforce_nulls(result)
+    if not isinstance(result, dict) or "error" in result:
+        print(f"[ERROR] Invalid invoice format or OCR failed for file_id={job['file_id']}")
+        return None
+    result["file_id"] = job["file_id"]
+    result["Received_From"] = job["sender_email"]
+    job["invoice"] = result
+    return job
+
+
+def validation_stage(job):
+    try:
+        index = get_invoice_index(get_supabase())
+        with metrics.span("index.sync"):
+            index.sync_if_stale()
+        with metrics.span("validation.rules"):
+            job["is_valid"], job["reason"] = validate_invoice(job["invoice"], index=index)
+        # Make this invoice visible to the next ones before its row reaches Supabase
+        index.add(job["invoice"])
+    except Exception as e:
+        # Undecided: the side-effect stage hands these to the agent instead of guessing
+        job["is_valid"], job["reason"] = None, f"Error during validation: {str(e)}"
+    label = {True: "VALID", False: "INVALID", None: "UNDECIDED"}[job["is_valid"]]
+    metrics.inc("validation_results", result=label.lower())
+    print(f"[{job['file_id']}] Validation Result: {label}")
+    return job
+
+
+def write_recorder(job):
+    """
+    Per-row Supabase write callback for one job.
+
+    Outcomes are kept in job["writes"] by table and passed to job["on_write"]
+    (set by the intake tracker), as buffered writes land after the job completes.
+    """
+    def callback(table, key, ok, error):
+        log_write_result(table, key, ok, error)
+        job.setdefault("writes", {})[table] = "written" if ok else f"failed: {error}"
+        if job.get("on_write"):
+            job["on_write"](table, ok, error)
+    return callback
+
+
+def make_side_effect_stage(act):
+    """Build the final stage: store the extracted invoice, then hand it to `act`"""
+    def side_effect_stage(job):
+        # Every row queued below, by the tools too, reports back to this job
+        with write_callback(write_recorder(job)):
+            insert_to_supabase(job["invoice"])
+            print("\n[Validated Result]:\n", json.dumps(job["invoice"], indent=2))
+            act(job["invoice"], job["file_id"], job["is_valid"], job["reason"])
+        return job
+    return side_effect_stage
+
+
+def build_invoice_pipeline(act, fetch_workers=1, ocr_workers=2, llm_workers=1,
+                           validation_workers=1, side_effect_workers=2, queue_size=8):
+    """
+    Wire the invoice stages together: fetch -> OCR -> LLM extraction -> validation -> side effects.
+
+    Downloads share one PyDrive HTTP connection, so keep `fetch_workers` at 1
+    unless the Drive client is thread-safe.
+    """
+    return Pipeline(
+        [
+            Stage("fetch", fetch_stage, fetch_workers, queue_size),
+            Stage("ocr", ocr_stage, ocr_workers, queue_size),
+            Stage("extraction", extraction_stage, llm_workers, queue_size),
+            Stage("validation", validation_stage, validation_workers, queue_size),
+            Stage("side_effects", make_side_effect_stage(act), side_effect_workers, queue_size),
+        ],
+        # Jobs that stop between OCR and extraction still hold their file or attachment
+        on_error=lambda stage, job, error: release_job(job),
+        on_drop=lambda stage, job: release_job(job),
+        on_close=release_open_readers,
+    )
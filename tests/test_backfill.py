@@ -0,0 +1,67 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+from bench.stubs import LocalSupabase
+from agent.backfill import run_backfill
+
+VALID = {
+    'Company Name': 'Acme Traders', 'Invoice Date': '2024-05-01', 'Total Amount': '1,180.00',
+    'GSTIN': '27AAPFU0939F1ZV', 'Customer Name': 'Globex', 'Taxes': 'CGST @9%: 90.00, SGST @9%: 90.00',
+}
+
+
+def stored_rows():
+    rows = []
+    for i in range(7):
+        row = {**VALID, 'file_id': f'f{i}', 'Invoice Number': f'INV-{i}', 'flagged': True, 'visited': False}
+        if i % 2:
+            row['GSTIN'] = '27AAPFU0939F1ZW'  # fails the checksum
+        rows.append(row)
+    return rows
+
+
+def run(client, tmp_path, **kwargs):
+    return run_backfill(client, use_history=False, page_size=2, checkpoint_path=str(tmp_path / 'checkpoint.json'),
+                        show=0, **kwargs)
+
+
+def test_backfill_resume_continues_after_the_checkpoint(tmp_path):
+    client = LocalSupabase()
+    client.tables['extracted_information'] = stored_rows()
+
+    first = run(client, tmp_path, limit=3)
+    # Stops at a page boundary once the limit is reached
+    assert first['after'] == 'f3' and first['scanned'] == 4
+
+    resumed = run(client, tmp_path, resume=True)
+    assert resumed['scanned'] == 7
+    assert resumed['cleared'] == 4 and resumed['flagged'] == 3
+    assert resumed['written'] == 7 and resumed['failed'] == 0
+    rows = client.tables['extracted_information']
+    assert [row['flagged'] for row in rows] == [bool(i % 2) for i in range(7)]
+    assert all(row['visited'] for row in rows)
+
+    # Everything is up to date now, so a fresh run writes nothing
+    again = run(client, tmp_path)
+    assert again['unchanged'] == 7 and again['written'] == 0
+
+
+def test_backfill_writes_only_updates(tmp_path):
+    client = LocalSupabase()
+    client.tables['extracted_information'] = stored_rows()[:2]
+    run(client, tmp_path)
+    # Only flagged/visited change; no other column is rewritten and no row is added
+    assert len(client.tables['extracted_information']) == 2
+    assert client.tables['extracted_information'][0]['Invoice Number'] == 'INV-0'
+
+
+def test_backfill_resume_refuses_a_different_mode(tmp_path):
+    client = LocalSupabase()
+    client.tables['extracted_information'] = stored_rows()
+    run(client, tmp_path, dry_run=True, limit=1)
+    assert [row['flagged'] for row in client.tables['extracted_information']] == [True] * 7
+    with pytest.raises(ValueError, match="dry run"):
+        run(client, tmp_path, resume=True)
@@ -0,0 +1,234 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import base64
+import io
+import select
+
+import pytest
+
+from ingestion.imap_idle import ImapIdleIngestor, decode_part, find_attachments, parse_fetch_response
+
+HEADERS = b'From: Acme Billing <billing@acme.example>\r\nSubject: invoice 42\r\n\r\n'
+PDF = b'%PDF-1.4 invoice'
+
+
+def structure_response():
+    """Two messages as imaplib returns them: the header literals arrive as (prefix, literal) tuples"""
+    return [
+        (b'1 (UID 101 BODYSTRUCTURE (("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 12 1 NIL NIL NIL NIL)'
+         b'("APPLICATION" "PDF" ("NAME" "inv.pdf") NIL NIL "BASE64" 1000 NIL ("ATTACHMENT" ("FILENAME" "inv.pdf"))'
+         b' NIL NIL) "MIXED" ("BOUNDARY" "xyz") NIL NIL NIL) BODY[HEADER.FIELDS (FROM SUBJECT)] {65}', HEADERS),
+        b')',
+        (b'2 (UID 102 BODYSTRUCTURE ("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 5 1 NIL NIL NIL NIL)'
+         b' BODY[HEADER.FIELDS (FROM SUBJECT)] {42}', b'From: someone@example.com\r\nSubject: hi\r\n\r\n'),
+        b')',
+    ]
+
+
+def test_parse_fetch_response_with_literal_headers():
+    messages = parse_fetch_response(structure_response())
+    assert [m['UID'] for m in messages] == ['101', '102']
+    assert messages[0]['BODY[HEADER.FIELDS (FROM SUBJECT)]'] == HEADERS
+    attachments = find_attachments(messages[0]['BODYSTRUCTURE'])
+    assert attachments == [{'section': '2', 'filename': 'inv.pdf', 'content_type': 'application/pdf',
+                            'encoding': 'BASE64'}]
+    assert find_attachments(messages[1]['BODYSTRUCTURE']) == []
+
+
+def test_nested_multipart_sections():
+    data = [
+        b'7 (UID 300 BODYSTRUCTURE ((("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 10 1 NIL NIL NIL NIL)'
+        b'("TEXT" "HTML" ("CHARSET" "utf-8") NIL NIL "QUOTED-PRINTABLE" 20 1 NIL NIL NIL NIL) "ALTERNATIVE"'
+        b' ("BOUNDARY" "inner") NIL NIL NIL)'
+        b'("IMAGE" "JPEG" ("NAME" "scan.jpg") "<img1>" NIL "BASE64" 500 NIL ("INLINE" ("FILENAME" "scan.jpg")) NIL NIL)'
+        b'("APPLICATION" "OCTET-STREAM" NIL NIL NIL "BASE64" 800 NIL ("ATTACHMENT" ("FILENAME" "bill.pdf")) NIL NIL)'
+        b' "MIXED" ("BOUNDARY" "outer") NIL NIL NIL))'
+    ]
+    structure = parse_fetch_response(data)[0]['BODYSTRUCTURE']
+    found = find_attachments(structure)
+    assert [(part['section'], part['filename'], part['content_type']) for part in found] == [
+        ('2', 'scan.jpg', 'image/jpeg'),
+        ('3', 'bill.pdf', 'application/octet-stream'),
+    ]
+
+
+def test_single_part_message_and_encoded_filename():
+    data = [
+        b'3 (UID 9 BODYSTRUCTURE ("APPLICATION" "PDF" ("NAME" "=?utf-8?B?UmVjaG51bmcucGRm?=") NIL NIL "BASE64"'
+        b' 1200 NIL NIL NIL NIL))'
+    ]
+    found = find_attachments(parse_fetch_response(data)[0]['BODYSTRUCTURE'])
+    assert found == [{'section': '1', 'filename': 'Rechnung.pdf', 'content_type': 'application/pdf',
+                      'encoding': 'BASE64'}]
+
+
+def test_quoted_strings_with_escapes():
+    data = [b'4 (UID 10 BODYSTRUCTURE ("APPLICATION" "PDF" ("NAME" "a \\"quoted\\" name.pdf") NIL NIL "BASE64"'
+            b' 10 NIL NIL NIL NIL))']
+    found = find_attachments(parse_fetch_response(data)[0]['BODYSTRUCTURE'])
+    assert found[0]['filename'] == 'a "quoted" name.pdf'
+
+
+def test_literal_bodies_for_several_messages():
+    encoded = base64.b64encode(PDF)
+    data = [
+        (b'1 (UID 101 BODY[2] {%d}' % len(encoded), encoded), b')',
+        (b'5 (UID 105 BODY[2] {%d}' % len(encoded), encoded), b')',
+    ]
+    messages = parse_fetch_response(data)
+    assert [m['UID'] for m in messages] == ['101', '105']
+    assert all(decode_part(m['BODY[2]'], 'BASE64') == PDF for m in messages)
+
+
+def test_decode_part_encodings():
+    assert decode_part(b'caf=C3=A9', 'QUOTED-PRINTABLE') == 'café'.encode()
+    assert decode_part(None, 'BASE64') == b''
+    assert decode_part(b'raw', '7BIT') == b'raw'
+
+
+class FakeMail:
+    """Answers the UID commands sync() sends with canned responses"""
+
+    def __init__(self, search_uids):
+        self.search_uids = search_uids
+        self.stored = []
+
+    def uid(self, command, *args):
+        if command == 'SEARCH':
+            return 'OK', [' '.join(map(str, self.search_uids)).encode()]
+        if command == 'STORE':
+            self.stored.append(args[0])
+            return 'OK', []
+        uids = args[0].split(',')
+        if 'BODYSTRUCTURE' in args[1]:
+            data = []
+            for uid in uids:
+                data += [(b'1 (UID %s BODYSTRUCTURE ("APPLICATION" "PDF" ("NAME" "inv-%s.pdf") NIL NIL "BASE64" 10'
+                          b' NIL NIL NIL NIL) BODY[HEADER.FIELDS (FROM SUBJECT)] {65}' % (uid.encode(), uid.encode()),
+                          HEADERS), b')']
+            return 'OK', data
+        encoded = base64.b64encode(PDF)
+        data = []
+        for uid in uids:
+            data += [(b'1 (UID %s BODY[1] {%d}' % (uid.encode(), len(encoded)), encoded), b')']
+        return 'OK', data
+
+
+@pytest.fixture
+def ingestor(tmp_path):
+    def make(on_job):
+        ingestor = ImapIdleIngestor(on_job=on_job, state_path=str(tmp_path / 'imap.json'), max_retries=2)
+        ingestor.uidvalidity = '1'
+        return ingestor
+    return make
+
+
+def test_sync_marks_only_handed_over_messages_seen(ingestor):
+    jobs = []
+
+    def on_job(job):
+        if job['uid'] == 11:
+            raise RuntimeError("pipeline unavailable")
+        jobs.append(job)
+
+    imap = ingestor(on_job)
+    imap.mail = FakeMail([10, 11, 12])
+    assert imap.sync() == 2
+    assert [job['uid'] for job in jobs] == [10, 12]
+    assert jobs[0]['sender_email'] == 'billing@acme.example' and jobs[0]['payload'] == PDF
+    assert imap.mail.stored == ['10,12']
+    assert imap.last_uid == 12
+    assert imap.retry == {11: {'attempts': 1, 'done': []}}
+
+    # The failed message is fetched again on the next sync even though no new mail arrived
+    imap.on_job = jobs.append
+    imap.mail = FakeMail([])
+    assert imap.sync() == 1
+    assert imap.mail.stored == ['11'] and imap.retry == {}
+
+
+def test_sync_gives_up_after_max_retries(ingestor):
+    def on_job(job):
+        raise RuntimeError("Drive down")
+
+    imap = ingestor(on_job)
+    imap.mail = FakeMail([20])
+    imap.sync()
+    assert imap.retry[20]['attempts'] == 1
+    imap.mail = FakeMail([])
+    imap.sync()
+    assert imap.retry == {} and imap.mail.stored == []
+
+
+def test_retry_state_is_persisted(ingestor):
+    def on_job(job):
+        raise RuntimeError("boom")
+
+    imap = ingestor(on_job)
+    imap.mail = FakeMail([30])
+    imap.sync()
+    reloaded = ImapIdleIngestor(on_job=None, state_path=imap.state_path)
+    assert reloaded.retry == {30: {'attempts': 1, 'done': []}} and reloaded.last_uid == 30
+
+
+def test_run_forever_survives_unexpected_errors(ingestor, monkeypatch):
+    imap = ingestor(lambda job: None)
+    calls = []
+
+    def sync():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ValueError("bad attachment handler")
+        imap.stop()
+
+    monkeypatch.setattr(imap, 'connect', lambda: setattr(imap, 'mail', object()))
+    monkeypatch.setattr(imap, 'sync', sync)
+    monkeypatch.setattr(imap, 'idle', lambda: None)
+    monkeypatch.setattr(imap, 'close', lambda: setattr(imap, 'mail', None))
+    imap.run_forever(reconnect_delay=0)
+    assert len(calls) == 2
+
+
+class FakeSocket:
+    def __init__(self):
+        self.timeout = None
+
+    def gettimeout(self):
+        return self.timeout
+
+    def setblocking(self, flag):
+        self.timeout = None if flag else 0.0
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+
+class IdleMail:
+    """The server sent the IDLE continuation and an EXISTS in one packet, so both are in imaplib's buffer"""
+
+    def __init__(self, data):
+        self.sock = FakeSocket()
+        self.file = io.BufferedReader(io.BytesIO(data))
+        self.sent = []
+
+    def _new_tag(self):
+        return b'A1'
+
+    def send(self, data):
+        self.sent.append(data)
+
+    def readline(self):
+        return self.file.readline()
+
+
+def test_idle_sees_responses_already_buffered(ingestor, monkeypatch):
+    def no_select(*args):
+        raise AssertionError("select() called while a response was buffered")
+
+    monkeypatch.setattr(select, 'select', no_select)
+    imap = ingestor(lambda job: None)
+    imap.mail = IdleMail(b'+ idling\r\n* 4 EXISTS\r\nA1 OK IDLE terminated\r\n')
+    assert imap.idle() is True
+    assert imap.mail.sent == [b'A1 IDLE\r\n', b'DONE\r\n']
+    assert imap.mail.sock.timeout is None
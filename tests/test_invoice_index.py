@@ -0,0 +1,78 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bench.stubs import LocalSupabase
+from agent.invoice_index import InvoiceIndex, within_one_edit
+
+ACME = {"Company Name": "Acme  Traders", "GSTIN": "27AAPFU0939F1ZV", "Total Amount": "1,180.00",
+        "Invoice Date": "2024-05-01"}
+
+
+def invoice(file_id, number, created_at=None, **fields):
+    return {"file_id": file_id, "Invoice Number": number, "created_at": created_at, **ACME, **fields}
+
+
+def test_within_one_edit():
+    assert within_one_edit("INV1001", "INV1002")
+    assert within_one_edit("INV1001", "INV101")
+    assert within_one_edit("INV1001", "INV10011")
+    assert not within_one_edit("INV1001", "INV1012")
+    assert not within_one_edit("INV1001", "INV100123")
+
+
+def test_similar_numbers_one_edit_apart():
+    index = InvoiceIndex(path=None)
+    for file_id, number in [("a", "INV-1001"), ("b", "INV-1002"), ("c", "INV/1001"), ("d", "INV-1101")]:
+        index.add(invoice(file_id, number))
+    # Separators are ignored, so INV/1001 is a respelling of INV-1001
+    assert index.similar_numbers("inv-1001") == ["INV-1002", "INV-1101", "INV/1001"]
+    assert index.similar_numbers("INV-2202") == []
+    assert index.find_duplicates(" inv-1001 ", exclude_file_id="x") == ["a"]
+
+
+def test_find_similar_invoices_matches_the_other_fields():
+    index = InvoiceIndex(path=None)
+    # Amounts come back from Postgres as numbers; they match the extracted text
+    index.add(invoice("stored", "INV-1001", created_at="2024-05-01T10:00:00+00:00", **{"Total Amount": 1180.0}))
+    index.add(invoice("other", "INV-1003", **{"Company Name": "Globex"}))
+    new = invoice("new", "INV-1002")
+    assert index.find_similar_invoices(new, exclude_file_id="new") == ["stored"]
+    assert index.find_similar_invoices({**new, "Total Amount": "1,190.00"}) == []
+    # Only invoices that arrived earlier count when re-validating a stored one
+    assert index.find_similar_invoices(new, before=0) == []
+
+
+def test_replacing_a_record_drops_its_old_number():
+    index = InvoiceIndex(path=None)
+    index.add(invoice("a", "INV-1001"))
+    index.add(invoice("a", "INV-5000"))
+    assert index.similar_numbers("INV-1002") == []
+    assert index.find_duplicates("INV-5000") == ["a"]
+    assert not index.by_variant.get("INV1001")
+
+
+def test_sync_appends_and_reloads(tmp_path):
+    client = LocalSupabase()
+    rows = client.tables.setdefault("extracted_information", [])
+    rows += [invoice("a", "INV-1", "2024-05-01T00:00:00+00:00"), invoice("b", "INV-2", "2024-05-02T00:00:00+00:00"),
+             invoice("undated", "INV-3")]
+    path = str(tmp_path / "index.jsonl")
+    index = InvoiceIndex(client, path=path)
+    # Rows without created_at cannot be placed after the cursor
+    assert index.sync(page_size=1) == 2 and "undated" not in index
+    rows.append(invoice("c", "INV-4", "2024-05-03T00:00:00+00:00"))
+    assert index.sync() == 1
+
+    reloaded = InvoiceIndex(client, path=path)
+    reloaded.load()
+    assert sorted(reloaded.records) == ["a", "b", "c"]
+    assert reloaded.cursor == ("2024-05-03T00:00:00+00:00", "c")
+    assert reloaded.sync() == 0
+
+    # A line cut short by a crash is skipped
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"file_id": "d", "Invoice')
+    truncated = InvoiceIndex(path=path)
+    truncated.load()
+    assert len(truncated) == 3
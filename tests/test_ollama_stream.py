@@ -0,0 +1,47 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from helper.ollama_stream import JsonObjectScanner
+
+
+def scan(*chunks):
+    scanner = JsonObjectScanner()
+    finished = [scanner.feed(chunk) for chunk in chunks]
+    return scanner, finished
+
+
+def test_completes_on_closing_brace_across_chunks():
+    scanner, finished = scan('{"Company', ' Name": "Ac', 'me"', '}', ' and more')
+    assert finished == [False, False, False, True, True]
+    assert scanner.done and scanner.text == '{"Company Name": "Acme"}'
+
+
+def test_drops_fences_and_preamble():
+    scanner, _ = scan('Sure! ```json\n', '{"a": 1}', '\n```')
+    assert scanner.text == '{"a": 1}'
+
+
+def test_braces_and_escaped_quotes_inside_strings():
+    scanner, finished = scan('{"a": "}{ \\"}\\" {", ', '"b": {"c": 1}', '}')
+    assert finished == [False, False, True]
+    assert scanner.text == '{"a": "}{ \\"}\\" {", "b": {"c": 1}}'
+
+
+def test_escape_split_across_chunks():
+    scanner, finished = scan('{"a": "x\\', '"}', '"}')
+    assert finished == [False, False, True]
+    assert scanner.text == '{"a": "x\\"}"}'
+
+
+def test_unfinished_object_tracks_state():
+    scanner, finished = scan('{"a": {"b": "unterminated')
+    assert finished == [False]
+    assert not scanner.done and scanner.depth == 2 and scanner.in_string
+    assert scanner.text == '{"a": {"b": "unterminated'
+
+
+def test_no_object_started():
+    scanner, finished = scan('"a": 1}', 'still nothing')
+    assert finished == [False, False]
+    assert not scanner.started and scanner.text == ''
@@ -0,0 +1,103 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+from agent.rules import (
+    check_gstin, check_taxes, check_total_amount, effective_rates, get_validator, gstin_check_character, parse_taxes,
+)
+
+VALID_INVOICE = {
+    'Company Name': 'Acme Traders', 'Invoice Number': 'INV-42', 'Invoice Date': '2024-05-01',
+    'Total Amount': '1,180.00', 'GSTIN': '27AAPFU0939F1ZV', 'Customer Name': 'Globex',
+    'Taxes': 'CGST @9%: 90.00, SGST @9%: 90.00',
+}
+
+
+@pytest.mark.parametrize("gstin, check", [
+    ('27AAPFU0939F1ZV', 'V'),
+    ('29AAGCB7383J1Z4', '4'),
+])
+def test_gstin_check_character_known_good(gstin, check):
+    assert gstin_check_character(gstin[:14]) == check
+    assert check_gstin(gstin) is None
+
+
+def test_gstin_check_character_rejects_altered_ids():
+    # Any single changed character breaks the checksum
+    assert check_gstin('27AAPFU0939F1ZW') == "GSTIN checksum is invalid"
+    assert check_gstin('27AAPFU0938F1ZV') == "GSTIN checksum is invalid"
+    assert check_gstin('28AAPFU0939F1ZV') == "GSTIN checksum is invalid"
+    assert check_gstin('27 aapfu 0939 f1zv') is None
+    assert check_gstin('27AAPFU0939F1V') == "GSTIN format is invalid (should be 15 characters)"
+
+
+def test_parse_taxes_free_text():
+    rates, amount = parse_taxes('CGST @9%: 450.00, SGST @9%: 450.00')
+    assert rates == [('CGST @9%: 450.00', 9.0), (' SGST @9%: 450.00', 9.0)]
+    assert amount == 900.0
+    # Indian digit grouping keeps its commas inside the amount
+    assert parse_taxes('IGST 18%: 1,23,456.50')[1] == 123456.5
+
+
+def test_parse_taxes_dict_and_json():
+    rates, amount = parse_taxes({'CGST 9%': 45, 'SGST 9%': 45})
+    assert rates == [('CGST 9%', 9.0), ('SGST 9%', 9.0)] and amount == 90.0
+    rates, amount = parse_taxes('{"IGST": "18%", "Tax amount": "1,800.00"}')
+    assert rates == [('IGST', 18.0)] and amount == 1800.0
+    assert parse_taxes('GST included') == ([], None)
+
+
+def test_effective_rates():
+    assert effective_rates([('CGST', 9.0), ('SGST', 9.0)]) == [18.0]
+    assert effective_rates([('CGST', 2.5), ('UTGST', 2.5), ('IGST', 12.0)]) == [5.0, 12.0]
+    # A lone CGST is not doubled
+    assert effective_rates([('CGST', 9.0)]) == [9.0]
+
+
+def test_check_taxes():
+    assert check_taxes('CGST @9%, SGST @9%', '1180') is None
+    assert check_taxes('IGST @7%', '1070') == "Tax rate 7% is not one of 5%/12%/18%"
+    # No printed rate: 180 on 1000 is 18%
+    assert check_taxes('Tax: 180.00', '1180.00') is None
+    assert check_taxes('Tax: 100.00', '1180.00').startswith("Implied tax rate")
+    assert check_taxes(None, '100') == "Tax information is missing"
+
+
+@pytest.mark.parametrize("taxes", ['18', 18, 12.0, ' 5 ', '18%'])
+def test_check_taxes_bare_rate(taxes):
+    # A bare valid rate is not a tax amount of 18 on a total of 1180 (an implied 1.5%)
+    assert parse_taxes(taxes) == ([('', float(str(taxes).strip().rstrip('%')))], None)
+    assert check_taxes(taxes, '1180') is None
+
+
+def test_check_taxes_bare_amount_still_implies_rate():
+    assert check_taxes('180', '1180') is None
+    assert check_taxes('100', '1180').startswith("Implied tax rate")
+
+
+@pytest.mark.parametrize("total", ['1,180.00', 1180, 'INR 99.50'])
+def test_check_total_amount_accepts_positive(total):
+    assert check_total_amount(total) is None
+
+
+@pytest.mark.parametrize("total, message", [
+    ('-5', "Total Amount is negative"),
+    (-5, "Total Amount is negative"),
+    ('Rs. -1,200.00', "Total Amount is negative"),
+    ('(1,200.00)', "Total Amount is negative"),
+    ('0.00', "Total Amount is zero or missing"),
+    (None, "Total Amount is zero or missing"),
+    ('n/a', "Total Amount is not a number"),
+])
+def test_check_total_amount_rejects_non_positive(total, message):
+    assert check_total_amount(total) == message
+
+
+def test_validator_reports_missing_invoice_date():
+    assert get_validator().validate(VALID_INVOICE) == (True, "Invoice validation passed")
+    is_valid, reason = get_validator().validate(dict(VALID_INVOICE, **{'Invoice Date': None}))
+    assert not is_valid
+    assert reason == ("Missing required fields: Invoice Date. "
+                      "Validation issues: Invoice Date is missing")
@@ -0,0 +1,51 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+from ocr.structured_output import parse_response, repair_json
+
+
+def test_repair_closes_unterminated_string_and_braces():
+    assert repair_json('{"Company Name": "Acme Tra') == {"Company Name": "Acme Tra"}
+    assert repair_json('{"Taxes": {"CGST": 45.0, "SGST": 45') == {"Taxes": {"CGST": 45.0, "SGST": 45}}
+
+
+def test_repair_unterminated_string_ending_in_backslash():
+    assert repair_json('{"Address": "Unit 4\\') == {"Address": "Unit 4"}
+
+
+def test_repair_drops_trailing_commas():
+    assert repair_json('{"a": 1, "b": [1, 2,],}') == {"a": 1, "b": [1, 2]}
+    # A comma left dangling where the output was cut off
+    assert repair_json('{"a": 1, "b": 2,') == {"a": 1, "b": 2}
+
+
+def test_repair_maps_python_literals():
+    assert repair_json('{"PAN": None, "paid": True, "flagged": False}') == {"PAN": None, "paid": True,
+                                                                          "flagged": False}
+    # Only bare literals are mapped, not words inside strings
+    assert repair_json('{"note": "None of the above", "x": None}') == {"note": "None of the above", "x": None}
+
+
+def test_repair_strips_fences_and_commentary():
+    text = 'Here is the JSON:\n```json\n{"Invoice Number": "INV-1", "Total Amount": 10.5,}\n```\nLet me know!'
+    assert repair_json(text) == {"Invoice Number": "INV-1", "Total Amount": 10.5}
+    # Braces inside strings do not end the object early
+    assert repair_json('```\n{"a": "}{", "b": 2}\n``` trailing {"c": 3}') == {"a": "}{", "b": 2}
+
+
+def test_repair_adds_missing_opening_brace():
+    assert repair_json('"Company Name": "Acme", "GSTIN": null}') == {"Company Name": "Acme", "GSTIN": None}
+
+
+@pytest.mark.parametrize("text", ['', 'no json here', '[1, 2, 3]', '{"a": 1 "b": 2}'])
+def test_repair_gives_up_on_unrecoverable_text(text):
+    assert repair_json(text) is None
+
+
+def test_parse_response_reports_repairs():
+    assert parse_response('{"a": 1}') == ({"a": 1}, False)
+    assert parse_response('{"a": 1,}') == ({"a": 1}, True)
+    assert parse_response('nothing') == (None, False)
@@ -0,0 +1,120 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+from bench.stubs import LocalSupabase
+from helper.write_behind import UPDATE_KEYS_PER_REQUEST, WriteBehindBuffer, check_upsert_key
+
+
+@pytest.fixture
+def make_buffer():
+    buffers = []
+
+    def make(client, **kwargs):
+        # Nothing flushes on its own; the tests call flush()
+        kwargs = {"max_rows": 10_000, "max_delay": 3600, "retry_backoff": 0, **kwargs}
+        buffer = WriteBehindBuffer(client, "extracted_information", **kwargs)
+        buffers.append(buffer)
+        return buffer
+
+    yield make
+    for buffer in buffers:
+        buffer.close()
+
+
+def recorder():
+    results = []
+    return results, lambda table, key, ok, error: results.append((key, ok))
+
+
+def test_update_merges_into_pending_insert(make_buffer):
+    client = LocalSupabase()
+    buffer = make_buffer(client)
+    results, callback = recorder()
+    buffer.add({"file_id": "a", "Invoice Number": "INV-1", "flagged": None}, callback)
+    buffer.add({"file_id": "a", "flagged": True, "visited": True}, callback, update=True)
+    buffer.flush()
+    rows = client.tables["extracted_information"]
+    assert len(rows) == 1 and client.requests == 1
+    assert rows[0]["Invoice Number"] == "INV-1" and rows[0]["flagged"] is True and rows[0]["visited"] is True
+    # Both callbacks for the key hear about the one write
+    assert results == [("a", True), ("a", True)]
+
+
+def test_update_without_pending_insert_does_not_create_a_row(make_buffer):
+    client = LocalSupabase()
+    client.tables["extracted_information"] = [{"file_id": "stored", "flagged": False}]
+    buffer = make_buffer(client)
+    results, callback = recorder()
+    buffer.add({"file_id": "stored", "flagged": True}, callback, update=True)
+    buffer.add({"file_id": "deleted", "flagged": True}, callback, update=True)
+    buffer.flush()
+    assert client.tables["extracted_information"] == [{"file_id": "stored", "flagged": True}]
+    # Rows setting the same values share one UPDATE
+    assert client.requests == 1
+    assert sorted(results) == [("deleted", True), ("stored", True)]
+
+
+def test_updates_grouped_by_values_and_split_by_key_count(make_buffer):
+    client = LocalSupabase()
+    count = UPDATE_KEYS_PER_REQUEST * 2 + 50
+    client.tables["extracted_information"] = [{"file_id": f"f{i:04}"} for i in range(count + 3)]
+    buffer = make_buffer(client)
+    for i in range(count):
+        buffer.add({"file_id": f"f{i:04}", "flagged": True, "visited": True}, update=True)
+    for i in range(count, count + 3):
+        buffer.add({"file_id": f"f{i:04}", "flagged": False, "visited": True}, update=True)
+    buffer.flush()
+    assert client.requests == 3 + 1
+    assert buffer.stats() == {"pending": 0, "written": count + 3, "failed": 0, "batches": 4}
+    flagged = [row["flagged"] for row in client.tables["extracted_information"]]
+    assert flagged == [True] * count + [False] * 3
+
+
+def test_inserts_grouped_by_column_set(make_buffer):
+    client = LocalSupabase()
+    buffer = make_buffer(client)
+    buffer.add({"file_id": "a", "Taxes": "18"})
+    buffer.add({"file_id": "b", "Taxes": "12"})
+    buffer.add({"file_id": "c", "Taxes": "5", "PAN": "AAPFU0939F"})
+    buffer.flush()
+    # PostgREST bulk upserts need the same columns in every row
+    assert client.requests == 2
+    assert sorted(row["file_id"] for row in client.tables["extracted_information"]) == ["a", "b", "c"]
+
+
+class MissingConstraint(Exception):
+    code = "42P10"
+
+
+class RejectingClient:
+    """Every upsert fails as it does when the ON CONFLICT column has no unique constraint"""
+
+    def __init__(self):
+        self.requests = 0
+
+    def table(self, name):
+        return self
+
+    def upsert(self, rows, on_conflict="id"):
+        return self
+
+    def execute(self):
+        self.requests += 1
+        raise MissingConstraint("there is no unique or exclusion constraint matching the ON CONFLICT specification")
+
+
+def test_missing_conflict_constraint_fails_fast(make_buffer):
+    client = RejectingClient()
+    with pytest.raises(RuntimeError, match="unique constraint on file_id"):
+        check_upsert_key(client, "invoice_db")
+    buffer = make_buffer(client)
+    results, callback = recorder()
+    for key in "abc":
+        buffer.add({"file_id": key}, callback)
+    buffer.flush()
+    # No retries and no row-by-row fallback
+    assert client.requests == 2
+    assert results == [("a", False), ("b", False), ("c", False)]
@@ -0,0 +1,331 @@
+# change_watcher.py
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import hashlib
+import json
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from dotenv import load_dotenv
+from helper.clients import get_drive
+from helper import metrics
+
+load_dotenv()
+
+WATCHER_STATE_PATH = os.getenv('WATCHER_STATE_PATH', os.path.join('.cache', 'drive_watcher_state.json'))
+WATCHER_DOWNLOAD_DIR = os.getenv('WATCHER_DOWNLOAD_DIR', os.path.join(tempfile.gettempdir(), 'invoice_downloads'))
+WATCHER_DOWNLOAD_WORKERS = int(os.getenv('WATCHER_DOWNLOAD_WORKERS', '4'))
+WATCHER_CHUNK_SIZE = int(float(os.getenv('WATCHER_CHUNK_MB', '1')) * 1024 * 1024)
+# Polls a file whose download keeps failing is retried on before it is given up
+WATCHER_MAX_RETRIES = int(os.getenv('WATCHER_MAX_RETRIES', '5'))
+
+# Only the metadata the pipeline needs, to keep listing and change responses small
+FILE_FIELDS = 'id,title,mimeType,md5Checksum,fileSize,modifiedDate,parents/id,labels/trashed'
+
+
+class DriveChangesBackend:
+    """Drive v2 changes feed for one folder, with per-thread HTTP connections for parallel downloads"""
+
+    def __init__(self, folder_id, drive=None):
+        self._drive = drive
+        self.folder_id = folder_id
+        self._local = threading.local()
+
+    @property
+    def drive(self):
+        # Resolved on first use so constructing the watcher does not trigger OAuth
+        return self._drive or get_drive()
+
+    @property
+    def service(self):
+        return self.drive.auth.service
+
+    def _http(self):
+        # httplib2 connections are not thread-safe, so every download thread gets its own
+        if not hasattr(self._local, 'http'):
+            import httplib2
+            self._local.http = self.drive.auth.credentials.authorize(httplib2.Http())
+        return self._local.http
+
+    def start_token(self):
+        return self.service.changes().getStartPageToken().execute()['startPageToken']
+
+    def list_folder(self):
+        """Every file currently in the folder, used once to seed the watcher"""
+        request = self.service.files().list(
+            q=f"'{self.folder_id}' in parents and trashed=false",
+            fields=f'nextPageToken,items({FILE_FIELDS})',
+            maxResults=1000,
+        )
+        while request is not None:
+            response = request.execute()
+            for item in response.get('items', []):
+                yield self._describe(item)
+            request = self.service.files().list_next(request, response)
+
+    def changes(self, token):
+        """Return (files added or modified in the folder since `token`, new token)"""
+        files = []
+        while True:
+            response = self.service.changes().list(
+                pageToken=token,
+                spaces='drive',
+                includeDeleted=False,
+                maxResults=1000,
+                fields=f'nextPageToken,newStartPageToken,items(fileId,deleted,file({FILE_FIELDS}))',
+            ).execute()
+            for change in response.get('items', []):
+                item = change.get('file')
+                if change.get('deleted') or not item or item.get('labels', {}).get('trashed'):
+                    continue
+                if self.folder_id not in {parent.get('id') for parent in item.get('parents', [])}:
+                    continue
+                files.append(self._describe(item))
+            if 'newStartPageToken' in response:
+                return files, response['newStartPageToken']
+            token = response['nextPageToken']
+
+    def watch(self, address, channel_id, token=None, ttl_seconds=86400):
+        """Ask Drive to POST a notification to `address` whenever the changes feed moves"""
+        body = {
+            'id': channel_id,
+            'type': 'web_hook',
+            'address': address,
+            'expiration': int((time.time() + ttl_seconds) * 1000),
+        }
+        if token:
+            body['token'] = token
+        return self.service.changes().watch(body=body, pageToken=self.start_token()).execute()
+
+    def download(self, file, stream, chunk_size):
+        from googleapiclient.http import MediaIoBaseDownload
+
+        request = self.service.files().get_media(fileId=file['id'])
+        request.http = self._http()
+        downloader = MediaIoBaseDownload(stream, request, chunksize=chunk_size)
+        done = False
+        while not done:
+            _, done = downloader.next_chunk()
+
+    @staticmethod
+    def _describe(item):
+        return {
+            'id': item['id'],
+            'title': item.get('title', item['id']),
+            'mime_type': item.get('mimeType'),
+            'modified': item.get('modifiedDate'),
+            'size': int(item.get('fileSize') or 0),
+        }
+
+
+class LocalFolderBackend:
+    """
+    Filesystem stand-in for DriveChangesBackend, for offline runs and benchmarks.
+
+    File IDs are paths relative to the root, and the change token is the newest
+    modification time (in nanoseconds) already reported.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _scan(self):
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                stat = os.stat(path)
+                yield stat.st_mtime_ns, {
+                    'id': os.path.relpath(path, self.root),
+                    'title': name,
+                    'mime_type': None,
+                    'modified': stat.st_mtime_ns,
+                    'size': stat.st_size,
+                }
+
+    def start_token(self):
+        return str(max((mtime for mtime, _ in self._scan()), default=0))
+
+    def list_folder(self):
+        return [file for _, file in self._scan()]
+
+    def changes(self, token):
+        since = int(token)
+        files, newest = [], since
+        for mtime, file in self._scan():
+            if mtime > since:
+                files.append(file)
+                newest = max(newest, mtime)
+        return files, str(newest)
+
+    def download(self, file, stream, chunk_size):
+        with open(os.path.join(self.root, file['id']), 'rb') as source:
+            shutil.copyfileobj(source, stream, chunk_size)
+
+
+class ChangeWatcher:
+    """
+    Stream every new or changed file in a watched folder since the last poll.
+
+    The backend's change token is persisted, so each poll only asks for what
+    changed. Files are downloaded concurrently, in chunks, to paths named after
+    the SHA-256 of their content; identical uploads share one file, which is
+    deleted once every job using it has called `release`. Files whose download
+    failed are persisted with the token and retried on the next poll.
+    """
+
+    def __init__(self, backend, download_dir=WATCHER_DOWNLOAD_DIR, state_path=WATCHER_STATE_PATH,
+                 workers=WATCHER_DOWNLOAD_WORKERS, chunk_size=WATCHER_CHUNK_SIZE, max_retries=WATCHER_MAX_RETRIES):
+        self.backend = backend
+        self.download_dir = download_dir
+        self.state_path = state_path
+        self.workers = max(1, workers)
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.token, self.retry = self._load_state()
+        self._refs = {}
+        self._refs_lock = threading.Lock()
+        os.makedirs(download_dir, exist_ok=True)
+
+    def _load_state(self):
+        if self.state_path and os.path.exists(self.state_path):
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            return state.get('token'), {file['id']: file for file in state.get('retry', [])}
+        return None, {}
+
+    def _save_state(self):
+        if not self.state_path:
+            return
+        directory = os.path.dirname(self.state_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.state_path, 'w', encoding='utf-8') as f:
+            json.dump({'token': self.token, 'retry': list(self.retry.values())}, f)
+
+    def poll(self, skip=None, on_failure=None):
+        """
+        Yield {"file_id", "title", "mime_type", "modified", "filepath"} for each changed file.
+
+        `skip(file_id)` can veto files before they are downloaded. At most
+        `workers` files are downloaded ahead of the consumer, so a saturated
+        pipeline pauses the downloads too. A failed download is kept for the
+        next poll and reported to `on_failure(file_id)`, so a claim taken in
+        `skip` can be dropped. The new token is saved only after the whole
+        batch has been yielded, so an interrupted poll is replayed rather than lost.
+        """
+        with metrics.span("drive.changes"):
+            if self.token is None:
+                # Take the token before listing so changes made during the listing are not missed
+                new_token = self.backend.start_token()
+                files = list(self.backend.list_folder())
+            else:
+                files, new_token = self.backend.changes(self.token)
+        # Earlier failures first; a newer change to the same file replaces the retry
+        pending = dict(self.retry)
+        pending.update({file['id']: file for file in files})
+        files = list(pending.values())
+        if skip:
+            files = [file for file in files if not skip(file['id'])]
+
+        failed = {}
+        if files:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='drive-download') as executor:
+                remaining = iter(files)
+                running = {}
+
+                def submit_next():
+                    file = next(remaining, None)
+                    if file is not None:
+                        running[executor.submit(self._download, file)] = file
+
+                for _ in range(self.workers):
+                    submit_next()
+                try:
+                    while running:
+                        done, _ = wait(running, return_when=FIRST_COMPLETED)
+                        future = next(iter(done))
+                        file = running.pop(future)
+                        try:
+                            filepath = future.result()
+                        except Exception as e:
+                            attempts = file.get('attempts', 0) + 1
+                            if attempts < self.max_retries:
+                                print(f"[Watcher] Failed to download {file['title']} ({file['id']}), "
+                                      f"retrying next poll: {e}")
+                                failed[file['id']] = dict(file, attempts=attempts)
+                            else:
+                                print(f"[Watcher] Giving up on {file['title']} ({file['id']}) "
+                                      f"after {attempts} attempts: {e}")
+                            if on_failure:
+                                on_failure(file['id'])
+                            submit_next()
+                            continue
+                        # The next download starts only when the consumer asks for another file
+                        yield {
+                            'file_id': file['id'],
+                            'title': file['title'],
+                            'mime_type': file['mime_type'],
+                            'modified': file['modified'],
+                            'filepath': filepath,
+                        }
+                        submit_next()
+                finally:
+                    # Closed early: drop downloads nobody will consume; the unsaved token replays them
+                    for future in running:
+                        future.cancel()
+                    for future in running:
+                        if not future.cancelled() and future.exception() is None:
+                            self.release(future.result())
+
+        self.token = new_token
+        self.retry = failed
+        self._save_state()
+
+    def _download(self, file):
+        _, ext = os.path.splitext(file['title'])
+        tmp_path = os.path.join(self.download_dir, f".{uuid.uuid4().hex}.part")
+        digest = hashlib.sha256()
+        try:
+            with open(tmp_path, 'wb') as stream, metrics.span("drive.download", file_id=file['id']):
+                self.backend.download(file, _HashingWriter(stream, digest), self.chunk_size)
+            path = os.path.join(self.download_dir, f"{digest.hexdigest()}{ext.lower()}")
+            with self._refs_lock:
+                if self._refs.get(path):
+                    os.remove(tmp_path)
+                else:
+                    os.replace(tmp_path, path)
+                self._refs[path] = self._refs.get(path, 0) + 1
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        print(f"[Watcher] Downloaded {file['title']} to {path}")
+        return path
+
+    def release(self, path):
+        """Drop one reference to a downloaded file, deleting it when no job needs it anymore"""
+        with self._refs_lock:
+            remaining = self._refs.get(path, 1) - 1
+            if remaining > 0:
+                self._refs[path] = remaining
+                return
+            self._refs.pop(path, None)
+            # Under the lock, so a concurrent download of the same content cannot be deleted after its replace
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class _HashingWriter:
+    """File wrapper that hashes everything written through it"""
+
+    def __init__(self, stream, digest):
+        self.stream = stream
+        self.digest = digest
+
+    def write(self, data):
+        self.digest.update(data)
+        return self.stream.write(data)
@@ -1,19 +1,16 @@
 # file_watcher.py
-from pydrive.auth import GoogleAuth
-from pydrive.drive import GoogleDrive
-import tempfile
+import sys
 import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import tempfile
 from dotenv import load_dotenv
-
-gauth = GoogleAuth(settings_file="settings.yaml")
-gauth.LocalWebserverAuth()
-drive = GoogleDrive(gauth)
+from helper.clients import get_drive
 
 load_dotenv()
 FOLDER_ID = os.getenv('DRIVE_FOLDER_ID')
 
 def get_latest_file_in_folder(folder_id=FOLDER_ID):
-    file_list = drive.ListFile({
+    file_list = get_drive().ListFile({
         'q': f"'{folder_id}' in parents and trashed=false",
         'orderBy': 'modifiedDate desc'
     }).GetList()
@@ -34,6 +31,27 @@ def get_latest_file_in_folder(folder_id=FOLDER_ID):
         print("No files found in the folder.")
         return None, None
 
+def list_files_in_folder(folder_id=FOLDER_ID):
+    """Return metadata for every non-trashed file in the folder, newest first"""
+    return get_drive().ListFile({
+        'q': f"'{folder_id}' in parents and trashed=false",
+        'orderBy': 'modifiedDate desc'
+    }).GetList()
+
+def get_file(file_id):
+    """Return a Drive file by ID with the metadata download_file needs"""
+    drive_file = get_drive().CreateFile({'id': file_id})
+    drive_file.FetchMetadata(fields='id,title,mimeType')
+    return drive_file
+
+def download_file(drive_file):
+    """Download a Drive file to a temp path unique to its file ID and return the path"""
+    temp_dir = tempfile.gettempdir()
+    temp_path = os.path.join(temp_dir, f"{drive_file['id']}_{drive_file['title']}")
+    drive_file.GetContentFile(temp_path)
+    print(f"[Downloaded] {drive_file['title']} to temp path: {temp_path}")
+    return temp_path
+
 if __name__ == "__main__":
     filepath, file_id = get_latest_file_in_folder()
     if filepath: